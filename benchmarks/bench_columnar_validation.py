@@ -0,0 +1,82 @@
+"""Benchmark of the columnar validation of large imports.
+
+Compares validating records one by one with the compiled validation engine
+and validating the same rows as NumPy columns.
+
+Usage:
+    $ Environment=test python benchmarks/bench_columnar_validation.py
+"""
+
+import argparse
+import sys
+import timeit
+
+import numpy
+
+from timed_release.validation import columnar
+from timed_release.validation import engine
+from timed_release.validation import validators
+
+
+def create_columns(count):
+    """Create typed columns, one row in a hundred being invalid."""
+    rows = numpy.arange(count)
+    product_ids = rows + 1
+    product_ids[::100] = -1
+    times = numpy.char.add(numpy.char.add(
+        numpy.char.zfill((rows % 24).astype(str), 2), ':30:'),
+        numpy.char.zfill((rows % 60).astype(str), 2))
+    time_zones = numpy.where(rows % 2, 'GMT', 'local')
+    store_ids = rows % 300 + 1
+    return {
+        'product_id': product_ids,
+        'time_of_day_product': times,
+        'time_zone': time_zones,
+        'store_id': store_ids}
+
+
+def to_records(columns):
+    """Turn columns into records."""
+    fields = list(columns)
+    values = [columns[field].tolist() for field in fields]
+    return [dict(zip(fields, row)) for row in zip(*values)]
+
+
+def main(argv=None):
+    """Run the benchmark.
+
+    Returns:
+        int: 0.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    arguments = parser.parse_args(argv)
+
+    required_fields = validators.TIMED_RELEASE_REQUIRED_FIELDS
+    columns = create_columns(arguments.rows)
+    records = to_records(columns)
+    validate = engine.compile_rules(required_fields)
+
+    row_errors = columnar.validate_columns(
+        columns, required_fields, check_duplicates=False)
+    assert [
+        columnar.describe_errors(row_error, required_fields)
+        for row_error in row_errors.tolist()] == [
+            validate(record) for record in records]
+
+    records_time = min(timeit.repeat(
+        lambda: [validate(record) for record in records],
+        number=1, repeat=arguments.repeat))
+    columns_time = min(timeit.repeat(
+        lambda: columnar.validate_columns(columns, required_fields),
+        number=1, repeat=arguments.repeat))
+
+    print('records: {:.1f} ms'.format(records_time * 1e3))
+    print('columns: {:.1f} ms'.format(columns_time * 1e3))
+    print('speedup: {:.1f}x'.format(records_time / columns_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,407 @@
+"""Benchmark of the product CRUD hot paths on a large seeded table.
+
+Seeds a product_live_time table with synthetic products (10k, 1M or 10M
+rows), then measures reading, creating, updating and deleting products,
+through the model functions and through the WSGI application: GET, POST,
+PUT and DELETE requests of the Flask test client. The product cache is
+disabled so that every read hits the database.
+
+Each operation is reported with its p50, p95 and p99 latencies and its
+throughput. With `--baseline`, the results are compared with the ones of
+the same row count stored in the baseline file, and the benchmark fails
+when an operation is slower than the tolerance allows, or when the file has
+no baseline of the row count; `--save-baseline` stores the results instead.
+Baselines only compare runs of one machine: `baselines/crud.json` holds the
+10k baseline of the seeded dataset, to save again on the machine running
+the comparison.
+
+The database defaults to a SQLite file in the temporary directory, seeded
+once per row count and reused by the next runs; seeding 10M rows takes
+several minutes. `--database` benchmarks another database, such as a local
+MySQL, the table being dropped and seeded again when its rows do not match.
+
+Usage:
+    $ Environment=test python benchmarks/bench_crud.py --rows 10k
+    $ Environment=test python benchmarks/bench_crud.py --rows 10k \
+        --baseline benchmarks/baselines/crud.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from timed_release import config
+from timed_release.connectors import sql
+from timed_release.handlers import app
+from timed_release.models import product_live_time
+
+
+ROW_COUNTS = {'10k': 10000, '1M': 1000000, '10M': 10000000}
+
+# Rows inserted by each executemany while seeding
+SEED_CHUNK_SIZE = 10000
+
+# Operations measured, in the order they run: products created by a post
+# are deleted by the delete of the same layer.
+OPERATIONS = (
+    'model.get', 'model.update', 'model.post', 'model.delete',
+    'wsgi.get', 'wsgi.update', 'wsgi.post', 'wsgi.delete')
+
+_table = product_live_time.ProductLiveTime.__table__
+
+
+def parse_row_count(value):
+    """Parse a row count, either a number or one of `ROW_COUNTS`.
+
+    Args:
+        value (str): Row count, such as `10000` or `10k`.
+
+    Returns:
+        int: The row count.
+    """
+    if value in ROW_COUNTS:
+        return ROW_COUNTS[value]
+    try:
+        row_count = int(value)
+    except ValueError:
+        row_count = 0
+    if row_count <= 0:
+        raise argparse.ArgumentTypeError(
+            'expected a positive number or one of {}'.format(
+                ', '.join(ROW_COUNTS)))
+    return row_count
+
+
+def generate_rows(row_count, seed):
+    """Generate synthetic product live times.
+
+    The same seed always generates the same rows.
+
+    Args:
+        row_count (int): Number of products, with ids 1 to `row_count`.
+        seed (int): Seed of the random generator.
+
+    Yields:
+        dict: Column values of a product.
+    """
+    rng = random.Random(seed)
+    for product_id in range(1, row_count + 1):
+        seconds = rng.randrange(24 * 60 * 60)
+        yield {
+            'product_id': product_id,
+            'time_of_day_product': datetime.time(
+                seconds // 3600, seconds // 60 % 60, seconds % 60),
+            'time_zone': rng.choice(config.TIME_ZONES),
+            # A tenth of the products do not belong to a store.
+            'store_id': rng.randrange(1, 1001) if rng.random() < 0.9 else None
+        }
+
+
+def seed(engine, row_count, seed_value):
+    """Seed the product_live_time table, unless it already holds the rows.
+
+    Products left above `row_count` by an interrupted run are deleted.
+
+    Args:
+        engine (Engine): Engine of the database.
+        row_count (int): Number of products.
+        seed_value (int): Seed of the random generator.
+
+    Returns:
+        bool: Whether the table was seeded.
+    """
+    sql.base_model.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(
+            _table.delete().where(_table.c.product_id > row_count))
+        count, max_product_id = connection.execute(select([
+            func.count(), func.max(_table.c.product_id)])).first()
+    if count == row_count and max_product_id == row_count:
+        return False
+
+    _table.drop(engine)
+    _table.create(engine)
+    sqlite = engine.dialect.name == 'sqlite'
+    with engine.connect() as connection:
+        if sqlite:
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('PRAGMA journal_mode = OFF')
+        chunk = []
+        for row in generate_rows(row_count, seed_value):
+            chunk.append(row)
+            if len(chunk) == SEED_CHUNK_SIZE:
+                _insert_chunk(connection, chunk)
+                chunk = []
+        if chunk:
+            _insert_chunk(connection, chunk)
+        if sqlite:
+            connection.execute('PRAGMA journal_mode = DELETE')
+            connection.execute('PRAGMA synchronous = FULL')
+            connection.execute('ANALYZE')
+    return True
+
+
+def _insert_chunk(connection, rows):
+    """Insert rows in their own transaction."""
+    with connection.begin():
+        connection.execute(product_live_time._insert_product, rows)
+
+
+def percentile(sorted_values, percent):
+    """Get a percentile of sorted values, by the nearest rank method.
+
+    Args:
+        sorted_values (list): Values, in ascending order.
+        percent (float): Percentile, between 0 and 100.
+
+    Returns:
+        float: The value at the percentile.
+    """
+    rank = max(int(-(-percent * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+
+def measure(operation, arguments, warmup):
+    """Measure the latency of each call of an operation.
+
+    Args:
+        operation (func): Operation, failing on errors.
+        arguments (list): Argument of each call.
+        warmup (int): Calls run first, and not measured.
+
+    Returns:
+        dict: p50, p95 and p99 latencies in microseconds, and calls per
+        second.
+    """
+    for argument in arguments[:warmup]:
+        operation(argument)
+
+    latencies = []
+    started = time.perf_counter()
+    for argument in arguments[warmup:]:
+        call_started = time.perf_counter()
+        operation(argument)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+        'p95_us': round(percentile(latencies, 95) * 1e6, 1),
+        'p99_us': round(percentile(latencies, 99) * 1e6, 1),
+        'ops_per_second': round(len(latencies) / elapsed, 1)}
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline.
+
+    An operation regresses when its throughput is lower, or its p95 latency
+    higher, than the baseline by more than the tolerance.
+
+    Args:
+        results (dict): Measures keyed by operation.
+        baseline (dict): Measures of the baseline keyed by operation.
+        tolerance (float): Fraction of the baseline allowed, 0.2 for 20%.
+
+    Returns:
+        list: Description of each regression.
+    """
+    regressions = []
+    for operation, expected in sorted(baseline.items()):
+        measured = results.get(operation)
+        if measured is None:
+            continue
+        if measured['ops_per_second'] < \
+                expected['ops_per_second'] * (1 - tolerance):
+            regressions.append('{}: {:.0f} ops/s, baseline {:.0f}'.format(
+                operation, measured['ops_per_second'],
+                expected['ops_per_second']))
+        if measured['p95_us'] > expected['p95_us'] * (1 + tolerance):
+            regressions.append('{}: p95 {:.0f} us, baseline {:.0f}'.format(
+                operation, measured['p95_us'], expected['p95_us']))
+    return regressions
+
+
+def _check(result):
+    """Fail on an error response of the model."""
+    if not result:
+        raise RuntimeError('{} {}'.format(result.status, result.errors))
+
+
+def _check_request(flask_response):
+    """Fail on an error response of the application."""
+    if flask_response.status_code >= 400:
+        raise RuntimeError('{} {}'.format(
+            flask_response.status_code, flask_response.get_data(True)))
+
+
+def _product_json(product_id, time_zone):
+    """Get the body of a product written through the application."""
+    return json.dumps({
+        'product_id': product_id, 'time_of_day_product': '10:30:00',
+        'time_zone': time_zone, 'store_id': 1})
+
+
+def run(row_count, calls, warmup, seed_value):
+    """Measure every operation on a seeded table.
+
+    Args:
+        row_count (int): Number of seeded products.
+        calls (int): Calls of each operation, warmup included.
+        warmup (int): Calls of each operation not measured.
+        seed_value (int): Seed of the random generator.
+
+    Returns:
+        dict: Measures keyed by operation.
+    """
+    rng = random.Random(seed_value)
+    client = app.test_client()
+    time_zones = config.TIME_ZONES
+
+    def existing_ids():
+        return [rng.randrange(1, row_count + 1) for _ in range(calls)]
+
+    model_ids = list(range(row_count + 1, row_count + calls + 1))
+    wsgi_ids = list(range(
+        row_count + calls + 1, row_count + 2 * calls + 1))
+    benchmarks = {
+        'model.get': (
+            lambda product_id: _check(
+                product_live_time.get_product_live_time_details(product_id)),
+            existing_ids()),
+        'model.update': (
+            lambda product_id: _check(
+                product_live_time.update_product_live_time_details(
+                    product_id,
+                    {'time_zone': time_zones[product_id % len(time_zones)]})),
+            existing_ids()),
+        'model.post': (
+            lambda product_id: _check(
+                product_live_time.create_product_live_time_details(
+                    product_id, '10:30:00', 'GMT', 1)),
+            model_ids),
+        'model.delete': (
+            lambda product_id: _check(
+                product_live_time.delete_product_live_time_details(
+                    product_id)),
+            model_ids),
+        'wsgi.get': (
+            lambda product_id: _check_request(
+                client.get('/product/{}'.format(product_id))),
+            existing_ids()),
+        'wsgi.update': (
+            lambda product_id: _check_request(client.put(
+                '/product/{}'.format(product_id),
+                data=_product_json(
+                    product_id, time_zones[product_id % len(time_zones)]),
+                content_type='application/json')),
+            existing_ids()),
+        'wsgi.post': (
+            lambda product_id: _check_request(client.post(
+                '/product', data=_product_json(product_id, 'GMT'),
+                content_type='application/json')),
+            wsgi_ids),
+        'wsgi.delete': (
+            lambda product_id: _check_request(
+                client.delete('/product/{}'.format(product_id))),
+            wsgi_ids)}
+
+    return {
+        operation: measure(
+            benchmarks[operation][0], benchmarks[operation][1], warmup)
+        for operation in OPERATIONS}
+
+
+def main(argv=None):
+    """Run the benchmark.
+
+    Returns:
+        int: 0, 1 when an operation regressed from the baseline, or 2 when
+        the baseline file has no baseline of the row count.
+    """
+    if config.ENVIRONMENT != config.TEST_ENVIRONMENT:
+        sys.exit('Environment must be set to {}.'.format(
+            config.TEST_ENVIRONMENT))
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--rows', type=parse_row_count, default=ROW_COUNTS['10k'],
+        help='Products seeded: a number, or one of {}.'.format(
+            ', '.join(ROW_COUNTS)))
+    parser.add_argument(
+        '--database', help='Database URL, a SQLite file by default.')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='Baseline JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='Store the results in the baseline file.')
+    parser.add_argument('--output', help='File to write the results to.')
+    arguments = parser.parse_args(argv)
+    if arguments.warmup >= arguments.calls:
+        parser.error('--warmup must be lower than --calls')
+
+    url = arguments.database or 'sqlite:///{}'.format(os.path.join(
+        tempfile.gettempdir(),
+        'timed_release_bench_crud_{}.db'.format(arguments.rows)))
+    engine = sql.get_engine(url)
+    started = time.perf_counter()
+    if seed(engine, arguments.rows, arguments.seed):
+        print('Seeded {} rows in {:.0f} s'.format(
+            arguments.rows, time.perf_counter() - started))
+
+    sql.shard_map = sql.ShardMap(
+        [sql.Shard('shard0', engine)], config.SHARD_VIRTUAL_NODES)
+    product_live_time.product_cache.max_size = 0
+    product_live_time.product_cache.clear()
+
+    results = run(
+        arguments.rows, arguments.calls, arguments.warmup, arguments.seed)
+    print('{} rows, {} calls per operation'.format(
+        arguments.rows, arguments.calls - arguments.warmup))
+    for operation in OPERATIONS:
+        print('{:<13} p50 {p50_us:>9.0f} us  p95 {p95_us:>9.0f} us  '
+              'p99 {p99_us:>9.0f} us  {ops_per_second:>9.0f} ops/s'.format(
+                  operation, **results[operation]))
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if not arguments.baseline:
+        return 0
+    baselines = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as baseline_file:
+            baselines = json.load(baseline_file)
+
+    if arguments.save_baseline:
+        baselines[str(arguments.rows)] = results
+        with open(arguments.baseline, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print('Baseline of {} rows saved'.format(arguments.rows))
+        return 0
+
+    baseline = baselines.get(str(arguments.rows))
+    if baseline is None:
+        print('No baseline of {} rows in {}, run with --save-baseline'.format(
+            arguments.rows, arguments.baseline), file=sys.stderr)
+        return 2
+    regressions = compare(results, baseline, arguments.tolerance)
+    for regression in regressions:
+        print('Regression: {}'.format(regression))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
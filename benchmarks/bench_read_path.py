@@ -0,0 +1,128 @@
+"""Benchmark of the product read path.
+
+Compares reading products through ORM instances serialized with `to_dict`
+and `json.dumps`, as the reads used to, with the lightweight read path:
+plain column rows, slotted records and direct JSON encoding. The product
+cache is bypassed so that every read hits the database, an in-memory SQLite
+database in the test environment.
+
+Usage:
+    $ Environment=test python benchmarks/bench_read_path.py
+"""
+
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+
+from sqlalchemy import select
+
+from timed_release import config
+from timed_release import serialization
+from timed_release.connectors import sql
+from timed_release.models import product_live_time
+
+
+ProductLiveTime = product_live_time.ProductLiveTime
+
+
+def orm_get(product_id):
+    """Read and serialize a product through an ORM instance."""
+    with sql.db_session() as session:
+        product = session.query(ProductLiveTime).get(product_id)
+        return json.dumps(product.to_dict())
+
+
+def orm_batch(product_ids):
+    """Read and serialize products through ORM instances."""
+    with sql.db_session() as session:
+        products = session.query(ProductLiveTime).filter(
+            ProductLiveTime.product_id.in_(product_ids))
+        return json.dumps({
+            'products': {
+                str(product.product_id): product.to_dict()
+                for product in products},
+            'missing': []})
+
+
+def record_get(product_id):
+    """Read and serialize a product through a record."""
+    with sql.db_session() as session:
+        row = session.execute(select(product_live_time._record_columns).where(
+            ProductLiveTime.product_id == product_id)).first()
+    return serialization.encode_product(
+        product_live_time.ProductLiveTimeRecord.from_row(row))
+
+
+def record_batch(product_ids):
+    """Read and serialize products through records."""
+    with sql.db_session() as session:
+        rows = session.execute(select(product_live_time._record_columns).where(
+            ProductLiveTime.product_id.in_(product_ids)))
+        products = {}
+        for row in rows:
+            product = product_live_time.ProductLiveTimeRecord.from_row(row)
+            products[str(product.product_id)] = product
+    return serialization.encode_product_batch(
+        {'products': products, 'missing': []})
+
+
+def measure(function, argument, number):
+    """Measure the time and the memory allocated by a read.
+
+    Returns:
+        tuple: microseconds per call, and peak bytes allocated by one call.
+    """
+    seconds = min(timeit.repeat(
+        lambda: function(argument), number=number, repeat=3))
+    tracemalloc.start()
+    allocated_before = tracemalloc.get_traced_memory()[0]
+    function(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds / number * 1e6, peak - allocated_before
+
+
+def main(argv=None):
+    """Run the benchmark.
+
+    Returns:
+        int: 0.
+    """
+    if config.ENVIRONMENT != config.TEST_ENVIRONMENT:
+        sys.exit('Environment must be set to {}.'.format(
+            config.TEST_ENVIRONMENT))
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--number', type=int, default=500)
+    arguments = parser.parse_args(argv)
+
+    sql.base_model.metadata.create_all(sql.db_engine)
+    product_live_time.create_product_live_time_details_bulk([
+        {'product_id': product_id, 'time_of_day_product': '10:30:00',
+            'time_zone': 'GMT', 'store_id': product_id % 10 + 1}
+        for product_id in range(1, arguments.products + 1)])
+
+    batch_ids = list(range(1, min(arguments.products, 100) + 1))
+    assert json.loads(orm_get(1)) == json.loads(record_get(1))
+    assert json.loads(orm_batch(batch_ids)) == json.loads(
+        record_batch(batch_ids))
+
+    for name, orm_read, record_read, argument in (
+            ('get', orm_get, record_get, 1),
+            ('batch of {}'.format(len(batch_ids)), orm_batch, record_batch,
+                batch_ids)):
+        orm_us, orm_bytes = measure(orm_read, argument, arguments.number)
+        record_us, record_bytes = measure(
+            record_read, argument, arguments.number)
+        print('{}: orm {:.0f} us, {} bytes peak; records {:.0f} us, {} bytes '
+              'peak; speedup {:.1f}x'.format(
+                  name, orm_us, orm_bytes, record_us, record_bytes,
+                  orm_us / record_us))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Micro-benchmark of the validation of timed release records.
+
+Compares the compiled validation engine with the previous implementation,
+which parsed times with `strptime` and rebuilt its rules for every record.
+
+Usage:
+    $ Environment=test python benchmarks/bench_validation.py
+"""
+
+import argparse
+import datetime
+import sys
+import timeit
+
+from timed_release import config
+from timed_release.constants import error
+from timed_release.validation import engine
+from timed_release.validation import validators
+
+
+def legacy_validate(data, required_fields):
+    """Validate a record as `validate_timed_release_dataset` used to."""
+    validation_errors = []
+    integer_and_non_negative_check_fields = ['product_id', 'store_id']
+
+    missing_fields = [
+        field for field in required_fields if not data.get(field)]
+    if missing_fields:
+        validation_errors.append({'missing mandatory fields': missing_fields})
+
+    integer_and_non_negative = [
+        field for field in integer_and_non_negative_check_fields
+        if data.get(field) and not validators.is_integer_and_non_negative(
+            data[field])]
+    if integer_and_non_negative:
+        validation_errors.append({
+            'non integer or negative fields list': integer_and_non_negative})
+
+    if data.get('time_of_day_product'):
+        try:
+            datetime.datetime.strptime(
+                data['time_of_day_product'], config.DEFAULT_TIME_FORMAT)
+        except ValueError:
+            validation_errors.append(
+                {'invalid time zone': error.ERROR_MESSAGE_TIME_OF_DAY_RELEASE})
+
+    if data.get('time_zone') and \
+            not validators.validate_time_zone(data['time_zone']):
+        validation_errors.append(
+            {'invalid time format': error.ERROR_MESSAGE_TIME_ZONE})
+
+    return validation_errors
+
+
+def create_records(count):
+    """Create records, one in ten of them being invalid."""
+    records = []
+    for index in range(count):
+        records.append({
+            'product_id': index + 1 if index % 10 else -1,
+            'time_of_day_product': '{:02d}:{:02d}:{:02d}'.format(
+                index % 24, index % 60, index % 59 if index % 10 else 75),
+            'time_zone': 'GMT' if index % 2 else 'local',
+            'store_id': index % 300 + 1})
+    return records
+
+
+def main(argv=None):
+    """Run the benchmark.
+
+    Returns:
+        int: 0 if the engine is at least `--min-speedup` times faster.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-speedup', type=float, default=5.0)
+    arguments = parser.parse_args(argv)
+
+    records = create_records(arguments.records)
+    required_fields = validators.TIMED_RELEASE_REQUIRED_FIELDS
+    validate = engine.compile_rules(required_fields)
+    assert [validate(record) for record in records] == [
+        legacy_validate(record, required_fields) for record in records]
+
+    legacy_time = min(timeit.repeat(
+        lambda: [legacy_validate(record, required_fields)
+                 for record in records],
+        number=1, repeat=arguments.repeat))
+    engine_time = min(timeit.repeat(
+        lambda: [validate(record) for record in records],
+        number=1, repeat=arguments.repeat))
+
+    speedup = legacy_time / engine_time
+    print('legacy: {:.3f} us/record'.format(
+        legacy_time / arguments.records * 1e6))
+    print('engine: {:.3f} us/record'.format(
+        engine_time / arguments.records * 1e6))
+    print('speedup: {:.1f}x'.format(speedup))
+    return 0 if speedup >= arguments.min_speedup else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""Tests for the in-process cache."""
+
+from timed_release.connectors import cache
+
+
+class FakeClock:
+    """Clock whose time is moved by hand."""
+
+    def __init__(self):
+        """Start the clock at 0."""
+        self.now = 0
+
+    def __call__(self):
+        """Return the current time."""
+        return self.now
+
+
+def test_get_and_set():
+    """Test a cached value is returned until it expires."""
+    clock = FakeClock()
+    lru_cache = cache.LRUCache(max_size=2, ttl=10, clock=clock)
+
+    assert lru_cache.get('a') is cache.MISSING
+    lru_cache.set('a', 1)
+    lru_cache.set('b', None, ttl=1)
+    assert lru_cache.get('a') == 1
+    assert lru_cache.get('b') is None
+
+    clock.now = 5
+    assert lru_cache.get('b') is cache.MISSING
+    assert lru_cache.get('a') == 1
+
+    clock.now = 10
+    assert lru_cache.get('a') is cache.MISSING
+    assert lru_cache.stats() == {
+        'hits': 3,
+        'misses': 3,
+        'evictions': 0,
+        'expirations': 2,
+        'size': 0,
+        'max_size': 2}
+
+
+def test_evicts_least_recently_used():
+    """Test the least recently used entry is evicted when full."""
+    lru_cache = cache.LRUCache(max_size=2, ttl=10)
+    lru_cache.set('a', 1)
+    lru_cache.set('b', 2)
+    lru_cache.get('a')
+    lru_cache.set('c', 3)
+
+    assert lru_cache.get('b') is cache.MISSING
+    assert lru_cache.get('a') == 1
+    assert lru_cache.get('c') == 3
+    assert lru_cache.evictions == 1
+
+
+def test_invalidate():
+    """Test invalidated entries are removed."""
+    lru_cache = cache.LRUCache(max_size=2, ttl=10)
+    lru_cache.set('a', 1)
+    lru_cache.set('b', 2)
+    lru_cache.invalidate(['a'])
+
+    assert lru_cache.get('a') is cache.MISSING
+    assert lru_cache.get('b') == 2
+
+
+def test_set_ignores_value_read_before_invalidation():
+    """Test a value read before an invalidation is not cached."""
+    lru_cache = cache.LRUCache(max_size=2, ttl=10)
+    token = lru_cache.read_token()
+    lru_cache.invalidate(['a'])
+    lru_cache.set('a', 'stale', token=token)
+
+    assert lru_cache.get('a') is cache.MISSING
+
+
+def test_disabled_cache():
+    """Test nothing is cached with a max size of 0."""
+    lru_cache = cache.LRUCache(max_size=0, ttl=10)
+    lru_cache.set('a', 1)
+
+    assert lru_cache.get('a') is cache.MISSING
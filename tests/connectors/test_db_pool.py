@@ -0,0 +1,142 @@
+"""Tests for the adaptive connection pool."""
+
+import sqlite3
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from timed_release.connectors import db_pool
+
+
+class Clock:
+    """Clock moved by hand."""
+
+    def __init__(self):
+        """Start at 0."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Get the current time."""
+        return self.now
+
+
+def create_pool(clock, pool_size=2, max_overflow=6, **kw):
+    """Create an adaptive pool of in-memory SQLite connections."""
+    return db_pool.AdaptivePool(
+        lambda: sqlite3.connect(':memory:', check_same_thread=False),
+        pool_size=pool_size, max_overflow=max_overflow, timeout=0.01,
+        adjust_seconds=10, clock=clock, **kw)
+
+
+def test_pool_is_bounded():
+    """Test a checkout at the limit times out, and is counted."""
+    pool = create_pool(Clock(), max_overflow=1)
+    connections = [pool.connect() for _ in range(3)]
+
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['checkouts'] == 0
+    assert stats['limit'] == 3
+    assert stats['overflow'] == 1
+    for connection in connections:
+        connection.close()
+    assert pool.stats()['idle'] == 2
+
+
+def test_pool_is_not_unbounded():
+    """Test an adaptive pool needs a maximum overflow."""
+    with pytest.raises(ValueError):
+        create_pool(Clock(), max_overflow=-1)
+
+
+def test_limit_adapts_to_waits_and_latency():
+    """Test the limit shrinks on latency and when idle, grows on waits."""
+    clock = Clock()
+    pool = create_pool(clock)
+    assert pool.limit == 8
+
+    pool.metrics.record_wait(0.5)
+    pool.metrics.record_query(1.0)
+    clock.now = 5
+    assert pool.adjust() == 8
+    clock.now = 10
+    assert pool.adjust() == 6
+
+    for _ in range(4):
+        pool.metrics.record_checkout()
+    pool.metrics.record_wait(0.5)
+    pool.metrics.record_query(0.01)
+    clock.now = 20
+    assert pool.adjust() == 8
+
+    for _ in range(4):
+        pool.metrics.record_checkin()
+    for limit in (7, 6, 5, 4, 3, 2, 2):
+        clock.now += 10
+        assert pool.adjust() == limit
+
+    assert pool.stats()['grown'] == 1
+    assert pool.stats()['shrunk'] == 7
+
+
+def test_recreate_keeps_limit_and_metrics():
+    """Test disposing of the pool keeps its bounds, limit and metrics."""
+    clock = Clock()
+    pool = create_pool(clock)
+    pool._resize(5)
+    pool.metrics.record_query(0.1)
+
+    recreated = pool.recreate()
+
+    assert recreated.limit == 5
+    assert (recreated.min_size, recreated.max_size) == (2, 8)
+    assert recreated.metrics is pool.metrics
+
+
+def test_watch_records_checkouts_and_queries():
+    """Test the engine events feed the metrics of the pool."""
+    engine = create_engine(
+        'sqlite://', poolclass=db_pool.AdaptivePool, pool_size=1,
+        max_overflow=2, pool_timeout=1, adjust_seconds=60)
+    db_pool.watch(engine)
+
+    with engine.connect() as connection:
+        connection.execute('SELECT 1')
+        assert engine.pool.stats()['in_use'] == 1
+
+    stats = engine.pool.stats()
+    assert stats['in_use'] == 0
+    assert stats['checkouts'] == 1
+    assert stats['queries'] == 1
+    assert stats['max_size'] == 3
+
+
+def test_idle_ping_skips_recently_used_connections(tmpdir):
+    """Test only connections idle for a while are pinged."""
+    clock = Clock()
+    ping = MagicMock()
+    liveness = db_pool.IdlePing(30, ping, clock=clock)
+    engine = create_engine(
+        'sqlite:///{}'.format(tmpdir.join('ping.db')), poolclass=QueuePool)
+    liveness.watch(engine)
+
+    with engine.connect() as connection:
+        assert connection.info[db_pool.UNVERIFIED]
+        connection.execute('SELECT 1')
+        assert db_pool.UNVERIFIED not in connection.info
+    clock.now = 29
+    with engine.connect():
+        pass
+    clock.now = 60
+    with engine.connect():
+        pass
+
+    assert ping.call_count == 1
+    assert liveness.stats() == {
+        'pings': 1, 'skipped_pings': 2, 'reconnects': 0}
@@ -1,7 +1,66 @@
 """Test for DB connection."""
+import datetime
+import json
+import time
+
+import flask
+import pytest
+from sqlalchemy import Column
+from sqlalchemy import create_engine
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import select
+from sqlalchemy import String
+from sqlalchemy import Table
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.exc import CompileError
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.exc import NoSuchColumnError
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
 
+from tests.testutils import db
+from timed_release import config
+from timed_release.connectors import cache
+from timed_release.connectors import db_pool
 from timed_release.connectors import sql
+from timed_release.models import product_live_time
+
+
+def create_app(handler):
+    """Create an app sharing a session per request, routing / to handler."""
+    app = flask.Flask('test')
+    sql.init_app(app)
+    app.add_url_rule('/', 'handler', handler, methods=['GET', 'POST'])
+    return app
+
+
+@pytest.fixture
+def replicated(monkeypatch, tmpdir):
+    """Route reads to a replica, with two SQLite files."""
+    primary = create_engine('sqlite:///{}'.format(tmpdir.join('primary.db')))
+    replica = create_engine('sqlite:///{}'.format(tmpdir.join('replica.db')))
+    for engine in (primary, replica):
+        sql.base_model.metadata.create_all(engine)
+    monkeypatch.setattr(sql, 'shard_map', sql.ShardMap([sql.Shard(
+        'shard0', primary, sql.ReplicaRouter([replica], 30))], 1))
+    monkeypatch.setattr(sql, '_thread_pins', sql.threading.local())
+    return primary, replica
+
+
+def count_products():
+    """Count the committed product live times."""
+    with sql.db_read_connection() as connection:
+        return len(list(sql.execute(
+            connection, select([product_live_time._table.c.product_id]))))
+
+
+UPSERT_TABLE = Table(
+    'upsert_test', MetaData(),
+    Column('id', Integer, primary_key=True), Column('name', String))
 
 
 def test_wrap_db_errors():
@@ -22,3 +81,381 @@ def test_wrap_db_errors_with_error():
 
     response = has_exception()
     assert response.status == 500
+
+
+@pytest.mark.parametrize(
+    'description, dialect, expected_clause', [
+        ('MySQL', mysql.dialect(),
+            'ON DUPLICATE KEY UPDATE name = VALUES(name)'),
+        ('SQLite', sqlite.dialect(),
+            'ON CONFLICT (id) DO UPDATE SET name = excluded.name')])
+def test_upsert(description, dialect, expected_clause):
+    """Test upsert statement is compiled with the native dialect syntax."""
+    statement = sql.Upsert(UPSERT_TABLE, ['id'], ['name'])
+    compiled = str(statement.compile(
+        dialect=dialect, column_keys=['id', 'name']))
+
+    assert compiled.startswith('INSERT INTO upsert_test (id, name)')
+    assert compiled.endswith(expected_clause)
+
+
+def test_upsert_unsupported_dialect():
+    """Test upsert statement is refused by other dialects."""
+    statement = sql.Upsert(UPSERT_TABLE, ['id'], ['name'])
+    with pytest.raises(CompileError):
+        statement.compile(dialect=postgresql.dialect())
+
+
+def test_statement_cache():
+    """Test compiled statements are counted and evicted by recency."""
+    statement_cache = sql.StatementCache(max_size=2)
+    statement_cache['a'] = 1
+    statement_cache['b'] = 2
+
+    assert statement_cache.get('a') == 1
+    assert statement_cache.get('c') is None
+    statement_cache['c'] = 3
+
+    assert statement_cache.get('b') is None
+    assert statement_cache.stats() == {
+        'hits': 1, 'misses': 2, 'evictions': 1, 'size': 2, 'max_size': 2}
+
+
+def test_execute_compiles_once(monkeypatch):
+    """Test a statement executed twice is compiled once."""
+    statement_cache = sql.StatementCache(max_size=10)
+    monkeypatch.setattr(sql, 'statement_cache', statement_cache)
+    statement = select([1])
+
+    with sql.db_session() as session:
+        sql.execute(session, statement)
+        sql.execute(session, statement)
+
+    assert statement_cache.misses == 1
+    assert statement_cache.hits == 1
+
+
+def test_db_read_connection(monkeypatch):
+    """Test reads run on a connection that is closed afterwards."""
+    statement_cache = sql.StatementCache(max_size=10)
+    monkeypatch.setattr(sql, 'statement_cache', statement_cache)
+
+    with sql.db_read_connection() as connection:
+        assert sql.execute(connection, select([1])).scalar() == 1
+
+    assert connection.closed
+    assert statement_cache.misses == 1
+
+
+def test_db_read_connection_read_only_transaction(monkeypatch, mocker):
+    """Test MySQL reads start a read only transaction when configured."""
+    connection = mocker.MagicMock()
+    connection.dialect.name = 'mysql'
+    monkeypatch.setattr(sql.config, 'READ_ONLY_TRANSACTIONS', True)
+    monkeypatch.setattr(sql.db_engine, 'connect', lambda: connection)
+
+    with sql.db_read_connection():
+        pass
+
+    connection.execute.assert_called_once_with('START TRANSACTION READ ONLY')
+    connection.close.assert_called_once_with()
+
+
+@db.test_schema
+def test_request_scope_commits_once():
+    """Test the writes of a request share one session, committed after it."""
+    sessions = []
+    committed = []
+
+    def handler():
+        for product_id in (1, 2):
+            with sql.db_session() as session:
+                sessions.append(session)
+                sql.execute(session, product_live_time._insert_product, {
+                    'product_id': product_id,
+                    'time_of_day_product': datetime.time(1),
+                    'time_zone': 'GMT'})
+        sql.after_commit(lambda: committed.append(count_products()))
+        assert committed == []
+        return 'ok'
+
+    result = create_app(handler).test_client().post('/')
+
+    assert result.status_code == 200
+    assert sessions[0] is sessions[1]
+    assert committed == [2]
+
+
+@db.test_schema
+def test_request_scope_rolls_back_server_errors():
+    """Test the writes of a request returning a server error are dropped."""
+    committed = []
+
+    def handler():
+        product_live_time.create_product_live_time_details(
+            1, '01:00:00', 'GMT', 1)
+        sql.after_commit(lambda: committed.append(True))
+        return 'error', 500
+
+    result = create_app(handler).test_client().post('/')
+
+    assert result.status_code == 500
+    assert count_products() == 0
+    assert committed == []
+
+
+@db.test_schema
+def test_request_scope_savepoint():
+    """Test a failing block with a savepoint only rolls back itself."""
+    def handler():
+        product_live_time.create_product_live_time_details(
+            1, '01:00:00', 'GMT', 1)
+        records = [
+            {'product_id': product_id, 'time_of_day_product': '02:00:00',
+             'time_zone': 'GMT'} for product_id in (1, 2)]
+        bulk_response = \
+            product_live_time.create_product_live_time_details_bulk(records)
+        return flask.jsonify(bulk_response.message)
+
+    result = create_app(handler).test_client().post('/')
+
+    assert result.status_code == 200
+    assert json.loads(result.data.decode())[1] is None
+    assert count_products() == 2
+
+
+def test_after_commit_outside_requests():
+    """Test callbacks are called right away outside requests."""
+    called = []
+    sql.after_commit(lambda: called.append(True))
+
+    assert called == [True]
+    assert not sql.has_uncommitted_writes()
+
+
+def test_reads_go_to_replicas_unless_pinned(replicated):
+    """Test reads go to the primary for a while after a thread writes."""
+    product_live_time.create_product_live_time_details(
+        1, '01:00:00', 'GMT', 1)
+    assert count_products() == 1
+
+    sql._thread_pins.until = 0
+    assert count_products() == 0
+    replica_router = sql.shard_map.shards[0].replica_router
+    assert replica_router.stats()['replica_reads'] == 1
+    assert replica_router.stats()['primary_reads'] == 1
+
+
+def test_request_reads_follow_the_pin_cookie(replicated):
+    """Test requests of a client that wrote read from the primary."""
+    def handler():
+        if flask.request.method == 'POST':
+            product_live_time.create_product_live_time_details(
+                1, '01:00:00', 'GMT', 1)
+        return str(count_products())
+
+    client = create_app(handler).test_client()
+    post_result = client.post('/')
+    pinned_result = client.get('/')
+    client.cookie_jar.clear()
+    unpinned_result = client.get('/')
+
+    assert config.REPLICA_PIN_COOKIE in post_result.headers['Set-Cookie']
+    assert post_result.data == b'1'
+    assert pinned_result.data == b'1'
+    assert unpinned_result.data == b'0'
+
+
+def test_pinned_requests_skip_the_product_cache(replicated, monkeypatch):
+    """Test pinned requests do not read products cached before a write."""
+    def handler():
+        if flask.request.method == 'POST':
+            product_live_time.create_product_live_time_details(
+                1, '01:00:00', 'GMT', 1)
+            return ''
+        single = product_live_time.get_product_live_time_details(1)
+        batch = product_live_time.get_product_live_time_details_batch([1])
+        return json.dumps([single.status, batch.message['missing']])
+
+    monkeypatch.setattr(
+        product_live_time, 'product_cache', cache.LRUCache(10, 60))
+    client = create_app(handler).test_client()
+    post_result = client.post('/')
+    client.cookie_jar.clear()
+    # An unpinned read caches the product as missing from the replica.
+    unpinned_result = client.get('/')
+    client.set_cookie(
+        'localhost', config.REPLICA_PIN_COOKIE, str(time.time()))
+    pinned_result = client.get('/')
+
+    assert config.REPLICA_PIN_COOKIE in post_result.headers['Set-Cookie']
+    assert json.loads(unpinned_result.data.decode()) == [404, [1]]
+    assert json.loads(pinned_result.data.decode()) == [200, []]
+
+
+def test_replica_router_round_robin_and_failures(mocker):
+    """Test replicas are used in turn and failing ones are skipped."""
+    now = [0]
+    engines = [mocker.MagicMock(), mocker.MagicMock()]
+    engines[1].connect.side_effect = OperationalError(
+        'connect', {}, Exception('down'))
+    router = sql.ReplicaRouter(engines, 30, clock=lambda: now[0])
+
+    assert router.connect() is engines[0].connect.return_value
+    assert router.connect() is engines[0].connect.return_value
+    assert router.connect() is engines[0].connect.return_value
+    assert engines[1].connect.call_count == 1
+    assert router.stats()['available_replicas'] == 1
+
+    engines[0].connect.side_effect = OperationalError(
+        'connect', {}, Exception('down'))
+    assert router.connect() is None
+
+    now[0] = 31
+    engines[1].connect.side_effect = None
+    assert router.connect() is engines[1].connect.return_value
+    assert router.stats() == {
+        'replica_reads': 4, 'primary_reads': 1, 'failures': 3,
+        'replicas': 2, 'available_replicas': 1}
+
+
+def test_shard_map_is_consistent(tmpdir):
+    """Test adding a shard only moves the ids it takes over."""
+    three_shards = db.create_shard_map(tmpdir, 3)
+    four_shards = db.create_shard_map(tmpdir, 4)
+    product_ids = range(1, 4001)
+
+    moved = [
+        product_id for product_id in product_ids
+        if three_shards.get(product_id).name !=
+        four_shards.get(product_id).name]
+    groups = three_shards.group(product_ids)
+
+    assert three_shards.get(42).name == three_shards.get('42').name
+    assert sorted(sum((ids for _, ids in groups), [])) == list(product_ids)
+    assert all(
+        three_shards.get(product_id) is shard
+        for shard, ids in groups for product_id in ids)
+    assert all(len(ids) > 800 for _, ids in groups)
+    assert 600 < len(moved) < 1400
+    assert all(four_shards.get(product_id).name == 'shard3'
+               for product_id in moved)
+
+
+def test_db_session_requires_a_shard(monkeypatch, tmpdir):
+    """Test the shard must be given when there are several."""
+    monkeypatch.setattr(sql, 'shard_map', db.create_shard_map(tmpdir, 2))
+
+    with pytest.raises(ValueError):
+        with sql.db_session():
+            pass
+
+
+def test_scatter(monkeypatch, tmpdir):
+    """Test a read runs on every shard, results in the order of shards."""
+    shard_map = db.create_shard_map(tmpdir, 3)
+    monkeypatch.setattr(sql, 'shard_map', shard_map)
+    with sql.db_session(shard_map.shards[1]) as session:
+        session.execute(product_live_time._insert_product, {
+            'product_id': 1, 'time_of_day_product': datetime.time(10),
+            'time_zone': 'GMT', 'store_id': 1})
+
+    results = sql.scatter(lambda shard, connection: (shard.name, len(list(
+        sql.execute(connection, select([product_live_time._table]))))))
+
+    assert results == [('shard0', 0), ('shard1', 1), ('shard2', 0)]
+    assert sql.scatter(
+        lambda shard, connection: shard.name,
+        shard_map.shards[2:]) == ['shard2']
+
+
+@pytest.fixture
+def liveness(monkeypatch, tmpdir):
+    """Watch an engine of a SQLite file with liveness checks."""
+    monkeypatch.setattr(sql, 'liveness', db_pool.IdlePing(
+        30, sql._ping_connection))
+    engine = create_engine(
+        'sqlite:///{}'.format(tmpdir.join('liveness.db')), poolclass=QueuePool)
+    sql.liveness.watch(engine)
+    return engine
+
+
+def close_database(connection):
+    """Close the database connection under a pooled connection."""
+    connection.connection.connection.close()
+
+
+def test_first_statement_reconnects(liveness):
+    """Test a first statement on a closed connection runs on a new one."""
+    with liveness.connect() as connection:
+        close_database(connection)
+        assert sql.execute(connection, select([1])).scalar() == 1
+
+    session = Session(bind=liveness)
+    close_database(session.connection())
+    assert sql.execute(session, select([1])).scalar() == 1
+    session.close()
+
+    assert sql.liveness.stats()['reconnects'] == 2
+
+
+def test_later_statements_do_not_reconnect(liveness):
+    """Test a statement is not run again once the connection was used."""
+    with liveness.connect() as connection:
+        sql.execute(connection, select([1]))
+        close_database(connection)
+        with pytest.raises(DBAPIError):
+            sql.execute(connection, select([1]))
+
+    assert sql.liveness.stats()['reconnects'] == 0
+
+
+@pytest.mark.parametrize('statement, expected_fingerprint', [
+    ('SELECT a FROM t WHERE id = ?', 'SELECT a FROM t WHERE id = ?'),
+    ("SELECT a\n  FROM t WHERE name = 'x''y' AND id = 42",
+     'SELECT a FROM t WHERE name = ? AND id = ?'),
+    ('SELECT a FROM t WHERE id IN (%s, %s, %s) LIMIT %(limit)s',
+     'SELECT a FROM t WHERE id IN (?, ...) LIMIT ?'),
+    ('SELECT product_id_1 FROM t WHERE id IN (:a, :b)',
+     'SELECT product_id_1 FROM t WHERE id IN (?, ...)')])
+def test_normalize_statement(statement, expected_fingerprint):
+    """Test literals and bind parameters are removed from statements."""
+    assert sql.normalize_statement(statement) == expected_fingerprint
+
+
+def test_slow_query_log(monkeypatch, tmpdir, mocker):
+    """Test slow statements are logged, and explained once."""
+    shard_map = db.create_shard_map(tmpdir, 1)
+    monkeypatch.setattr(sql, 'shard_map', shard_map)
+    monkeypatch.setattr(sql, 'slow_query_log', sql.SlowQueryLog(0))
+    sql.slow_query_log.watch(shard_map.shards[0].engine)
+    mock_warning = mocker.patch.object(sql.logger, 'warning')
+    product_live_time.product_cache.clear()
+
+    product_live_time.create_product_live_time_details_bulk([
+        {'product_id': product_id, 'time_of_day_product': '10:00:00',
+         'time_zone': 'GMT', 'store_id': None} for product_id in (1, 2)])
+    for product_id in (1, 2):
+        product_live_time.get_product_live_time_details(product_id)
+    product_live_time.product_cache.clear()
+
+    report = {
+        entry['statement'].split()[0]: entry
+        for entry in sql.slow_query_log.report()}
+    assert report['SELECT']['count'] == 2
+    assert report['SELECT']['parameters'] == '(int)'
+    assert report['SELECT']['call_site'].startswith(
+        'models/product_live_time.py:')
+    assert report['SELECT']['call_site'].endswith(
+        ' in get_product_live_time_details')
+    assert 'product_live_time' in str(report['SELECT']['explain'])
+    assert report['INSERT']['parameters'] == '2 x (int, str x 2, NoneType)'
+    assert report['INSERT']['explain'] is None
+    assert sql.slow_query_log.stats() == {
+        'slow_queries': sum(entry['count'] for entry in report.values()),
+        'statements': len(report), 'explained': 1}
+    messages = [
+        args[0] % args[1:] for args, _ in mock_warning.call_args_list]
+    assert any(message.startswith('Slow query of') for message in messages)
+    assert any(
+        message.startswith('EXPLAIN of SELECT') for message in messages)
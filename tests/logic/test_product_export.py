@@ -0,0 +1,69 @@
+"""Unit tests for Product Live Time export logic."""
+
+import datetime
+import json
+
+from oto import status as http_status
+import pytest
+
+from tests.testutils import db
+from timed_release.connectors.sql import db_session
+from timed_release.logic import product_export
+from timed_release.models import product_live_time as product_live_time_model
+
+
+def insert_products():
+    """Insert three products over two stores and time zones."""
+    with db_session() as session:
+        session.bulk_insert_mappings(
+            product_live_time_model.ProductLiveTime, [
+                {'product_id': product_id,
+                    'time_of_day_product': datetime.time(10, product_id),
+                    'time_zone': time_zone, 'store_id': store_id}
+                for product_id, time_zone, store_id in (
+                    (3, 'GMT', 1), (1, 'local', 1), (2, 'GMT', 2))])
+
+
+@db.test_schema
+def test_export_ndjson(monkeypatch):
+    """Test all the products are exported in product id order."""
+    monkeypatch.setattr(product_export.config, 'EXPORT_BATCH_SIZE', 2)
+    insert_products()
+
+    result = product_export.export_product_live_times('ndjson')
+    chunks = list(result.message)
+
+    assert len(chunks) == 2
+    products = [json.loads(line) for line in ''.join(chunks).splitlines()]
+    assert [product['product_id'] for product in products] == [1, 2, 3]
+    assert products[0] == {
+        'product_id': 1,
+        'time_of_day_product': '10:01:00',
+        'time_zone': 'local',
+        'store_id': 1}
+
+
+@db.test_schema
+def test_export_csv_with_filters():
+    """Test the products are exported as CSV with the filters applied."""
+    insert_products()
+
+    result = product_export.export_product_live_times(
+        'csv', store_id='1', time_zone='GMT')
+
+    assert ''.join(result.message) == (
+        'product_id,time_of_day_product,time_zone,store_id\n'
+        '3,10:03:00,GMT,1\n')
+
+
+@pytest.mark.parametrize(
+    'description, export_format, store_id, time_zone', [
+        ('Invalid format', 'xml', None, None),
+        ('Invalid store id', 'csv', 'abc', None),
+        ('Invalid time zone', 'csv', None, 'UTC')])
+def test_export_validation(description, export_format, store_id, time_zone):
+    """Test the export parameters are validated."""
+    result = product_export.export_product_live_times(
+        export_format, store_id, time_zone)
+
+    assert result.status == http_status.BAD_REQUEST
@@ -0,0 +1,143 @@
+"""Unit tests for Product Live Time import logic."""
+
+import io
+from unittest.mock import MagicMock
+
+from oto import response
+from oto import status as http_status
+import pytest
+
+from tests.testutils import db
+from timed_release.logic import product_import
+from timed_release.models import product_live_time as product_live_time_model
+
+
+NDJSON_BODY = b''.join([
+    b'{"product_id": 12, "time_of_day_product": "01:00:00", '
+    b'"time_zone": "GMT"}\n',
+    b'not json\n',
+    b'\n',
+    b'{"product_id": 13, "time_of_day_product": "02:00:00", '
+    b'"time_zone": "UTC"}\n',
+    b'{"product_id": 14, "time_of_day_product": "03:00:00", '
+    b'"time_zone": "local"}\n'])
+
+CSV_BODY = b''.join([
+    b'product_id,time_of_day_product,time_zone,store_id\n',
+    b'12,01:00:00,GMT,\n',
+    b'abc,02:00:00,GMT,1\n',
+    b'13,02:00:00,UTC,1\n',
+    b'14,03:00:00,local,2\n'])
+
+
+@db.test_schema
+@pytest.mark.parametrize(
+    'description, import_format, body, columnar_min_records', [
+        ('NDJSON import', 'ndjson', NDJSON_BODY, 1000),
+        ('CSV import', 'csv', CSV_BODY, 1000),
+        ('NDJSON import validated as columns', 'ndjson', NDJSON_BODY, 1),
+        ('CSV import validated as columns', 'csv', CSV_BODY, 1)])
+def test_import_product_live_times(
+        description, import_format, body, columnar_min_records, monkeypatch):
+    """Test valid rows are upserted and invalid rows are reported."""
+    monkeypatch.setattr(product_import.config, 'IMPORT_COMMIT_SIZE', 1)
+    monkeypatch.setattr(
+        product_import.config, 'COLUMNAR_VALIDATION_MIN_RECORDS',
+        columnar_min_records)
+    db.insert_product_live_time_data()
+    progress = MagicMock()
+
+    result = product_import.import_product_live_times(
+        io.BytesIO(body), import_format, progress=progress)
+
+    assert result.status == http_status.OK
+    assert result.message['processed'] == 4
+    assert result.message['inserted'] == 1
+    assert result.message['updated'] == 1
+    assert result.message['rejected'] == 2
+    assert [rejection['row'] for rejection in result.message[
+        'rejections']] == [1, 2]
+    assert result.message['committed_offset'] == 4
+    assert progress.call_count == 3
+    assert product_live_time_model.get_product_live_time_details(
+        14).message['time_zone'] == 'local'
+
+
+@db.test_schema
+@pytest.mark.parametrize(
+    'description, import_format, body', [
+        ('NDJSON import', 'ndjson', b''.join([
+            b'\xff\xfe\n',
+            b'{"product_id": 12, "time_of_day_product": "01:00:00", '
+            b'"time_zone": "GMT"}\n'])),
+        ('CSV import', 'csv', b''.join([
+            b'product_id,time_of_day_product,time_zone,store_id\n',
+            b'\xff\xfe,01:00:00,GMT,\n',
+            b'12,01:00:00,GMT,\n']))])
+def test_import_product_live_times_invalid_encoding(
+        description, import_format, body):
+    """Test lines that are not UTF-8 are rejected like other invalid rows."""
+    result = product_import.import_product_live_times(
+        io.BytesIO(body), import_format)
+
+    assert result.status == http_status.OK
+    assert result.message['processed'] == 2
+    assert result.message['inserted'] == 1
+    assert result.message['rejections'] == [{
+        'row': 0,
+        'errors': [{'invalid record': 'Line is not valid UTF-8'}]}]
+    assert result.message['committed_offset'] == 2
+
+
+@db.test_schema
+def test_import_product_live_times_unicode_digits():
+    """Test CSV integers of non-ASCII digits are rejected."""
+    result = product_import.import_product_live_times(io.BytesIO(b''.join([
+        b'product_id,time_of_day_product,time_zone,store_id\n',
+        b'12,01:00:00,GMT,\xc2\xb2\n'])), 'csv')
+
+    assert result.status == http_status.OK
+    assert result.message['rejected'] == 1
+    assert result.message['inserted'] == 0
+
+
+@db.test_schema
+def test_import_product_live_times_resume():
+    """Test the rows before the offset are skipped."""
+    result = product_import.import_product_live_times(
+        io.BytesIO(NDJSON_BODY), 'ndjson', offset=3)
+
+    assert result.message['processed'] == 1
+    assert result.message['inserted'] == 1
+    assert result.message['committed_offset'] == 4
+    assert product_live_time_model.get_product_live_time_details(
+        12).status == http_status.NOT_FOUND
+
+
+def test_import_product_live_times_failure(monkeypatch):
+    """Test the committed offset is returned when the database fails."""
+    monkeypatch.setattr(product_import.config, 'IMPORT_COMMIT_SIZE', 1)
+    monkeypatch.setattr(
+        product_live_time_model, 'import_product_live_time_details',
+        MagicMock(side_effect=[
+            response.Response(message={'inserted': 1, 'updated': 0}),
+            response.create_fatal_response()]))
+
+    result = product_import.import_product_live_times(
+        io.BytesIO(NDJSON_BODY), 'ndjson')
+
+    assert result.status == http_status.INTERNAL_ERROR
+    assert result.errors['message']['summary']['committed_offset'] == 1
+
+
+@pytest.mark.parametrize(
+    'description, import_format, offset', [
+        ('Invalid format', 'xml', 0),
+        ('Negative offset', 'csv', -1)])
+def test_import_product_live_times_validation(
+        description, import_format, offset):
+    """Test the import parameters are validated."""
+    result = product_import.import_product_live_times(
+        io.BytesIO(b''), import_format, offset)
+
+    assert result.status == http_status.BAD_REQUEST
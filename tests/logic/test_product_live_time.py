@@ -11,6 +11,7 @@ from timed_release.constants import error
 from timed_release.constants import success
 from timed_release.logic import product_live_time
 from timed_release.models import product_live_time as product_live_time_model
+from timed_release.models import time_index
 
 
 @pytest.mark.parametrize(
@@ -205,3 +206,257 @@ def test_update_product_live_time_for_product_not_found(monkeypatch):
     result = product_live_time.update_product_live_time('12', request_body)
 
     assert result.status == http_status.NOT_FOUND
+
+
+@pytest.mark.parametrize(
+    'description, product_ids', [
+        ('No product ids', []),
+        ('Product id must be integer', ['1', 'abc']),
+        ('Product id must be greater than zero', ['0', 2]),
+        ('Product id must not be negative', [-1]),
+        ('Product id must be ASCII digits', ['1', '\u00b2'])])
+def test_get_product_live_time_details_batch_validation(
+        description, product_ids):
+    """Test for batch get product live time with invalid ids."""
+    result = product_live_time.get_product_live_time_details_batch(
+        product_ids)
+
+    assert result.status == http_status.BAD_REQUEST
+
+
+def test_get_product_live_time_details_batch_too_many_ids(monkeypatch):
+    """Test for batch get product live time with too many ids."""
+    monkeypatch.setattr(product_live_time.config, 'BATCH_MAX_PRODUCT_IDS', 2)
+
+    result = product_live_time.get_product_live_time_details_batch(
+        ['1', '2', '3'])
+
+    assert result.status == http_status.BAD_REQUEST
+
+
+def test_get_product_live_time_details_batch_success(monkeypatch):
+    """Test batch get product live time deduplicates and converts ids."""
+    mock_get_batch = MagicMock(return_value=response.Response(
+        message={'products': {}, 'missing': [3, 1]}))
+    monkeypatch.setattr(
+        product_live_time_model, 'get_product_live_time_details_batch',
+        mock_get_batch)
+
+    result = product_live_time.get_product_live_time_details_batch(
+        ['3', 1, '3'])
+
+    assert result.status == http_status.OK
+    mock_get_batch.assert_called_with([3, 1])
+
+
+@pytest.mark.parametrize(
+    'description, records', [
+        ('No records', []),
+        ('Too many records', [{}] * 3)])
+def test_create_product_live_time_details_bulk_validation(
+        description, records, monkeypatch):
+    """Test for bulk create with an invalid list of records."""
+    monkeypatch.setattr(product_live_time.config, 'BULK_MAX_RECORDS', 2)
+
+    result = product_live_time.create_product_live_time_details_bulk(records)
+
+    assert result.status == http_status.BAD_REQUEST
+
+
+@pytest.mark.parametrize(
+    'description, columnar_min_records', [
+        ('Records validated one by one', 1000),
+        ('Records validated as columns', 1)])
+def test_create_product_live_time_details_bulk_partial(
+        description, columnar_min_records, monkeypatch):
+    """Test for bulk create where some records are invalid."""
+    monkeypatch.setattr(
+        product_live_time.validators.config,
+        'COLUMNAR_VALIDATION_MIN_RECORDS', columnar_min_records)
+    valid_record = {
+        'product_id': 1, 'time_of_day_product': '20:15:00',
+        'time_zone': 'local'}
+    mock_create_bulk = MagicMock(
+        return_value=response.Response(message=[None]))
+    monkeypatch.setattr(
+        product_live_time_model, 'create_product_live_time_details_bulk',
+        mock_create_bulk)
+
+    result = product_live_time.create_product_live_time_details_bulk([
+        'abc',
+        valid_record,
+        {'product_id': 2, 'time_of_day_product': '85:00:00',
+            'time_zone': 'local'},
+        valid_record])
+
+    assert result.status == http_status.MULTIPLE_STATUS
+    assert result.message['created'] == 1
+    assert result.message['failed'] == 3
+    assert [item['status'] for item in result.message['results']] == [
+        'error', 'created', 'error', 'error']
+    assert result.message['results'][3]['errors'] == [{
+        'duplicate product id':
+            'Product id 1 is present more than once in the request'}]
+    mock_create_bulk.assert_called_with([valid_record])
+
+
+def test_create_product_live_time_details_bulk_success(monkeypatch):
+    """Test for bulk create where all records are created."""
+    monkeypatch.setattr(
+        product_live_time_model, 'create_product_live_time_details_bulk',
+        MagicMock(return_value=response.Response(message=[None])))
+
+    result = product_live_time.create_product_live_time_details_bulk([{
+        'product_id': 1, 'time_of_day_product': '20:15:00',
+        'time_zone': 'local'}])
+
+    assert result.status == http_status.OK
+    assert result.message['results'] == [
+        {'index': 0, 'product_id': 1, 'status': 'created'}]
+
+
+def test_upsert_product_live_time_detail(monkeypatch):
+    """Test for upsert product live time detail with the id of the path."""
+    mock_upsert = MagicMock(return_value=response.Response(message={}))
+    monkeypatch.setattr(
+        product_live_time_model, 'upsert_product_live_time_details',
+        mock_upsert)
+
+    result = product_live_time.upsert_product_live_time_detail(
+        '11', {'time_of_day_product': '03:02:01', 'time_zone': 'GMT'})
+
+    assert result.status == http_status.OK
+    mock_upsert.assert_called_with(11, '03:02:01', 'GMT', None)
+
+
+def test_upsert_product_live_time_detail_invalid_product_id():
+    """Test for upsert product live time detail with an invalid id."""
+    result = product_live_time.upsert_product_live_time_detail('abc', {})
+
+    assert result.status == http_status.BAD_REQUEST
+
+
+def test_upsert_product_live_time_details_bulk(monkeypatch):
+    """Test for bulk upsert of product live time details."""
+    monkeypatch.setattr(
+        product_live_time_model, 'upsert_product_live_time_details_bulk',
+        MagicMock(return_value=response.Response(message=[None])))
+
+    result = product_live_time.upsert_product_live_time_details_bulk([{
+        'product_id': 1, 'time_of_day_product': '20:15:00',
+        'time_zone': 'local'}])
+
+    assert result.status == http_status.OK
+    assert result.message['upserted'] == 1
+
+
+@pytest.mark.parametrize(
+    'description, start_time, end_time, store_id', [
+        ('Invalid start time', '25:00:00', '10:00:00', None),
+        ('Missing end time', '10:00:00', '', None),
+        ('Invalid store id', '10:00:00', '11:00:00', 'abc')])
+def test_get_products_going_live_validation(
+        description, start_time, end_time, store_id):
+    """Test going live window validation."""
+    result = product_live_time.get_products_going_live(
+        start_time, end_time, store_id)
+
+    assert result.status == http_status.BAD_REQUEST
+
+
+def test_get_products_going_live_from_database(monkeypatch):
+    """Test going live windows are queried from the database by default."""
+    mock_going_live = MagicMock(return_value=response.Response(message={}))
+    monkeypatch.setattr(
+        product_live_time_model, 'get_products_going_live', mock_going_live)
+
+    product_live_time.get_products_going_live('10:00:00', '11:00:00', '2')
+
+    mock_going_live.assert_called_with('10:00:00', '11:00:00', 2)
+
+
+@db.test_schema
+def test_get_products_going_live_from_time_index(monkeypatch):
+    """Test going live windows are answered by the in-memory index."""
+    monkeypatch.setattr(
+        product_live_time.config, 'WINDOW_INDEX_IN_MEMORY', True)
+    db.insert_product_live_time_data()
+    try:
+        result = product_live_time.get_products_going_live(
+            '20:00:00', '01:00:00')
+    finally:
+        time_index.reset_time_index()
+
+    assert result.message == {
+        'products': [{
+            'product_id': 12,
+            'time_of_day_product': '20:30:00',
+            'time_zone': 'GMT',
+            'store_id': 1}],
+        'truncated': False}
+
+
+@pytest.mark.parametrize(
+    'description, store_id, limit, cursor', [
+        ('Invalid store id', 'abc', None, None),
+        ('Zero limit', '1', '0', None),
+        ('Limit too large', '1', '1001', None),
+        ('Cursor not base64', '1', None, '!!!'),
+        ('Cursor not a position', '1', None, 'eyJhIjogMX0'),
+        ('Cursor with invalid time', '1', None, 'WyIyNTowMDowMCIsIDFd')])
+def test_get_store_products_validation(
+        description, store_id, limit, cursor):
+    """Test store listing validation."""
+    result = product_live_time.get_store_products(store_id, limit, cursor)
+
+    assert result.status == http_status.BAD_REQUEST
+
+
+@db.test_schema
+def test_get_store_products_pages():
+    """Test the next cursor walks through all the products of a store."""
+    product_live_time_model.create_product_live_time_details_bulk([
+        {'product_id': product_id, 'time_of_day_product': '10:00:00',
+            'time_zone': 'GMT', 'store_id': 1}
+        for product_id in range(1, 6)])
+
+    product_ids = []
+    cursor = None
+    while True:
+        result = product_live_time.get_store_products('1', '2', cursor)
+        product_ids.extend(
+            product['product_id'] for product in result.message['products'])
+        cursor = result.message['next_cursor']
+        if cursor is None:
+            break
+
+    assert product_ids == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.parametrize(
+    'description, product_ids, reference', [
+        ('Invalid reference', ['12'], 'yesterday'),
+        ('Invalid product id', ['abc'], '1451606400'),
+        ('No product id', [], None)])
+def test_get_next_releases_validation(description, product_ids, reference):
+    """Test next releases validation."""
+    result = product_live_time.get_next_releases(product_ids, reference)
+
+    assert result.status == http_status.BAD_REQUEST
+
+
+@db.test_schema
+def test_get_next_releases():
+    """Test the next releases of the found products are computed."""
+    db.insert_product_live_time_data()
+
+    # 2016-01-01T00:00:00Z
+    result = product_live_time.get_next_releases(['12', '13'], '1451606400')
+
+    assert result.message == {
+        'releases': {
+            '12': {
+                'next_release': 1451680200,
+                'next_release_utc': '2016-01-01T20:30:00Z',
+                'time_zone_name': 'UTC'}},
+        'missing': [13]}
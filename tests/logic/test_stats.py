@@ -0,0 +1,35 @@
+"""Unit tests for Stats logic."""
+
+from oto import status as http_status
+
+from timed_release.logic import stats
+
+
+def test_get_stats():
+    """Test the counters of the in-process caches are returned."""
+    result = stats.get_stats()
+
+    assert result.status == http_status.OK
+    assert set(result.message['product_cache']) == {
+        'hits', 'misses', 'evictions', 'expirations', 'size', 'max_size'}
+    assert set(result.message['statement_cache']) == {
+        'hits', 'misses', 'evictions', 'size', 'max_size'}
+    assert result.message['replicas']['replicas'] == 0
+    assert result.message['pools'] == {}
+    assert set(result.message['liveness']) == {
+        'pings', 'skipped_pings', 'reconnects'}
+    assert set(result.message['slow_queries']) == {
+        'slow_queries', 'statements', 'explained'}
+
+
+def test_get_metrics():
+    """Test the counters are rendered with the request and query metrics."""
+    result = stats.get_metrics()
+
+    assert result.status == http_status.OK
+    assert '# TYPE timed_release_requests_total counter\n' in result.message
+    assert 'timed_release_cache_hits_total{cache="product"} ' in \
+        result.message
+    assert 'timed_release_connection_checks_total{result="pinged"} ' in \
+        result.message
+    assert 'timed_release_slow_queries_total ' in result.message
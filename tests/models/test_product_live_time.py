@@ -1,6 +1,8 @@
 """"Test for Product Live Time Model CRUD operation."""
 
 import datetime
+import json
+from unittest.mock import ANY
 from unittest.mock import MagicMock
 from unittest.mock import patch
 from oto import response
@@ -10,6 +12,7 @@ import pytest
 from sqlalchemy.exc import SQLAlchemyError
 
 from tests.testutils import db
+from timed_release.connectors import sql
 from timed_release.constants import success
 from timed_release.models import product_live_time
 from timed_release.validation import validators
@@ -46,6 +49,23 @@ def test_create_product_live_time_details_success(
     assert insert_response.message == expected_response
 
 
+@db.test_schema
+def test_create_product_live_time_details_duplicate():
+    """Test that creating an existing product id is a conflict."""
+    product_id = 2080166
+    product_live_time.create_product_live_time_details(
+        product_id, '20:30:00', 'GMT', 286)
+
+    result = product_live_time.create_product_live_time_details(
+        product_id, '11:45:00', 'local', 286)
+
+    assert result.status == http_status.CONFLICT
+    assert result.errors == {
+        'code': 'conflict', 'message': 'Product id 2080166 already exists'}
+    assert product_live_time.get_product_live_time_details(
+        product_id).message['time_of_day_product'] == '20:30:00'
+
+
 @pytest.mark.parametrize(
     'description, product_id, time_of_day_product, time_zone, store_id', [
         ('testing with product_id is non integer', '2080166xyz', '20:30:00',
@@ -220,3 +240,389 @@ def test_update_product_live_time_details_internal_error(monkeypatch):
         11, update_data)
 
     assert response.status == http_status.INTERNAL_ERROR
+
+
+@db.test_schema
+def test_get_product_live_time_details_batch():
+    """Test to get found and missing product live times at once."""
+    db.insert_product_live_time_data()
+    response = product_live_time.get_product_live_time_details_batch(
+        [12, 13])
+
+    assert response.status == http_status.OK
+    assert response.message == {
+        'products': {
+            '12': {
+                'product_id': 12,
+                'time_of_day_product': '20:30:00',
+                'time_zone': 'GMT',
+                'store_id': 1}},
+        'missing': [13]}
+
+
+@db.test_schema
+def test_get_product_live_time_details_batch_chunks(monkeypatch):
+    """Test that ids are fetched over several IN clauses when needed."""
+    monkeypatch.setattr(product_live_time.config, 'BATCH_QUERY_CHUNK_SIZE', 1)
+    db.insert_product_live_time_data()
+    response = product_live_time.get_product_live_time_details_batch(
+        [11, 12, 13])
+
+    assert list(response.message['products']) == ['12']
+    assert response.message['missing'] == [11, 13]
+
+
+@db.test_schema
+def test_create_product_live_time_details_bulk(monkeypatch):
+    """Test bulk create only fails the records that already exist."""
+    monkeypatch.setattr(product_live_time.config, 'BULK_INSERT_CHUNK_SIZE', 2)
+    db.insert_product_live_time_data()
+    records = [
+        {'product_id': 11, 'time_of_day_product': '10:00:00',
+            'time_zone': 'GMT', 'store_id': 1},
+        {'product_id': 12, 'time_of_day_product': '10:00:00',
+            'time_zone': 'GMT'},
+        {'product_id': 13, 'time_of_day_product': datetime.time(9, 0),
+            'time_zone': 'local', 'store_id': 2}]
+
+    result = product_live_time.create_product_live_time_details_bulk(records)
+
+    assert result.status == http_status.OK
+    assert result.message[0] is None
+    assert result.message[1] == [{
+        'duplicate product id': 'Product id 12 already exists'}]
+    assert result.message[2] is None
+    assert product_live_time.get_product_live_time_details(11).message == {
+        'product_id': 11,
+        'time_of_day_product': '10:00:00',
+        'time_zone': 'GMT',
+        'store_id': 1}
+    assert product_live_time.get_product_live_time_details(13)
+
+
+@db.test_schema
+def test_create_product_live_time_details_bulk_constraint_errors():
+    """Test a record refused by a constraint is not reported as duplicate."""
+    records = [
+        {'product_id': 11, 'time_of_day_product': '10:00:00',
+            'time_zone': 'UTC'},
+        {'product_id': 12, 'time_of_day_product': '10:00:00',
+            'time_zone': 'GMT'}]
+
+    result = product_live_time.create_product_live_time_details_bulk(records)
+
+    assert list(result.message[0][0]) == ['invalid data']
+    assert result.message[1] is None
+
+
+@db.test_schema
+def test_create_product_live_time_details_constraint_error(monkeypatch):
+    """Test a record refused by a constraint is a bad request."""
+    monkeypatch.setattr(
+        validators, 'validate_timed_release_dataset',
+        MagicMock(return_value=None))
+
+    result = product_live_time.create_product_live_time_details(
+        11, '10:00:00', 'UTC', 1)
+
+    assert result.status == http_status.BAD_REQUEST
+    assert list(result.errors['message'][0]) == ['invalid data']
+
+
+@db.test_schema
+def test_upsert_product_live_time_details():
+    """Test upsert creates a missing product and replaces an existing one."""
+    db.insert_product_live_time_data()
+
+    for product_id in (11, 12):
+        result = product_live_time.upsert_product_live_time_details(
+            product_id, '10:20:30', 'local', 5)
+        assert result.status == http_status.OK
+
+    for product_id in (11, 12):
+        assert product_live_time.get_product_live_time_details(
+            product_id).message == {
+                'product_id': product_id,
+                'time_of_day_product': '10:20:30',
+                'time_zone': 'local',
+                'store_id': 5}
+
+
+def test_upsert_product_live_time_details_validation():
+    """Test upsert with an invalid time zone."""
+    result = product_live_time.upsert_product_live_time_details(
+        11, '10:20:30', 'UTC')
+
+    assert result.status == http_status.BAD_REQUEST
+
+
+@db.test_schema
+def test_upsert_product_live_time_details_bulk(monkeypatch):
+    """Test bulk upsert writes new and existing products."""
+    monkeypatch.setattr(product_live_time.config, 'BULK_INSERT_CHUNK_SIZE', 2)
+    db.insert_product_live_time_data()
+    records = [
+        {'product_id': product_id, 'time_of_day_product': '01:02:03',
+            'time_zone': 'GMT'}
+        for product_id in (11, 12, 13)]
+
+    result = product_live_time.upsert_product_live_time_details_bulk(records)
+
+    assert result.message == [None, None, None]
+    batch = product_live_time.get_product_live_time_details_batch(
+        [11, 12, 13])
+    assert batch.message['missing'] == []
+    assert batch.message['products']['12']['time_of_day_product'] == \
+        '01:02:03'
+    assert batch.message['products']['12']['store_id'] is None
+
+
+@db.test_schema
+def test_get_product_live_time_details_cached():
+    """Test a product is cached on read and invalidated on write."""
+    db.insert_product_live_time_data()
+    product_live_time.get_product_live_time_details('12')
+    product_live_time.get_product_live_time_details('12')
+    product_live_time.get_product_live_time_details_batch([12])
+    assert product_live_time.product_cache.hits == 2
+
+    product_live_time.update_product_live_time_details(
+        12, {'time_zone': 'local'})
+    response = product_live_time.get_product_live_time_details('12')
+    assert response.message['time_zone'] == 'local'
+
+    product_live_time.delete_product_live_time_details(12)
+    response = product_live_time.get_product_live_time_details('12')
+    assert response.status == http_status.NOT_FOUND
+
+
+@db.test_schema
+def test_get_product_live_time_details_not_found_cached(monkeypatch):
+    """Test a product not found is cached with its own time to live."""
+    mock_set = MagicMock()
+    monkeypatch.setattr(product_live_time.product_cache, 'set', mock_set)
+
+    product_live_time.get_product_live_time_details('12')
+
+    mock_set.assert_called_with(
+        12, None, ttl=product_live_time.config.
+        PRODUCT_CACHE_NOT_FOUND_TTL_SECONDS, token=ANY)
+
+
+@db.test_schema
+@pytest.mark.parametrize(
+    'description, start_time, end_time, store_id, expected_product_ids', [
+        ('Window within the day', '10:00:00', '12:00:00', None, [2, 3]),
+        ('Window wrapping past midnight', '22:00:00', '10:00:00', None,
+            [4, 1, 2]),
+        ('Window of a store', '00:00:00', '23:59:59', 2, [3, 4])])
+def test_get_products_going_live(
+        description, start_time, end_time, store_id, expected_product_ids):
+    """Test products going live in a window are ordered by time of day."""
+    product_live_time.create_product_live_time_details_bulk([
+        {'product_id': product_id, 'time_of_day_product': time_of_day,
+            'time_zone': 'GMT', 'store_id': store}
+        for product_id, time_of_day, store in (
+            (1, '01:00:00', 1), (2, '10:00:00', 1), (3, '12:00:00', 2),
+            (4, '23:00:00', 2))])
+
+    result = product_live_time.get_products_going_live(
+        start_time, end_time, store_id)
+
+    assert [product['product_id'] for product in result.message[
+        'products']] == expected_product_ids
+    assert not result.message['truncated']
+
+
+@db.test_schema
+def test_get_products_going_live_truncated(monkeypatch):
+    """Test the products going live are limited."""
+    monkeypatch.setattr(product_live_time.config, 'WINDOW_MAX_RESULTS', 1)
+    db.insert_product_live_time_data()
+    product_live_time.create_product_live_time_details(
+        13, '01:00:00', 'GMT', 1)
+
+    result = product_live_time.get_products_going_live(
+        '20:00:00', '02:00:00')
+
+    assert [product['product_id'] for product in result.message[
+        'products']] == [12]
+    assert result.message['truncated']
+
+
+@db.test_schema
+def test_get_store_products():
+    """Test the products of a store are paged in time of day order."""
+    product_live_time.create_product_live_time_details_bulk([
+        {'product_id': product_id, 'time_of_day_product': time_of_day,
+            'time_zone': 'GMT', 'store_id': store}
+        for product_id, time_of_day, store in (
+            (1, '10:00:00', 1), (2, '09:00:00', 1), (3, '10:00:00', 1),
+            (4, '08:00:00', 2), (5, '11:00:00', 1))])
+
+    first_page = product_live_time.get_store_products(1, 2)
+    assert [product['product_id'] for product in first_page.message[
+        'products']] == [2, 1]
+    assert first_page.message['has_more']
+
+    second_page = product_live_time.get_store_products(
+        1, 2, ('10:00:00', 1))
+    assert [product['product_id'] for product in second_page.message[
+        'products']] == [3, 5]
+    assert not second_page.message['has_more']
+
+    last_page = product_live_time.get_store_products(1, 2, ('11:00:00', 5))
+    assert last_page.message == {'products': [], 'has_more': False}
+
+
+def test_product_live_time_record():
+    """Test records read like product live time dicts and encode JSON."""
+    record = product_live_time.ProductLiveTimeRecord(
+        12, '20:30:00', 'GMT', None)
+
+    assert record == {
+        'product_id': 12, 'time_of_day_product': '20:30:00',
+        'time_zone': 'GMT', 'store_id': None}
+    assert record['time_zone'] == 'GMT'
+    assert record.get('comment') is None
+    assert json.loads(record.to_json()) == record.to_dict()
+    assert record.to_json() is record.to_json()
+
+
+def test_product_live_time_record_from_row():
+    """Test times are formatted like str on a time."""
+    for time_value in (datetime.time(8, 5, 3), datetime.time(8, 5, 3, 20)):
+        record = product_live_time.ProductLiveTimeRecord.from_row(
+            (1, time_value, 'local', 2))
+
+        assert record.time_of_day_product == str(time_value)
+
+
+@db.test_schema
+def test_get_product_live_time_details_reads_records():
+    """Test single and batch reads return records."""
+    db.insert_product_live_time_data()
+
+    product = product_live_time.get_product_live_time_details(12).message
+    batch = product_live_time.get_product_live_time_details_batch([12])
+
+    assert isinstance(product, product_live_time.ProductLiveTimeRecord)
+    assert batch.message['products']['12'] is product
+
+
+def test_product_ids_parameters():
+    """Test IN (...) lists are padded to a power of two with the last id."""
+    assert product_live_time._product_ids_parameters([7]) == (
+        1, {'product_id_0': 7})
+    assert product_live_time._product_ids_parameters([7, 8, 9]) == (4, {
+        'product_id_0': 7, 'product_id_1': 8, 'product_id_2': 9,
+        'product_id_3': 9})
+
+
+@db.test_schema
+def test_statements_are_compiled_once():
+    """Test repeated reads and writes reuse their compiled statements."""
+    db.insert_product_live_time_data()
+    product_live_time.delete_product_live_time_details(11)
+    product_live_time.update_product_live_time_details(
+        12, {'time_zone': 'GMT'})
+    product_live_time.get_products_going_live('00:00:00', '23:59:59')
+    misses = sql.statement_cache.misses
+    hits = sql.statement_cache.hits
+
+    product_live_time.delete_product_live_time_details(11)
+    product_live_time.update_product_live_time_details(
+        12, {'time_zone': 'local'})
+    product_live_time.get_products_going_live('01:00:00', '02:00:00')
+
+    assert sql.statement_cache.misses == misses
+    assert sql.statement_cache.hits == hits + 3
+
+
+@db.test_schema
+def test_reads_do_not_open_sessions(monkeypatch):
+    """Test reads use a read connection instead of a session."""
+    db.insert_product_live_time_data()
+    monkeypatch.setattr(sql, 'db_session', None)
+
+    assert product_live_time.get_product_live_time_details(12).status == \
+        http_status.OK
+    assert list(product_live_time.get_product_live_time_details_batch(
+        [12]).message['products']) == ['12']
+    assert product_live_time.get_products_going_live(
+        '00:00:00', '23:59:59').message['products']
+    assert product_live_time.get_store_products(1, 10).message['products']
+    assert [product['product_id'] for product in
+            product_live_time.iter_product_live_times()] == [12]
+
+
+@pytest.fixture
+def sharded(monkeypatch, tmpdir):
+    """Spread the product live times over three SQLite shards."""
+    shard_map = db.create_shard_map(tmpdir, 3)
+    monkeypatch.setattr(sql, 'shard_map', shard_map)
+    product_live_time.product_cache.clear()
+    yield shard_map
+    product_live_time.product_cache.clear()
+
+
+def create_products(count):
+    """Create products 1 to count, with times going back from 23:00."""
+    product_live_time.create_product_live_time_details_bulk([
+        {'product_id': product_id,
+         'time_of_day_product': '{:02d}:00:00'.format(23 - product_id % 24),
+         'time_zone': 'GMT', 'store_id': 1}
+        for product_id in range(1, count + 1)])
+
+
+def count_shard_products(shard):
+    """Count the products stored in a shard."""
+    return sum(
+        len(rows) for rows in product_live_time.iter_shard_rows(shard, 100))
+
+
+def test_sharded_writes_go_to_one_shard(sharded):
+    """Test each product is stored in the shard the map assigns it to."""
+    create_products(30)
+    product_live_time.upsert_product_live_time_details(
+        31, '10:00:00', 'GMT', 1)
+
+    counts = [count_shard_products(shard) for shard in sharded.shards]
+    assert sum(counts) == 31
+    assert all(counts)
+    for product_id in range(1, 32):
+        with sql.db_read_connection(sharded.get(product_id)) as connection:
+            assert sql.execute(
+                connection, product_live_time._select_product,
+                {'product_id': product_id}).first()
+
+    assert product_live_time.update_product_live_time_details(
+        5, {'time_zone': 'local'}).status == http_status.OK
+    assert product_live_time.get_product_live_time_details(
+        5).message['time_zone'] == 'local'
+    assert product_live_time.delete_product_live_time_details(
+        5).status == http_status.OK
+    assert product_live_time.get_product_live_time_details(
+        5).status == http_status.NOT_FOUND
+
+
+def test_sharded_reads_are_merged(sharded):
+    """Test list, window and export queries merge all the shards."""
+    create_products(30)
+
+    batch = product_live_time.get_product_live_time_details_batch(
+        [1, 2, 3, 40])
+    window = product_live_time.get_products_going_live(
+        '20:00:00', '01:00:00').message['products']
+    page = product_live_time.get_store_products(1, 5).message
+    exported = list(product_live_time.iter_product_live_times())
+
+    assert sorted(batch.message['products']) == ['1', '2', '3']
+    assert batch.message['missing'] == [40]
+    assert [product['product_id'] for product in window] == [
+        3, 27, 2, 26, 1, 25, 24, 23, 22]
+    assert [product['product_id'] for product in page['products']] == [
+        23, 22, 21, 20, 19]
+    assert page['has_more']
+    assert [product['product_id'] for product in exported] == list(
+        range(1, 31))
@@ -0,0 +1,178 @@
+"""Tests for the in-memory time of day index."""
+
+import threading
+from unittest.mock import MagicMock
+
+from sqlalchemy import exc
+
+from tests.testutils import db
+from timed_release.connectors.sql import db_session
+from timed_release.models import product_live_time
+from timed_release.models import time_index
+
+
+def product(product_id, time_of_day_product, store_id=None):
+    """Create a product live time dict."""
+    return {
+        'product_id': product_id,
+        'time_of_day_product': time_of_day_product,
+        'time_zone': 'GMT',
+        'store_id': store_id}
+
+
+def test_window():
+    """Test windows are answered in time of day order, wrapping at night."""
+    index = time_index.TimeOfDayIndex()
+    index.load([
+        product(1, '23:30:00', 1),
+        product(2, '00:15:00', 2),
+        product(3, '12:00:00', 1),
+        product(4, '23:30:00', 2)])
+
+    assert len(index) == 4
+    assert index.window(0, 86399) == [2, 3, 1, 4]
+    assert index.window(43200, 43200) == [3]
+    assert index.window(84600, 1800) == [1, 4, 2]
+    assert index.window(84600, 1800, store_id=2) == [4, 2]
+    assert index.window(84600, 1800, limit=2) == [1, 4]
+    assert index.window(84600, 1800, store_id=3) == []
+
+
+def test_update_and_remove():
+    """Test products are moved and removed from the index."""
+    index = time_index.TimeOfDayIndex()
+    index.load([product(1, '10:00:00', 1), product(2, '11:00:00', 1)])
+
+    index.update(product(1, '12:00:00', 2))
+    index.update(product(3, '09:00:00'))
+    assert index.window(0, 86399) == [3, 2, 1]
+    assert index.window(0, 86399, store_id=1) == [2]
+    assert index.window(0, 86399, store_id=2) == [1]
+
+    index.remove(2)
+    index.remove(5)
+    assert index.window(0, 86399) == [3, 1]
+    assert index.window(0, 86399, store_id=1) == []
+
+
+def test_large_product_ids():
+    """Test ids above 32 bits are indexed, and those not fitting skipped."""
+    index = time_index.TimeOfDayIndex()
+    index.load([
+        product(2 ** 32 + 1, '10:00:00', 1),
+        product(time_index.MAX_PRODUCT_ID, '10:00:00', 1),
+        product(time_index.MAX_PRODUCT_ID + 1, '09:00:00', 1),
+        product(1, '10:00:01')])
+
+    index.update(product(2 ** 64, '00:00:00', 1))
+    assert len(index) == 3
+    assert index.window(0, 86399) == [
+        2 ** 32 + 1, time_index.MAX_PRODUCT_ID, 1]
+    assert index.window(0, 86399, store_id=1) == [
+        2 ** 32 + 1, time_index.MAX_PRODUCT_ID]
+
+
+@db.test_schema
+def test_get_time_index_follows_writes():
+    """Test the index is loaded and follows the writes of the model."""
+    db.insert_product_live_time_data()
+    try:
+        index = time_index.get_time_index()
+        assert index.window(0, 86399) == [12]
+
+        product_live_time.create_product_live_time_details(
+            13, '01:00:00', 'GMT', 1)
+        product_live_time.delete_product_live_time_details(12)
+        assert index.window(0, 86399) == [13]
+        assert time_index.get_time_index() is index
+    finally:
+        time_index.reset_time_index()
+
+
+def start_stale_reload(monkeypatch):
+    """Get the index once it is too old, which starts a reload."""
+    monkeypatch.setattr(time_index.config, 'WINDOW_INDEX_RELOAD_SECONDS', 0)
+    index = time_index.get_time_index()
+    monkeypatch.setattr(
+        time_index.config, 'WINDOW_INDEX_RELOAD_SECONDS', 300)
+    return index
+
+
+def wait_for_reload():
+    """Wait until the background reload is over."""
+    reload_thread = time_index._reload_thread
+    if reload_thread is not None:
+        reload_thread.join(5)
+
+
+@db.test_schema
+def test_get_time_index_reloads(monkeypatch):
+    """Test the index is reloaded to see the writes of other processes."""
+    try:
+        index = time_index.get_time_index()
+        assert index.window(0, 86399) == []
+        db.insert_product_live_time_data()
+        with db_session():
+            pass
+
+        assert start_stale_reload(monkeypatch) is index
+        wait_for_reload()
+        assert time_index.get_time_index().window(0, 86399) == [12]
+    finally:
+        time_index.reset_time_index()
+
+
+@db.test_schema
+def test_get_time_index_reloads_in_background(monkeypatch):
+    """Test readers use the last index while a new one is built."""
+    iter_product_live_times = product_live_time.iter_product_live_times
+    scanning = threading.Event()
+    scanned = threading.Event()
+
+    def slow_iter_product_live_times():
+        scanning.set()
+        scanned.wait(5)
+        return iter_product_live_times()
+
+    db.insert_product_live_time_data()
+    try:
+        index = time_index.get_time_index()
+        monkeypatch.setattr(
+            product_live_time, 'iter_product_live_times',
+            slow_iter_product_live_times)
+        start_stale_reload(monkeypatch)
+        assert scanning.wait(5)
+
+        assert time_index.get_time_index() is index
+        product_live_time.create_product_live_time_details(
+            13, '01:00:00', 'GMT', 1)
+        assert index.window(0, 86399) == [13, 12]
+
+        scanned.set()
+        wait_for_reload()
+        reloaded_index = time_index.get_time_index()
+        assert reloaded_index is not index
+        assert reloaded_index.window(0, 86399) == [13, 12]
+    finally:
+        scanned.set()
+        wait_for_reload()
+        time_index.reset_time_index()
+
+
+@db.test_schema
+def test_get_time_index_keeps_index_on_reload_errors(monkeypatch):
+    """Test the last index is kept when the table cannot be read."""
+    db.insert_product_live_time_data()
+    try:
+        index = time_index.get_time_index()
+        monkeypatch.setattr(
+            product_live_time, 'iter_product_live_times',
+            MagicMock(side_effect=exc.OperationalError('', {}, None)))
+        start_stale_reload(monkeypatch)
+        wait_for_reload()
+
+        assert time_index.get_time_index() is index
+        assert index.window(0, 86399) == [12]
+        assert time_index._reload_thread is None
+    finally:
+        time_index.reset_time_index()
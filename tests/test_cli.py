@@ -0,0 +1,92 @@
+"""Tests for the command line interface."""
+
+from unittest.mock import MagicMock
+
+from oto import response
+
+from timed_release import cli
+from timed_release import rebalance
+from timed_release import scheduler
+from timed_release.logic import product_export
+from timed_release.logic import product_import
+
+
+def test_export(monkeypatch, tmpdir):
+    """Test the export is written to the output file."""
+    mock_export = MagicMock(return_value=response.Response(
+        message=iter(['a\n', 'b\n'])))
+    monkeypatch.setattr(
+        product_export, 'export_product_live_times', mock_export)
+    output = tmpdir.join('dump.csv')
+
+    status = cli.main([
+        'export', '--format', 'csv', '--store-id', '1',
+        '--output', str(output)])
+
+    assert status == 0
+    assert output.read() == 'a\nb\n'
+    mock_export.assert_called_with('csv', '1', None)
+
+
+def test_export_validation_error(monkeypatch, capsys):
+    """Test the validation errors are printed."""
+    monkeypatch.setattr(
+        product_export, 'export_product_live_times',
+        MagicMock(return_value=response.create_error_response(
+            code='bad_request', message='Invalid')))
+
+    status = cli.main(['export'])
+
+    assert status == 1
+    assert 'Invalid' in capsys.readouterr().err
+
+
+def test_no_command():
+    """Test the help is printed without command."""
+    assert cli.main([]) == 2
+
+
+def test_import(monkeypatch, tmpdir, capsys):
+    """Test the file is imported and the summary printed."""
+    mock_import = MagicMock(return_value=response.Response(
+        message={'processed': 0}))
+    monkeypatch.setattr(
+        product_import, 'import_product_live_times', mock_import)
+    input_file = tmpdir.join('dump.csv')
+    input_file.write('product_id\n')
+
+    status = cli.main([
+        'import', '--format', 'csv', '--offset', '2', str(input_file)])
+
+    assert status == 0
+    assert '"processed": 0' in capsys.readouterr().out
+    assert mock_import.call_args[0][1:3] == ('csv', 2)
+
+
+def test_schedule(monkeypatch):
+    """Test the scheduler is served until interrupted."""
+    mock_serve = MagicMock(side_effect=KeyboardInterrupt)
+    monkeypatch.setattr(scheduler, 'serve', mock_serve)
+
+    status = cli.main(['schedule', '--sync-seconds', '30'])
+
+    assert status == 0
+    mock_serve.assert_called_with(scheduler.log_release, 30.0)
+
+
+def test_rebalance(monkeypatch, capsys):
+    """Test the rebalance summary is printed, the progress on stderr."""
+    def mock_rebalance(target_map, batch_size, dry_run, progress):
+        summary = {'scanned': 10, 'moved': {'shard0->shard1': 4}}
+        progress(summary)
+        return summary
+
+    monkeypatch.setattr(rebalance, 'rebalance', mock_rebalance)
+
+    status = cli.main([
+        'rebalance', 'sqlite://', '--batch-size', '5', '--dry-run'])
+
+    output = capsys.readouterr()
+    assert status == 0
+    assert '"shard0->shard1": 4' in output.out
+    assert output.err == '10 rows scanned, 4 moved\n'
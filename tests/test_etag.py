@@ -0,0 +1,33 @@
+"""Tests for entity tags."""
+
+from timed_release import etag
+
+
+PRODUCT = {
+    'product_id': 12,
+    'time_of_day_product': '20:30:00',
+    'time_zone': 'GMT',
+    'store_id': 1}
+
+
+def test_compute_product_etag():
+    """Test the tag of a product only changes when the product changes."""
+    product_etag = etag.compute_product_etag(PRODUCT)
+
+    assert product_etag == etag.compute_product_etag(dict(PRODUCT))
+    assert product_etag != etag.compute_product_etag(
+        dict(PRODUCT, time_zone='local'))
+
+
+def test_compute_collection_etag():
+    """Test the tag of a collection does not depend on the order."""
+    other_product = dict(PRODUCT, product_id=13)
+    collection_etag = etag.compute_collection_etag(
+        [PRODUCT, other_product], [14, 15])
+
+    assert collection_etag == etag.compute_collection_etag(
+        [other_product, PRODUCT], [15, 14])
+    assert collection_etag != etag.compute_collection_etag(
+        [PRODUCT, other_product], [14])
+    assert collection_etag != etag.compute_collection_etag(
+        [PRODUCT, dict(other_product, store_id=2)], [14, 15])
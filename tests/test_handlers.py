@@ -8,10 +8,14 @@ from oto import response
 from oto import status as http_status
 import pytest
 
+from tests.testutils import db
 from timed_release import handlers
+from timed_release import metrics
 from timed_release.api import app
 from timed_release.constants import error
 from timed_release.constants import success
+from timed_release.logic import product_export
+from timed_release.logic import product_import
 from timed_release.logic import product_live_time
 
 
@@ -175,6 +179,28 @@ def test_create_product_live_time_detail_db_failure(mocker):
         assert result.status_code == http_status.INTERNAL_ERROR
 
 
+@db.test_schema
+def test_create_product_live_time_detail_duplicate():
+    """Test that creating an existing product is a conflict."""
+    request_body = json.dumps({
+        'product_id': 2080166,
+        'time_of_day_product': '20:15:00',
+        'time_zone': 'local',
+        'store_id': 286})
+
+    with app.test_client() as client:
+        client.post(
+            '/product', data=request_body, content_type='application/json')
+        result = client.post(
+            '/product', data=request_body, content_type='application/json')
+        message = json.loads(result.data.decode())
+
+        assert result.status_code == http_status.CONFLICT
+        assert message == {
+            'code': error.ERROR_CODE_CONFLICT,
+            'message': 'Product id 2080166 already exists'}
+
+
 @pytest.mark.parametrize('description, request_body', [
     ('test with empty request body', ''),
     ('test with invalid data passed to request body', 'abc')])
@@ -216,3 +242,270 @@ def test_delete_product_live_details_for_not_found(monkeypatch):
     result = app.test_client().delete(request_url)
 
     assert result.status_code == http_status.NOT_FOUND
+
+
+def test_get_product_live_details_batch(monkeypatch):
+    """Test batch get product live time with ids in the query string."""
+    expected_response = {'products': {}, 'missing': [1, 2]}
+    mock_get_batch = MagicMock(
+        return_value=response.Response(message=expected_response))
+    monkeypatch.setattr(
+        product_live_time, 'get_product_live_time_details_batch',
+        mock_get_batch)
+
+    result = app.test_client().get('/products?ids=1,2')
+
+    assert result.status_code == http_status.OK
+    assert json.loads(result.data.decode()) == expected_response
+    mock_get_batch.assert_called_with(['1', '2'])
+
+
+def test_lookup_product_live_details(monkeypatch):
+    """Test batch get product live time with ids in the body."""
+    expected_response = {'products': {}, 'missing': [1, 2]}
+    mock_get_batch = MagicMock(
+        return_value=response.Response(message=expected_response))
+    monkeypatch.setattr(
+        product_live_time, 'get_product_live_time_details_batch',
+        mock_get_batch)
+
+    with app.test_client() as client:
+        result = client.post(
+            '/products/lookup', data=json.dumps({'product_ids': [1, 2]}),
+            content_type='application/json')
+
+    assert result.status_code == http_status.OK
+    mock_get_batch.assert_called_with([1, 2])
+
+
+@pytest.mark.parametrize('description, request_body', [
+    ('test with empty request body', ''),
+    ('test with product_ids not being a list', '{"product_ids": 1}'),
+    ('test with a product id of Unicode digits',
+     '{"product_ids": ["\\u00b2"]}')])
+def test_lookup_product_live_details_invalid_request_body(
+        description, request_body):
+    """Test batch get product live time with an invalid body."""
+    with app.test_client() as client:
+        result = client.post(
+            '/products/lookup', data=request_body,
+            content_type='application/json')
+
+    assert result.status_code == http_status.BAD_REQUEST
+
+
+def test_create_product_live_time_details_bulk(monkeypatch):
+    """Test bulk create product live time details."""
+    request_body = [{
+        'product_id': 2080166,
+        'time_of_day_product': '20:15:00',
+        'time_zone': 'local'}]
+    mock_create_bulk = MagicMock(return_value=response.Response(
+        message={'results': [], 'created': 1, 'failed': 0}))
+    monkeypatch.setattr(
+        product_live_time, 'create_product_live_time_details_bulk',
+        mock_create_bulk)
+
+    with app.test_client() as client:
+        result = client.post(
+            '/products', data=json.dumps(request_body),
+            content_type='application/json')
+
+    assert result.status_code == http_status.OK
+    mock_create_bulk.assert_called_with(request_body)
+
+
+def test_create_product_live_time_details_bulk_invalid_request_body():
+    """Test bulk create product live time details with an object body."""
+    with app.test_client() as client:
+        result = client.post(
+            '/products', data=json.dumps({'product_id': 1}),
+            content_type='application/json')
+
+    assert result.status_code == http_status.BAD_REQUEST
+
+
+def test_upsert_product_live_time_detail(monkeypatch):
+    """Test upsert product live time detail."""
+    request_body = {'time_of_day_product': '20:15:00', 'time_zone': 'local'}
+    mock_upsert = MagicMock(return_value=response.Response(message={}))
+    monkeypatch.setattr(
+        product_live_time, 'upsert_product_live_time_detail', mock_upsert)
+
+    with app.test_client() as client:
+        result = client.put(
+            '/product/12', data=json.dumps(request_body),
+            content_type='application/json')
+
+    assert result.status_code == http_status.OK
+    mock_upsert.assert_called_with('12', request_body)
+
+
+def test_upsert_product_live_time_details_bulk(monkeypatch):
+    """Test bulk upsert product live time details."""
+    request_body = [{
+        'product_id': 2080166,
+        'time_of_day_product': '20:15:00',
+        'time_zone': 'local'}]
+    mock_upsert_bulk = MagicMock(return_value=response.Response(
+        message={'results': [], 'upserted': 1, 'failed': 0}))
+    monkeypatch.setattr(
+        product_live_time, 'upsert_product_live_time_details_bulk',
+        mock_upsert_bulk)
+
+    with app.test_client() as client:
+        result = client.put(
+            '/products', data=json.dumps(request_body),
+            content_type='application/json')
+
+    assert result.status_code == http_status.OK
+    mock_upsert_bulk.assert_called_with(request_body)
+
+
+def test_get_stats():
+    """Test the cache counters are exposed."""
+    result = app.test_client().get('/stats')
+
+    assert result.status_code == http_status.OK
+    assert 'product_cache' in json.loads(result.data.decode())
+
+
+def test_get_metrics():
+    """Test the metrics are exposed in the Prometheus text format."""
+    app.test_client().get('/stats')
+    result = app.test_client().get('/metrics')
+
+    assert result.status_code == http_status.OK
+    assert result.headers['Content-Type'] == metrics.CONTENT_TYPE
+    assert 'timed_release_requests_total{endpoint="get_stats",' \
+        'method="GET",status="200"} ' in result.data.decode()
+
+
+def test_get_product_live_time_detail_not_modified(monkeypatch):
+    """Test get product live time honors If-None-Match."""
+    product = {
+        'product_id': 122,
+        'time_of_day_product': '02:01:00',
+        'time_zone': 'GMT',
+        'store_id': 1}
+    monkeypatch.setattr(
+        product_live_time, 'get_product_live_time_details',
+        MagicMock(return_value=response.Response(message=product)))
+
+    with app.test_client() as client:
+        result = client.get('/product/122')
+        entity_tag = result.headers['ETag']
+        assert entity_tag
+
+        result = client.get(
+            '/product/122', headers={'If-None-Match': entity_tag})
+        assert result.status_code == 304
+        assert result.headers['ETag'] == entity_tag
+        assert not result.data
+
+        result = client.get(
+            '/product/122', headers={'If-None-Match': '"other"'})
+        assert result.status_code == http_status.OK
+
+
+def test_get_product_live_details_batch_not_modified(monkeypatch):
+    """Test batch get product live time honors If-None-Match."""
+    monkeypatch.setattr(
+        product_live_time, 'get_product_live_time_details_batch',
+        MagicMock(return_value=response.Response(
+            message={'products': {}, 'missing': [1]})))
+
+    with app.test_client() as client:
+        entity_tag = client.get('/products?ids=1').headers['ETag']
+        result = client.get(
+            '/products?ids=1', headers={'If-None-Match': entity_tag})
+
+    assert result.status_code == 304
+
+
+def test_export_product_live_details(monkeypatch):
+    """Test the export is streamed with the mimetype of the format."""
+    mock_export = MagicMock(return_value=response.Response(
+        message=iter(['{"product_id": 1}\n'])))
+    monkeypatch.setattr(
+        product_export, 'export_product_live_times', mock_export)
+
+    result = app.test_client().get('/products/export?store_id=1')
+
+    assert result.status_code == http_status.OK
+    assert result.mimetype == 'application/x-ndjson'
+    assert result.data.decode() == '{"product_id": 1}\n'
+    mock_export.assert_called_with('ndjson', '1', None)
+
+
+def test_export_product_live_details_validation(monkeypatch):
+    """Test the export validation errors are returned."""
+    result = app.test_client().get('/products/export?format=xml')
+
+    assert result.status_code == http_status.BAD_REQUEST
+
+
+def test_import_product_live_details(monkeypatch):
+    """Test the request body is imported with the format of its mimetype."""
+    mock_import = MagicMock(return_value=response.Response(
+        message={'processed': 1}))
+    monkeypatch.setattr(
+        product_import, 'import_product_live_times', mock_import)
+
+    with app.test_client() as client:
+        result = client.post(
+            '/products/import?offset=2', data='product_id\n1\n',
+            content_type='text/csv')
+
+    assert result.status_code == http_status.OK
+    assert mock_import.call_args[0][1:3] == ('csv', 2)
+
+
+@pytest.mark.parametrize('offset', ['-1', '', '\u00b2'])
+def test_import_product_live_details_invalid_offset(offset):
+    """Test the import offset must be a positive integer."""
+    with app.test_client() as client:
+        result = client.post(
+            '/products/import', query_string={'offset': offset}, data='')
+
+    assert result.status_code == http_status.BAD_REQUEST
+
+
+def test_get_products_going_live(monkeypatch):
+    """Test the going live window is read from the query string."""
+    mock_going_live = MagicMock(return_value=response.Response(
+        message={'products': [], 'truncated': False}))
+    monkeypatch.setattr(
+        product_live_time, 'get_products_going_live', mock_going_live)
+
+    result = app.test_client().get(
+        '/products/window?start=23:00:00&end=01:00:00')
+
+    assert result.status_code == http_status.OK
+    mock_going_live.assert_called_with('23:00:00', '01:00:00', None)
+
+
+def test_get_store_products(monkeypatch):
+    """Test the store listing is read from the path and query string."""
+    mock_store_products = MagicMock(return_value=response.Response(
+        message={'products': [], 'next_cursor': None}))
+    monkeypatch.setattr(
+        product_live_time, 'get_store_products', mock_store_products)
+
+    result = app.test_client().get('/store/1/products?limit=10&cursor=abc')
+
+    assert result.status_code == http_status.OK
+    mock_store_products.assert_called_with('1', '10', 'abc')
+
+
+def test_get_next_releases(monkeypatch):
+    """Test the next releases are read from the query string."""
+    mock_next_releases = MagicMock(return_value=response.Response(
+        message={'releases': {}, 'missing': [1]}))
+    monkeypatch.setattr(
+        product_live_time, 'get_next_releases', mock_next_releases)
+
+    result = app.test_client().get('/products/next-release?ids=1,2&at=10')
+
+    assert result.status_code == http_status.OK
+    mock_next_releases.assert_called_with(['1', '2'], '10')
@@ -0,0 +1,95 @@
+"""Tests for the metrics."""
+
+import threading
+
+import flask
+import pytest
+from sqlalchemy import create_engine
+
+from timed_release import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Record the metrics in an empty registry."""
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def test_counter_sums_threads(registry):
+    """Test the values of every thread are summed, ended threads included."""
+    counter = metrics.Counter('events_total', 'Events.', ('kind',))
+    counter.inc(('a',))
+    threads = [
+        threading.Thread(target=counter.inc, args=(('a',), 2))
+        for _ in range(3)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+    counter.inc(('b"\n',))
+
+    assert registry.render() == (
+        '# HELP events_total Events.\n'
+        '# TYPE events_total counter\n'
+        'events_total{kind="a"} 7\n'
+        'events_total{kind="b\\"\\n"} 1\n')
+    assert len(registry._threads) == 1
+    assert registry.collect() == {
+        ('events_total', ('a',)): 7, ('events_total', ('b"\n',)): 1}
+
+
+def test_histogram_buckets(registry):
+    """Test the histogram buckets are cumulative, with sum and count."""
+    histogram = metrics.Histogram(
+        'duration_seconds', 'Durations.', ('route',), (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, ('index',))
+
+    assert registry.render(families=[
+        ('up', 'gauge', 'Up.', [({}, 1)])]).splitlines() == [
+        '# HELP duration_seconds Durations.',
+        '# TYPE duration_seconds histogram',
+        'duration_seconds_bucket{route="index",le="0.1"} 2',
+        'duration_seconds_bucket{route="index",le="1"} 3',
+        'duration_seconds_bucket{route="index",le="+Inf"} 4',
+        'duration_seconds_sum{route="index"} 3.65',
+        'duration_seconds_count{route="index"} 4',
+        '# HELP up Up.',
+        '# TYPE up gauge',
+        'up 1']
+
+
+def test_requests_are_recorded():
+    """Test the requests are counted by endpoint, method and status."""
+    app = flask.Flask('test')
+    metrics.init_app(app)
+    app.add_url_rule('/', 'index', lambda: ('', 503))
+    before = metrics.registry.collect()
+
+    app.test_client().get('/')
+    app.test_client().get('/missing')
+
+    after = metrics.registry.collect()
+    key = ('timed_release_requests_total', ('index', 'GET', '503'))
+    assert after[key] - before.get(key, 0) == 1
+    key = ('timed_release_requests_total', ('none', 'GET', '404'))
+    assert after[key] - before.get(key, 0) == 1
+    key = ('timed_release_request_duration_seconds', ('index', '503'))
+    assert after[key][-1] - before.get(key, [0])[-1] == 1
+
+
+def test_queries_are_recorded():
+    """Test the queries are timed by SQL operation."""
+    engine = create_engine('sqlite://')
+    metrics.watch(engine)
+    key = ('timed_release_query_duration_seconds', ('SELECT',))
+    before = metrics.registry.collect().get(key, [0])[-1]
+
+    engine.execute('SELECT 1')
+    engine.execute('PRAGMA user_version')
+
+    totals = metrics.registry.collect()
+    assert totals[key][-1] - before == 1
+    assert totals[
+        'timed_release_query_duration_seconds', ('OTHER',)][-1] >= 1
@@ -0,0 +1,65 @@
+"""Tests for the shard rebalancing."""
+
+import pytest
+
+from tests.testutils import db
+from timed_release import rebalance
+from timed_release.connectors import sql
+from timed_release.models import product_live_time
+
+
+@pytest.fixture
+def single_shard(monkeypatch, tmpdir):
+    """Store 50 products in a single SQLite shard."""
+    shard_map = db.create_shard_map(tmpdir, 1)
+    monkeypatch.setattr(sql, 'shard_map', shard_map)
+    product_live_time.product_cache.clear()
+    product_live_time.create_product_live_time_details_bulk([
+        {'product_id': product_id, 'time_of_day_product': '10:00:00',
+         'time_zone': 'GMT', 'store_id': 1}
+        for product_id in range(1, 51)])
+    yield shard_map
+    product_live_time.product_cache.clear()
+
+
+def shard_product_ids(shard):
+    """Get the product ids stored in a shard."""
+    return [
+        row['product_id']
+        for rows in product_live_time.iter_shard_rows(shard, 100)
+        for row in rows]
+
+
+def test_rebalance(monkeypatch, tmpdir, single_shard):
+    """Test rows move to the shards of the new map, once."""
+    target_map = db.create_shard_map(tmpdir, 3)
+    progress = []
+
+    summary = rebalance.rebalance(
+        target_map, batch_size=20, progress=progress.append)
+
+    assert summary['scanned'] == 50
+    assert set(summary['moved']) == {'shard0->shard1', 'shard0->shard2'}
+    assert len(progress) == 3
+    for shard in target_map.shards:
+        product_ids = shard_product_ids(shard)
+        assert product_ids
+        assert all(target_map.get(product_id) is shard
+                   for product_id in product_ids)
+    assert sum(
+        len(shard_product_ids(shard)) for shard in target_map.shards) == 50
+
+    monkeypatch.setattr(sql, 'shard_map', target_map)
+    assert rebalance.rebalance(target_map) == {'scanned': 50, 'moved': {}}
+    assert product_live_time.get_product_live_time_details_batch(
+        list(range(1, 51))).message['missing'] == []
+
+
+def test_rebalance_dry_run(tmpdir, single_shard):
+    """Test a dry run counts the rows to move without moving them."""
+    summary = rebalance.rebalance(
+        db.create_shard_map(tmpdir, 3), dry_run=True)
+
+    assert summary['scanned'] == 50
+    assert sum(summary['moved'].values()) > 0
+    assert len(shard_product_ids(single_shard.shards[0])) == 50
@@ -0,0 +1,103 @@
+"""Tests for the release time resolution."""
+
+import datetime
+
+import pytest
+import pytz
+
+from timed_release import release_time
+
+
+NEW_YORK = pytz.timezone('America/New_York')
+
+
+def local_product(time_of_day_product, store_id=1):
+    """Create a local product live time dict."""
+    return {
+        'product_id': 1,
+        'time_of_day_product': time_of_day_product,
+        'time_zone': 'local',
+        'store_id': store_id}
+
+
+@pytest.fixture
+def store_time_zones(monkeypatch):
+    """Configure the store 1 in New York, and the others in UTC."""
+    monkeypatch.setattr(
+        release_time.config, 'STORE_TIME_ZONES', {1: 'America/New_York'})
+    monkeypatch.setattr(
+        release_time.config, 'DEFAULT_LOCAL_TIME_ZONE', 'UTC')
+
+
+def new_york_timestamp(*args, **kwargs):
+    """Get the timestamp of a New York wall time."""
+    return int(NEW_YORK.localize(
+        datetime.datetime(*args), **kwargs).timestamp())
+
+
+def test_resolve_time_zone(store_time_zones):
+    """Test local releases use the time zone of their store."""
+    assert str(release_time.resolve_time_zone('GMT', 1)) == 'UTC'
+    assert str(release_time.resolve_time_zone(
+        'local', 1)) == 'America/New_York'
+    assert str(release_time.resolve_time_zone('local', 2)) == 'UTC'
+    assert str(release_time.resolve_time_zone('local')) == 'UTC'
+
+
+def test_compute_next_releases(store_time_zones):
+    """Test next releases are computed for each time zone, in order."""
+    # 2016-06-01T12:00:00Z, 08:00 in New York
+    reference = 1464782400
+    products = [
+        local_product('09:00:00'),
+        {'product_id': 2, 'time_of_day_product': '11:00:00',
+            'time_zone': 'GMT', 'store_id': 1},
+        local_product('07:00:00'),
+        local_product('13:00:00', store_id=2)]
+
+    next_releases = release_time.compute_next_releases(products, reference)
+
+    assert next_releases.tolist() == [
+        reference + 3600,
+        reference + 23 * 3600,
+        reference + 23 * 3600,
+        reference + 3600]
+
+
+def test_compute_next_releases_empty():
+    """Test an empty batch has no releases."""
+    assert release_time.compute_next_releases([], 0).tolist() == []
+
+
+@pytest.mark.parametrize(
+    'description, time_of_day_product, expected', [
+        ('Before the change', '01:30:00', (2016, 3, 13, 1, 30)),
+        ('Skipped by the change', '02:30:00', (2016, 3, 13, 3, 30)),
+        ('After the change', '11:00:00', (2016, 3, 13, 11, 0))])
+def test_compute_next_releases_spring_forward(
+        store_time_zones, description, time_of_day_product, expected):
+    """Test releases on the day clocks go forward."""
+    reference = new_york_timestamp(2016, 3, 12, 12, 0)
+
+    next_releases = release_time.compute_next_releases(
+        [local_product(time_of_day_product)], reference)
+
+    assert next_releases.tolist() == [new_york_timestamp(*expected)]
+
+
+@pytest.mark.parametrize(
+    'description, time_of_day_product, expected', [
+        ('Before the change', '00:30:00', ((2016, 11, 6, 0, 30), True)),
+        ('Happening twice', '01:30:00', ((2016, 11, 6, 1, 30), False)),
+        ('After the change', '11:00:00', ((2016, 11, 6, 11, 0), False))])
+def test_compute_next_releases_fall_back(
+        store_time_zones, description, time_of_day_product, expected):
+    """Test releases on the day clocks go back."""
+    reference = new_york_timestamp(2016, 11, 5, 12, 0)
+    wall_time, is_dst = expected
+
+    next_releases = release_time.compute_next_releases(
+        [local_product(time_of_day_product)], reference)
+
+    assert next_releases.tolist() == [
+        new_york_timestamp(*wall_time, is_dst=is_dst)]
@@ -0,0 +1,247 @@
+"""Tests for the release scheduler."""
+
+import time
+
+import pytest
+
+from tests.testutils import db
+from timed_release import release_time
+from timed_release import scheduler
+from timed_release.models import product_live_time
+
+
+# 2016-01-01T00:00:00Z
+MIDNIGHT = 1451606400
+
+
+class FakeClock:
+    """Clock moved by hand, which never waits."""
+
+    def __init__(self, now):
+        self.current = now
+
+    def now(self):
+        return self.current
+
+    def wait(self, condition, timeout):
+        pass
+
+
+def product(product_id, time_of_day_product, time_zone='GMT', store_id=None):
+    """Create a product live time dict."""
+    return {
+        'product_id': product_id,
+        'time_of_day_product': time_of_day_product,
+        'time_zone': time_zone,
+        'store_id': store_id}
+
+
+def create_scheduler(now=MIDNIGHT):
+    """Create a scheduler recording the fired events."""
+    fired = []
+    release_scheduler = scheduler.ReleaseScheduler(
+        lambda product_id, fire_at: fired.append((product_id, fire_at)),
+        FakeClock(now))
+    return release_scheduler, fired
+
+
+def test_next_fire_time_gmt():
+    """Test GMT times fire today when still ahead, else tomorrow."""
+    assert scheduler.next_fire_time('GMT', 3600, MIDNIGHT) == MIDNIGHT + 3600
+    assert scheduler.next_fire_time('GMT', 0, MIDNIGHT) == MIDNIGHT + 86400
+    assert scheduler.next_fire_time(
+        'GMT', 60, MIDNIGHT + 7200) == MIDNIGHT + 86460
+
+
+@pytest.fixture
+def store_time_zones(monkeypatch):
+    """Configure the store 1 in Tokyo, and run the process in New York."""
+    monkeypatch.setattr(
+        scheduler.config, 'STORE_TIME_ZONES', {1: 'Asia/Tokyo'})
+    monkeypatch.setattr(scheduler.config, 'DEFAULT_LOCAL_TIME_ZONE', 'UTC')
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_next_fire_time_local(store_time_zones):
+    """Test local times fire at the time of the day of their store."""
+    # 2016-01-01T09:00:00 in Tokyo, 10:00:00 is 01:00:00Z.
+    assert scheduler.next_fire_time(
+        'local', 36000, MIDNIGHT, 1) == MIDNIGHT + 3600
+    assert scheduler.next_fire_time(
+        'local', 36000, MIDNIGHT, 2) == MIDNIGHT + 36000
+
+
+def test_local_releases_match_next_releases(store_time_zones):
+    """Test the scheduler fires local products at their next release."""
+    products = [
+        product(1, '10:00:00', 'local', 1), product(2, '10:00:00', 'local'),
+        product(3, '08:30:00', 'local', 1)]
+    release_scheduler, fired = create_scheduler()
+    release_scheduler.load(products)
+    release_scheduler.apply(product(4, '10:00:00', 'local', 1))
+
+    next_releases = release_time.compute_next_releases(
+        products + [product(4, '10:00:00', 'local', 1)], MIDNIGHT).tolist()
+    release_scheduler.clock.current = MIDNIGHT + 86400
+    release_scheduler.run_pending()
+    assert sorted(fired) == sorted(zip((1, 2, 3, 4), next_releases))
+    assert next_releases == [
+        MIDNIGHT + 3600, MIDNIGHT + 36000, MIDNIGHT + 84600, MIDNIGHT + 3600]
+
+
+def test_run_pending_fires_and_rearms():
+    """Test due events are fired in time order and re-armed for tomorrow."""
+    release_scheduler, fired = create_scheduler()
+    release_scheduler.load([
+        product(1, '02:00:00'), product(2, '01:00:00'),
+        product(3, '03:00:00')])
+
+    assert len(release_scheduler) == 3
+    assert release_scheduler.seconds_until_next() == 3600
+    assert release_scheduler.run_pending() == 0
+
+    release_scheduler.clock.current = MIDNIGHT + 7200
+    assert release_scheduler.run_pending() == 2
+    assert fired == [(2, MIDNIGHT + 3600), (1, MIDNIGHT + 7200)]
+    assert release_scheduler.seconds_until_next() == 3600
+
+    release_scheduler.clock.current = MIDNIGHT + 86400 + 3600
+    assert release_scheduler.run_pending() == 2
+    assert fired[2:] == [(3, MIDNIGHT + 10800), (2, MIDNIGHT + 90000)]
+    assert release_scheduler.fired_count == 4
+
+
+def test_large_product_ids():
+    """Test ids above 32 bits are fired, and those not fitting skipped."""
+    release_scheduler, fired = create_scheduler()
+    release_scheduler.load([
+        product(2 ** 32 + 1, '01:00:00'),
+        product(scheduler.MAX_PRODUCT_ID, '02:00:00'),
+        product(scheduler.MAX_PRODUCT_ID + 1, '00:30:00')])
+    release_scheduler.apply(product(2 ** 64, '00:10:00'))
+    release_scheduler.apply(product(1, '01:00:00'))
+
+    assert len(release_scheduler) == 3
+    release_scheduler.clock.current = MIDNIGHT + 7200
+    assert release_scheduler.run_pending() == 3
+    assert fired == [
+        (1, MIDNIGHT + 3600), (2 ** 32 + 1, MIDNIGHT + 3600),
+        (scheduler.MAX_PRODUCT_ID, MIDNIGHT + 7200)]
+
+
+def test_run_pending_survives_callback_errors():
+    """Test a failing callback does not stop the other events."""
+    calls = []
+
+    def callback(product_id, fire_at):
+        calls.append(product_id)
+        raise ValueError('Boom')
+
+    release_scheduler = scheduler.ReleaseScheduler(
+        callback, FakeClock(MIDNIGHT))
+    release_scheduler.load([product(1, '00:00:01'), product(2, '00:00:02')])
+    release_scheduler.clock.current = MIDNIGHT + 2
+
+    assert release_scheduler.run_pending() == 2
+    assert calls == [1, 2]
+
+
+def test_apply_and_remove():
+    """Test changed products are rescheduled and removed ones unscheduled."""
+    release_scheduler, fired = create_scheduler()
+    release_scheduler.load([product(1, '01:00:00'), product(2, '02:00:00')])
+
+    release_scheduler.apply(product(1, '03:00:00'))
+    release_scheduler.apply(product(3, '00:30:00'))
+    release_scheduler.remove(2)
+    release_scheduler.remove(4)
+
+    assert len(release_scheduler) == 2
+    release_scheduler.clock.current = MIDNIGHT + 86399
+    release_scheduler.run_pending()
+    assert fired == [(3, MIDNIGHT + 1800), (1, MIDNIGHT + 10800)]
+
+
+def test_sync():
+    """Test a snapshot only reschedules the products that changed."""
+    release_scheduler, fired = create_scheduler()
+    release_scheduler.load([product(1, '01:00:00'), product(2, '02:00:00')])
+    heap_size = len(release_scheduler._heap)
+
+    release_scheduler.sync([product(1, '01:00:00'), product(2, '02:00:00')])
+    assert len(release_scheduler._heap) == heap_size
+
+    release_scheduler.sync([product(2, '00:10:00'), product(3, '04:00:00')])
+    assert len(release_scheduler) == 2
+    release_scheduler.clock.current = MIDNIGHT + 86399
+    release_scheduler.run_pending()
+    assert fired == [(2, MIDNIGHT + 600), (3, MIDNIGHT + 14400)]
+
+
+def test_sync_keeps_due_events():
+    """Test a sync between a due instant and run_pending keeps the event."""
+    release_scheduler, fired = create_scheduler(MIDNIGHT + 35990)
+    release_scheduler.load([product(1, '10:00:00')])
+
+    release_scheduler.clock.current = MIDNIGHT + 36001
+    release_scheduler.sync([product(1, '10:00:00')])
+    release_scheduler.on_products_changed([])
+
+    assert release_scheduler.run_pending() == 1
+    assert fired == [(1, MIDNIGHT + 36000)]
+    assert release_scheduler.seconds_until_next() == 86399
+
+
+def test_stale_entries_are_compacted():
+    """Test the heap is rebuilt when stale entries outnumber the live ones."""
+    release_scheduler, _ = create_scheduler()
+    release_scheduler.load([product(1, '01:00:00')])
+
+    for second in range(5000):
+        release_scheduler.apply(product(1, time.strftime(
+            '%H:%M:%S', time.gmtime(second + 1))))
+
+    assert len(release_scheduler._heap) <= 2 * len(release_scheduler) + 1024
+    assert release_scheduler.seconds_until_next() == 5000
+
+
+def test_start_and_stop():
+    """Test the scheduler thread fires due events and stops."""
+    release_scheduler, fired = create_scheduler(MIDNIGHT + 3600)
+    release_scheduler.load([product(1, '01:00:00')])
+    release_scheduler.clock.current = MIDNIGHT + 86400 + 3600
+
+    release_scheduler.start()
+    deadline = time.time() + 5
+    while not fired and time.time() < deadline:
+        time.sleep(0.01)
+    release_scheduler.stop(timeout=5)
+
+    assert fired[0] == (1, MIDNIGHT + 86400 + 3600)
+
+
+@db.test_schema
+def test_on_products_changed():
+    """Test the scheduler follows the writes of the model."""
+    release_scheduler, fired = create_scheduler()
+    release_scheduler.load([product(12, '01:00:00'), product(13, '02:00:00')])
+    product_live_time.add_change_listener(
+        release_scheduler.on_products_changed)
+    try:
+        product_live_time.create_product_live_time_details(
+            12, '00:20:00', 'GMT', 1)
+        product_live_time.create_product_live_time_details(
+            13, '02:00:00', 'GMT', 1)
+        product_live_time.delete_product_live_time_details(13)
+    finally:
+        product_live_time.remove_change_listener(
+            release_scheduler.on_products_changed)
+
+    assert len(release_scheduler) == 1
+    release_scheduler.clock.current = MIDNIGHT + 86399
+    release_scheduler.run_pending()
+    assert fired == [(12, MIDNIGHT + 1200)]
@@ -0,0 +1,31 @@
+"""Tests for the JSON serialization of product live times."""
+
+import json
+
+from timed_release import serialization
+from timed_release.models import product_live_time
+
+
+def test_encode_product():
+    """Test records and dicts are encoded alike."""
+    product = {
+        'product_id': 12, 'time_of_day_product': '20:30:00',
+        'time_zone': 'local', 'store_id': 1}
+    record = product_live_time.ProductLiveTimeRecord(**product)
+
+    assert json.loads(serialization.encode_product(record)) == product
+    assert json.loads(serialization.encode_product(product)) == product
+
+
+def test_encode_product_batch():
+    """Test batches are encoded with their products and missing ids."""
+    record = product_live_time.ProductLiveTimeRecord(
+        12, '20:30:00', 'GMT', None)
+
+    encoded_batch = serialization.encode_product_batch(
+        {'products': {'12': record}, 'missing': [13]})
+
+    assert json.loads(encoded_batch) == {
+        'products': {'12': record.to_dict()}, 'missing': [13]}
+    assert json.loads(serialization.encode_product_batch(
+        {'products': {}, 'missing': []})) == {'products': {}, 'missing': []}
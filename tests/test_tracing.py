@@ -0,0 +1,98 @@
+"""Tests for the request tracing."""
+
+import re
+
+import flask
+import pytest
+from sqlalchemy import create_engine
+
+from timed_release import config
+from timed_release import metrics
+from timed_release import tracing
+
+
+engine = create_engine('sqlite://')
+tracing.watch(engine)
+
+
+@tracing.traced('model')
+def read_model():
+    """Run a query in the model layer."""
+    return engine.execute('SELECT 1').scalar()
+
+
+@tracing.traced('logic')
+def run_logic():
+    """Call the model, and logic nested in logic."""
+    with tracing.span('validation'):
+        pass
+    return nested_logic() + read_model()
+
+
+@tracing.traced('logic')
+def nested_logic():
+    """Logic called by logic."""
+    return 1
+
+
+@pytest.fixture(autouse=True)
+def tracing_enabled(monkeypatch):
+    """Enable tracing, which is disabled by default."""
+    monkeypatch.setattr(config, 'TRACING_ENABLED', True)
+
+
+def create_app():
+    """Create a traced app, routing / to the logic."""
+    app = flask.Flask('test')
+    app.before_request(lambda: None)
+    app.add_url_rule('/', 'index', lambda: str(run_logic()))
+    tracing.init_app(app)
+    return app
+
+
+def test_server_timing():
+    """Test each layer of the request is in its Server-Timing header."""
+    result = create_app().test_client().get('/')
+
+    assert result.data == b'2'
+    timings = result.headers['Server-Timing'].split(', ')
+    assert [timing.split(';')[0] for timing in timings] == [
+        'hooks', 'handler', 'logic', 'validation', 'model', 'sql', 'total']
+    assert timings[-2].endswith(';desc="1 queries"')
+    durations = {
+        timing.split(';')[0]: float(
+            re.search(r'dur=([0-9.]+)', timing).group(1))
+        for timing in timings}
+    assert durations['handler'] >= durations['logic'] >= durations['model']
+    assert durations['total'] >= durations['handler']
+    assert tracing.current_trace() is None
+
+
+def test_spans_outside_requests():
+    """Test spans do nothing when no request is traced."""
+    assert run_logic() == 2
+    assert tracing.current_trace() is None
+
+
+def test_traces_are_sampled(monkeypatch):
+    """Test the sampled requests are added to the span histogram."""
+    app = create_app()
+    key = ('timed_release_span_duration_seconds', ('sql',))
+
+    monkeypatch.setattr(config, 'TRACING_SAMPLE_RATE', 0)
+    before = metrics.registry.collect().get(key, [0])[-1]
+    app.test_client().get('/')
+    assert metrics.registry.collect().get(key, [0])[-1] == before
+
+    monkeypatch.setattr(config, 'TRACING_SAMPLE_RATE', 1)
+    app.test_client().get('/')
+    assert metrics.registry.collect()[key][-1] == before + 1
+
+
+def test_tracing_disabled(monkeypatch):
+    """Test requests are not traced when tracing is disabled."""
+    monkeypatch.setattr(config, 'TRACING_ENABLED', False)
+
+    result = create_app().test_client().get('/')
+
+    assert 'Server-Timing' not in result.headers
@@ -8,6 +8,7 @@ from functools import wraps
 import sys
 
 from timed_release import config
+from timed_release.connectors import sql
 from timed_release.connectors.sql import base_model
 from timed_release.connectors.sql import db_engine
 from timed_release.connectors.sql import db_session_maker
@@ -18,6 +19,8 @@ from timed_release.models import product_live_time
 def create_all_tables():
     """Create database table for all model classes."""
     _exit_if_not_test_environment(db_session_maker())
+    # Cached products would leak from one test schema to another.
+    product_live_time.product_cache.clear()
     # Creates table for all model where base_model is inherited.
     base_model.metadata.create_all(db_engine)
 
@@ -78,3 +81,22 @@ def insert_product_live_time_data():
     with db_session() as session:
         session.bulk_insert_mappings(
             product_live_time.ProductLiveTime, INSERT_DATA)
+
+
+def create_shard_map(directory, count):
+    """Create a map of shards stored in SQLite files, with their tables.
+
+    Args:
+        directory (py.path.local): Directory of the SQLite files.
+        count (int): Number of shards.
+
+    Returns:
+        sql.ShardMap: The shard map.
+    """
+    shards = []
+    for position in range(count):
+        engine = sql.get_engine('sqlite:///{}'.format(
+            directory.join('shard{}.db'.format(position))))
+        base_model.metadata.create_all(engine)
+        shards.append(sql.Shard('shard{}'.format(position), engine))
+    return sql.ShardMap(shards, config.SHARD_VIRTUAL_NODES)
@@ -0,0 +1,144 @@
+"""Tests for the columnar validation."""
+
+import datetime
+
+import numpy
+import pytest
+
+from timed_release.validation import columnar
+from timed_release.validation import engine
+from timed_release.validation import validators
+
+
+RECORDS = [
+    {'product_id': 1, 'time_of_day_product': '20:15:00',
+        'time_zone': 'GMT', 'store_id': 286},
+    {'product_id': 2, 'time_of_day_product': '8:15:00', 'time_zone': 'local',
+        'store_id': None},
+    {'product_id': None, 'time_of_day_product': '', 'time_zone': None,
+        'store_id': None},
+    {'product_id': -3, 'time_of_day_product': '25:00:00', 'time_zone': 'UTC',
+        'store_id': '286'},
+    {'product_id': 1, 'time_of_day_product': '10:00:00', 'time_zone': 'GMT',
+        'store_id': 1},
+    {'product_id': 4, 'time_of_day_product': 72000, 'time_zone': 'GMT',
+        'store_id': 0},
+    {'product_id': 5, 'time_of_day_product': datetime.time(1, 2, 3),
+        'time_zone': 'local', 'store_id': True},
+    {'product_id': 6, 'time_of_day_product': '10:0a:00', 'time_zone': 'GMT',
+        'store_id': 2}]
+
+
+def to_columns(records):
+    """Turn records into lists of values."""
+    return {
+        field: [record[field] for record in records]
+        for field in ('product_id', 'time_of_day_product', 'time_zone',
+                      'store_id')}
+
+
+def test_validate_columns_matches_records():
+    """Test columns report the errors of the single record validation."""
+    required_fields = validators.TIMED_RELEASE_REQUIRED_FIELDS
+    validate = engine.compile_rules(required_fields)
+
+    row_errors = validators.validate_timed_release_columns(
+        to_columns(RECORDS), required_fields)
+
+    assert row_errors.tolist()[4] == columnar.ERROR_DUPLICATED_PRODUCT_ID
+    for row, record in enumerate(RECORDS):
+        expected_errors = validate(record)
+        if row == 4:
+            expected_errors = [{
+                'duplicate product id':
+                    'Product id 1 is present more than once in the request'}]
+        assert columnar.describe_errors(
+            row_errors[row], required_fields, record['product_id']) == \
+            expected_errors
+
+
+@pytest.mark.parametrize('check_duplicates', [True, False])
+def test_validate_timed_release_records(check_duplicates, monkeypatch):
+    """Test large batches report the errors of small ones."""
+    required_fields = validators.TIMED_RELEASE_REQUIRED_FIELDS
+    records = RECORDS + [
+        {'product_id': '7', 'time_of_day_product': ['10:00:00'],
+            'time_zone': 'GMT'},
+        {'product_id': 8, 'time_of_day_product': '10:00:00',
+            'time_zone': 'GMT', 'store_id': 2 ** 70}]
+    expected_errors = validators.validate_timed_release_records(
+        records, required_fields, check_duplicates)
+
+    monkeypatch.setattr(
+        validators.config, 'COLUMNAR_VALIDATION_MIN_RECORDS', len(records))
+    assert validators.validate_timed_release_records(
+        records, required_fields, check_duplicates) == expected_errors
+    assert bool(expected_errors[4]) == check_duplicates
+
+
+@pytest.mark.parametrize('description, extra_record', [
+    ('string columns', {
+        'product_id': 5, 'time_of_day_product': '10:00:00',
+        'time_zone': 'GMT', 'store_id': 1}),
+    ('object columns', {
+        'product_id': 5, 'time_of_day_product': 36000, 'time_zone': None,
+        'store_id': 1})])
+def test_validate_columns_nul_characters(description, extra_record):
+    """Test strings with NUL characters get the errors of single records."""
+    required_fields = validators.TIMED_RELEASE_REQUIRED_FIELDS
+    validate = engine.compile_rules(required_fields)
+    records = [
+        {'product_id': 1, 'time_of_day_product': '12:00:00\x00',
+            'time_zone': 'GMT', 'store_id': 1},
+        {'product_id': 2, 'time_of_day_product': '12:00:00',
+            'time_zone': 'GMT\x00', 'store_id': 1},
+        {'product_id': 3, 'time_of_day_product': '\x00',
+            'time_zone': '\x00', 'store_id': 1},
+        {'product_id': 4, 'time_of_day_product': '12:00:00',
+            'time_zone': 'local', 'store_id': 1},
+        extra_record]
+
+    row_errors = columnar.validate_columns(
+        to_columns(records), required_fields)
+
+    for row, record in enumerate(records):
+        assert columnar.describe_errors(
+            row_errors[row], required_fields, record['product_id']) == \
+            validate(record)
+    assert row_errors[0] and row_errors[1] and row_errors[2]
+
+
+def test_validate_typed_columns():
+    """Test integer and string arrays are validated."""
+    row_errors = columnar.validate_columns({
+        'product_id': numpy.array([1, 0, -2, 1]),
+        'time_of_day_product': numpy.array(
+            ['00:00:00', '23:59:59', '24:00:00', '1:00:00']),
+        'time_zone': numpy.array(['GMT', 'local', 'gmt', 'GMT'])},
+        ['product_id', 'time_of_day_product', 'time_zone'])
+
+    assert row_errors.tolist() == [
+        0,
+        columnar.ERROR_MISSING_PRODUCT_ID,
+        columnar.ERROR_INVALID_PRODUCT_ID | columnar.ERROR_INVALID_TIME |
+        columnar.ERROR_INVALID_TIME_ZONE,
+        columnar.ERROR_DUPLICATED_PRODUCT_ID]
+
+
+def test_validate_columns_without_duplicates_check():
+    """Test duplicates can be allowed."""
+    row_errors = columnar.validate_columns(
+        {'product_id': [1, 1]}, ['product_id'], check_duplicates=False)
+
+    assert row_errors.tolist() == [0, 0]
+
+
+@pytest.mark.parametrize(
+    'description, columns, required_fields', [
+        ('Different lengths', {'product_id': [1], 'store_id': [1, 2]},
+            ['product_id']),
+        ('Unknown required field', {'product_id': [1]}, ['comment'])])
+def test_validate_columns_errors(description, columns, required_fields):
+    """Test invalid columns are refused."""
+    with pytest.raises(ValueError):
+        columnar.validate_columns(columns, required_fields)
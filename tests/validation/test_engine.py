@@ -0,0 +1,82 @@
+"""Tests for the compiled validation engine."""
+
+import datetime
+
+import pytest
+
+from timed_release.validation import engine
+from timed_release.validation import validators
+
+
+@pytest.mark.parametrize(
+    'description, time_value, expected_response', [
+        ('Two digits fields', '20:15:07', 72907),
+        ('One digit fields', '1:2:3', 3723),
+        ('Midnight', '00:00:00', 0),
+        ('Last second', '23:59:59', 86399),
+        ('Time object', datetime.time(1, 2, 3), 3723),
+        ('Hours out of range', '24:00:00', None),
+        ('Minutes out of range', '10:60:00', None),
+        ('Seconds out of range', '10:00:60', None),
+        ('Three digits field', '010:00:00', None),
+        ('Empty field', '10::00', None),
+        ('Missing field', '10:00', None),
+        ('Signed field', '+1:00:00', None),
+        ('Surrounding spaces', ' 10:00:00', None),
+        ('Not a string', 36000, None)])
+def test_parse_time(description, time_value, expected_response):
+    """Test times are parsed like strptime with HH:MM:SS."""
+    assert engine.parse_time(time_value) == expected_response
+
+
+@pytest.mark.parametrize(
+    'description, data, expected_response', [
+        ('Valid record',
+            {'product_id': 1, 'time_of_day_product': '20:15:00',
+                'time_zone': 'GMT', 'store_id': 286},
+            []),
+        ('Valid record with a one digit hour',
+            {'product_id': 1, 'time_of_day_product': '8:15:00',
+                'time_zone': 'local'},
+            []),
+        ('Empty record', {},
+            [{'missing mandatory fields': [
+                'product_id', 'time_of_day_product', 'time_zone']}]),
+        ('Boolean ids',
+            {'product_id': True, 'time_of_day_product': '20:15:00',
+                'time_zone': 'GMT'},
+            []),
+        ('Invalid fields',
+            {'product_id': -1, 'time_of_day_product': '25:00:00',
+                'time_zone': 'UTC', 'store_id': '286'},
+            [{'non integer or negative fields list': [
+                'product_id', 'store_id']},
+             {'invalid time zone': 'Time of day Product should be in valid '
+                                   'HH:MM:SS format'},
+             {'invalid time format': 'Time Zone should be GMT or local'}]),
+        ('Invalid types',
+            {'product_id': 1, 'time_of_day_product': 72000,
+                'time_zone': ['GMT']},
+            [{'invalid time zone': 'Time of day Product should be in valid '
+                                   'HH:MM:SS format'},
+             {'invalid time format': 'Time Zone should be GMT or local'}])])
+def test_compile_rules(description, data, expected_response):
+    """Test compiled rules report the errors of a record."""
+    validate = engine.compile_rules(validators.TIMED_RELEASE_REQUIRED_FIELDS)
+
+    assert validate(data) == expected_response
+
+
+def test_compile_rules_other_required_fields():
+    """Test fields without rules can be required."""
+    validate = engine.compile_rules(['product_id', 'comment'])
+
+    assert validate({'product_id': 1, 'comment': 'Launch'}) == []
+    assert validate({'product_id': 1}) == [
+        {'missing mandatory fields': ['comment']}]
+
+
+def test_compile_rules_is_cached():
+    """Test rules are compiled once per list of required fields."""
+    assert engine.compile_rules(['product_id']) is \
+        engine.compile_rules(('product_id',))
@@ -9,6 +9,9 @@ from owslogger import flask_logger
 from owsrequest import flask_request
 
 from timed_release import config
+from timed_release import metrics
+from timed_release import tracing
+from timed_release.connectors import sql
 
 
 app = Flask(config.SERVICE_NAME)
@@ -25,5 +28,8 @@ if config.ENVIRONMENT == config.DEV_ENVIRONMENT:
 flask_logger.setup(
     app, config.LOGGER_DSN, config.ENVIRONMENT, config.LOGGER_NAME,
     config.LOGGER_LEVEL, config.SERVICE_NAME, config.SERVICE_VERSION,
-    exclude_paths=[config.HEALTH_CHECK])
+    exclude_paths=[config.HEALTH_CHECK, config.METRICS_PATH])
 flask_request.setup(app, config.ENVIRONMENT)
+metrics.init_app(app)
+sql.init_app(app)
+tracing.init_app(app)
@@ -0,0 +1,196 @@
+"""Command line interface.
+
+Runs the service operations that do not fit in an HTTP request, using the
+same logic layer as the handlers. For instance, to export the whole
+product_live_time table::
+
+    $ python -m timed_release.cli export --format csv --output dump.csv
+
+and to load it back::
+
+    $ python -m timed_release.cli import --format csv dump.csv
+"""
+
+import argparse
+import json
+import logging
+import sys
+
+from timed_release import rebalance
+from timed_release import scheduler
+from timed_release.connectors import sql
+from timed_release.logic import product_export
+from timed_release.logic import product_import
+
+
+def export(arguments):
+    """Export product live times as NDJSON or CSV.
+
+    Args:
+        arguments (argparse.Namespace): parsed command line arguments.
+
+    Returns:
+        int: exit status.
+    """
+    export_response = product_export.export_product_live_times(
+        arguments.format, arguments.store_id, arguments.time_zone)
+    if not export_response:
+        print(export_response.errors['message'], file=sys.stderr)
+        return 1
+
+    output = sys.stdout
+    if arguments.output:
+        output = open(arguments.output, 'w', newline='')
+    try:
+        for chunk in export_response.message:
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+def import_(arguments):
+    """Import product live times from a NDJSON or CSV file.
+
+    Progress is printed on the standard error, the final summary on the
+    standard output.
+
+    Args:
+        arguments (argparse.Namespace): parsed command line arguments.
+
+    Returns:
+        int: exit status.
+    """
+    def print_progress(summary):
+        print('{} rows committed'.format(summary['committed_offset']),
+              file=sys.stderr)
+
+    with open(arguments.input, 'rb') as input_file:
+        import_response = product_import.import_product_live_times(
+            input_file, arguments.format, arguments.offset, print_progress)
+
+    if not import_response:
+        print(json.dumps(import_response.errors, indent=2), file=sys.stderr)
+        return 1
+    print(json.dumps(import_response.message, indent=2))
+    return 0
+
+
+def schedule(arguments):
+    """Fire the release events of the product live times until interrupted.
+
+    Release events are logged on the standard error.
+
+    Args:
+        arguments (argparse.Namespace): parsed command line arguments.
+
+    Returns:
+        int: exit status.
+    """
+    logging.basicConfig(
+        level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    try:
+        scheduler.serve(scheduler.log_release, arguments.sync_seconds)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def rebalance_(arguments):
+    """Move product live times to their shards in a new shard map.
+
+    Progress is printed on the standard error, the final summary on the
+    standard output.
+
+    Args:
+        arguments (argparse.Namespace): parsed command line arguments.
+
+    Returns:
+        int: exit status.
+    """
+    def print_progress(summary):
+        print('{} rows scanned, {} moved'.format(
+            summary['scanned'], sum(summary['moved'].values())),
+            file=sys.stderr)
+
+    summary = rebalance.rebalance(
+        sql.create_shard_map(arguments.shard_urls), arguments.batch_size,
+        arguments.dry_run, print_progress)
+    print(json.dumps(summary, indent=2, sort_keys=True))
+    return 0
+
+
+def get_parser():
+    """Create the parser of the command line arguments.
+
+    Returns:
+        argparse.ArgumentParser: the parser.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m timed_release.cli',
+        description='Timed release operations.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    export_parser = subparsers.add_parser(
+        'export', help='Export product live times.')
+    export_parser.add_argument(
+        '--format', default=product_export.FORMAT_NDJSON,
+        choices=sorted(product_export.EXPORT_MIMETYPES))
+    export_parser.add_argument('--store-id')
+    export_parser.add_argument('--time-zone')
+    export_parser.add_argument(
+        '--output', help='File to write to, defaults to standard output.')
+    export_parser.set_defaults(function=export)
+
+    import_parser = subparsers.add_parser(
+        'import', help='Import product live times.')
+    import_parser.add_argument('input', help='NDJSON or CSV file to import.')
+    import_parser.add_argument(
+        '--format', default=product_import.FORMAT_NDJSON,
+        choices=product_import.IMPORT_FORMATS)
+    import_parser.add_argument(
+        '--offset', type=int, default=0,
+        help='Number of rows to skip, to resume a previous import.')
+    import_parser.set_defaults(function=import_)
+
+    schedule_parser = subparsers.add_parser(
+        'schedule', help='Fire the release events until interrupted.')
+    schedule_parser.add_argument(
+        '--sync-seconds', type=float,
+        help='Time between two syncs with the product_live_time table.')
+    schedule_parser.set_defaults(function=schedule)
+
+    rebalance_parser = subparsers.add_parser(
+        'rebalance', help='Move product live times to their shards.')
+    rebalance_parser.add_argument(
+        'shard_urls', nargs='*', metavar='shard_url',
+        help='URLs of the shards after RDS_DB_URL, as RDS_SHARD_URLS will be.')
+    rebalance_parser.add_argument('--batch-size', type=int)
+    rebalance_parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Only count the rows to move.')
+    rebalance_parser.set_defaults(function=rebalance_)
+
+    return parser
+
+
+def main(argv=None):
+    """Run the command given on the command line.
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv.
+
+    Returns:
+        int: exit status.
+    """
+    parser = get_parser()
+    arguments = parser.parse_args(argv)
+    if not arguments.command:
+        parser.print_help()
+        return 2
+    return arguments.function(arguments)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,6 @@
 """Application configuration."""
 
+import json
 import logging
 import os
 
@@ -30,19 +31,126 @@ LOGGER_NAME = 'ows1'
 
 # Generic handlers
 HEALTH_CHECK = '/hello/'
+METRICS_PATH = '/metrics'
 
 # Database config
 RDS_DB_URL = 'sqlite://'
+RDS_REPLICA_URLS = []
+RDS_SHARD_URLS = []
 POOL_CLASS = StaticPool
 
 if ENVIRONMENT != TEST_ENVIRONMENT:
     RDS_DB_URL = os.environ.get('RDS_DB_URL', 'sqlite://')
+    RDS_REPLICA_URLS = [
+        url for url in os.environ.get('RDS_REPLICA_URLS', '').split(',')
+        if url]
+    RDS_SHARD_URLS = [
+        url for url in os.environ.get('RDS_SHARD_URLS', '').split(',')
+        if url]
     POOL_CLASS = QueuePool
     POOL_SIZE = 5
     POOL_RECYCLE_MS = 3600  # Avoids connections going stale
     POOL_MAX_OVERFLOW = -1
     POOL_PRE_PING = True
 
+# Bounded connection pool, instead of the unbounded one: connections kept
+# open and open at most, seconds a checkout waits for a connection at the
+# limit, and how the limit adapts. It grows when checkouts wait more than
+# the target while queries stay under the max latency, and shrinks when they
+# do not.
+POOL_BOUNDED = os.environ.get('POOL_BOUNDED', 'false').lower() == 'true'
+POOL_MIN_SIZE = int(os.environ.get('POOL_MIN_SIZE', 5))
+POOL_MAX_SIZE = int(os.environ.get('POOL_MAX_SIZE', 30))
+POOL_TIMEOUT_SECONDS = 5
+POOL_ADJUST_SECONDS = 10
+POOL_TARGET_WAIT_MS = 10
+POOL_MAX_LATENCY_MS = 100
+
+# Pre ping: seconds a connection stays idle in the pool before it is pinged
+# when checked out. Connections used more recently are not pinged, their
+# first statement runs again on a new connection if theirs was closed.
+POOL_PING_IDLE_SECONDS = 30
+
+# Time zones of the local releases: IANA time zone of each store id, given
+# as a JSON object such as {"286": "Europe/Stockholm"}, and the one of the
+# stores missing from the mapping.
+STORE_TIME_ZONES = {
+    int(store_id): time_zone for store_id, time_zone in
+    json.loads(os.environ.get('STORE_TIME_ZONES') or '{}').items()}
+DEFAULT_LOCAL_TIME_ZONE = os.environ.get('LOCAL_TIME_ZONE', 'UTC')
+
+# Batch lookups: maximum ids accepted per request and per IN (...) clause
+BATCH_MAX_PRODUCT_IDS = 1000
+BATCH_QUERY_CHUNK_SIZE = 500
+
+# Bulk writes: maximum records accepted per request and rows per transaction
+BULK_MAX_RECORDS = 50000
+BULK_INSERT_CHUNK_SIZE = 1000
+
+# Batches of records validated as columns with NumPy from this size, one
+# record at a time below it
+COLUMNAR_VALIDATION_MIN_RECORDS = 500
+
+# Streaming export: rows fetched from the database and written per batch
+EXPORT_BATCH_SIZE = 1000
+
+# Streaming import: rows committed per transaction and rejected rows reported
+IMPORT_COMMIT_SIZE = 1000
+IMPORT_MAX_REPORTED_REJECTIONS = 1000
+
+# Going live window queries: maximum products returned, and whether windows
+# are answered from an in-memory index reloaded every few seconds.
+WINDOW_MAX_RESULTS = 10000
+WINDOW_INDEX_IN_MEMORY = False
+WINDOW_INDEX_RELOAD_SECONDS = 300
+
+# Store listings: products per page by default and at most
+STORE_PRODUCTS_PAGE_SIZE = 100
+STORE_PRODUCTS_MAX_PAGE_SIZE = 1000
+
+# Release scheduler: time between two syncs with the product_live_time table
+SCHEDULER_SYNC_SECONDS = 60
+
+# In-process cache of product live times. A max size of 0 disables it.
+PRODUCT_CACHE_MAX_SIZE = 100000
+PRODUCT_CACHE_TTL_SECONDS = 60
+PRODUCT_CACHE_NOT_FOUND_TTL_SECONDS = 5
+
+# Read replicas: seconds the reads of a client stay on the primary after it
+# wrote, cookie carrying the time of its last write, and seconds a replica
+# that failed to connect is skipped.
+REPLICA_PIN_SECONDS = 5
+REPLICA_PIN_COOKIE = 'primary_pin'
+REPLICA_RETRY_SECONDS = 30
+
+# Sharding: points of each shard on the hash ring, and threads reading the
+# shards in parallel. RDS_DB_URL is the first shard, RDS_SHARD_URLS the
+# others.
+SHARD_VIRTUAL_NODES = 64
+SHARD_SCATTER_THREADS = 8
+
+# Whether reads run in read only transactions, on MySQL 5.6.5 or later
+READ_ONLY_TRANSACTIONS = os.environ.get(
+    'READ_ONLY_TRANSACTIONS', 'false').lower() == 'true'
+
+# Tracing: whether the time of each request is broken down by layer in its
+# Server-Timing header, which shows it to the clients, and fraction of the
+# requests added to the metrics.
+TRACING_ENABLED = os.environ.get(
+    'TRACING_ENABLED', 'false').lower() == 'true'
+TRACING_SAMPLE_RATE = float(os.environ.get('TRACING_SAMPLE_RATE', 0.1))
+
+# Slow query log: milliseconds above which statements are logged, whether
+# the plan of each new slow statement is read with EXPLAIN, and statements
+# kept with their counters.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_EXPLAIN = os.environ.get(
+    'SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+SLOW_QUERY_MAX_STATEMENTS = 500
+
+# Compiled SQL statements kept per process
+STATEMENT_CACHE_MAX_SIZE = 500
+
 # Time zones of product live time
 TIME_ZONES = ('local', 'GMT')
 
@@ -0,0 +1,137 @@
+"""In-process Cache.
+
+Bounded least recently used cache where every entry expires after a time to
+live. The cache is local to the process: writes done by other processes are
+only seen once the cached entries expire, so the time to live bounds how
+stale a value can be.
+
+Usage:
+    products = LRUCache(max_size=1000, ttl=60)
+    token = products.read_token()
+    product = products.get(product_id)
+    if product is MISSING:
+        product = fetch(product_id)
+        products.set(product_id, product, token=token)
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+# Returned by LRUCache.get when the key is not cached, as None can be cached.
+MISSING = object()
+
+
+class LRUCache:
+    """Bounded LRU cache with a time to live per entry."""
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        """Create a cache.
+
+        Args:
+            max_size (int): Maximum number of entries, 0 disables the cache.
+            ttl (float): Default time to live of an entry, in seconds.
+            clock (func): Function returning the current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Get the value cached for a key.
+
+        Args:
+            key: Key of the entry.
+
+        Returns:
+            The cached value, or MISSING if the key is not cached or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def read_token(self):
+        """Get a token to take before reading the value to cache.
+
+        Returns:
+            int: Token to pass to `set`.
+        """
+        return self._invalidations
+
+    def set(self, key, value, ttl=None, token=None):
+        """Cache a value, evicting the least recently used entry if full.
+
+        Args:
+            key: Key of the entry.
+            value: Value to cache.
+            ttl (float): Time to live of the entry, defaults to the cache one.
+            token (int): Token taken with `read_token` before reading the
+                value. The value is not cached if an invalidation happened
+                since, as it might be stale.
+        """
+        if not self.max_size:
+            return
+
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if token is not None and token != self._invalidations:
+                return
+
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        """Remove entries from the cache.
+
+        Args:
+            keys (iterable): Keys of the entries to remove.
+        """
+        with self._lock:
+            self._invalidations += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all the entries from the cache."""
+        with self._lock:
+            self._invalidations += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Get the counters of the cache.
+
+        Returns:
+            dict: hits, misses, evictions, expirations, size and max size.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self._entries),
+            'max_size': self.max_size
+        }
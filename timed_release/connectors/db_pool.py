@@ -0,0 +1,391 @@
+"""Adaptive Connection Pool.
+
+Queue pool bounded by a limit of open connections. A checkout waits at most
+`timeout` seconds for a connection when the limit is reached, then raises
+`sqlalchemy.exc.TimeoutError`, instead of opening connections until the
+database gives up.
+
+The limit starts at `pool_size + max_overflow`, and moves between `pool_size`
+and that maximum every `adjust_seconds`, from the checkout waits and the
+query latencies observed in that time:
+
+- waits above `target_wait` while queries stay under `max_latency` mean the
+  pool is too small for the load, the limit grows by half;
+- queries over `max_latency` mean the database is saturated, the limit
+  shrinks by a quarter so that requests queue in the service rather than in
+  the database;
+- a limit at least twice the connections used at the peak shrinks by one.
+
+Connections above a lowered limit are closed when they are returned.
+
+`IdlePing` checks connections are alive when they are checked out, pinging
+only the ones that were idle for a while in the pool.
+
+Usage:
+    engine = create_engine(
+        url, poolclass=AdaptivePool, pool_size=2, max_overflow=18,
+        pool_timeout=5)
+    watch(engine)
+    stats = engine.pool.stats()
+"""
+
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy import pool
+
+
+# Keys of the info of pooled connections: time the connection was last used,
+# and whether it was checked out without a ping and did not run a statement.
+LAST_USED = 'last_used'
+UNVERIFIED = 'unverified'
+
+
+class PoolMetrics:
+    """Counters of the checkouts and queries of a pool.
+
+    The totals grow for the life of the process, the window ones are reset
+    each time the pool adjusts its limit.
+    """
+
+    def __init__(self):
+        """Create metrics with every counter at 0."""
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.in_use = 0
+        self.grown = 0
+        self.shrunk = 0
+        self._reset_window()
+
+    def record_wait(self, seconds, timed_out=False):
+        """Record the wait of a checkout.
+
+        Args:
+            seconds (float): Time waited for a connection.
+            timed_out (bool): Whether the checkout timed out.
+        """
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                self._window_timeouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            self._window_waits += 1
+            self._window_wait_seconds += seconds
+
+    def record_checkout(self):
+        """Record a connection checked out of the pool."""
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self._window_peak_in_use = max(
+                self._window_peak_in_use, self.in_use)
+
+    def record_checkin(self):
+        """Record a connection returned to the pool."""
+        with self._lock:
+            self.in_use -= 1
+
+    def record_query(self, seconds):
+        """Record the latency of a query.
+
+        Args:
+            seconds (float): Time the query took.
+        """
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+            self._window_queries += 1
+            self._window_query_seconds += seconds
+
+    def take_window(self):
+        """Get the averages of the current window and start a new one.
+
+        Returns:
+            tuple: Average checkout wait and query latency, in seconds, and
+            the peak of connections in use.
+        """
+        with self._lock:
+            average_wait = self._window_wait_seconds / max(
+                self._window_waits, 1)
+            if self._window_timeouts:
+                average_wait = float('inf')
+            average_latency = self._window_query_seconds / max(
+                self._window_queries, 1)
+            peak_in_use = max(self._window_peak_in_use, self.in_use)
+            self._reset_window()
+        return average_wait, average_latency, peak_in_use
+
+    def stats(self):
+        """Get the counters.
+
+        Returns:
+            dict: Totals since the process started, and connections in use.
+        """
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds': self.wait_seconds,
+                'max_wait_seconds': self.max_wait_seconds,
+                'queries': self.queries,
+                'query_seconds': self.query_seconds,
+                'in_use': self.in_use,
+                'grown': self.grown,
+                'shrunk': self.shrunk}
+
+    def _reset_window(self):
+        """Start a new window."""
+        self._window_waits = 0
+        self._window_wait_seconds = 0.0
+        self._window_timeouts = 0
+        self._window_queries = 0
+        self._window_query_seconds = 0.0
+        self._window_peak_in_use = 0
+
+
+class AdaptivePool(pool.QueuePool):
+    """Queue pool whose limit of open connections adapts to the load."""
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, timeout=30,
+                 adjust_seconds=10, target_wait=0.01, max_latency=0.1,
+                 clock=time.monotonic, **kw):
+        """Create a pool.
+
+        Args:
+            creator (func): Function returning a DBAPI connection.
+            pool_size (int): Connections kept open, and lowest limit.
+            max_overflow (int): Connections above `pool_size` at most.
+            timeout (float): Seconds a checkout waits at the limit.
+            adjust_seconds (float): Time between two adjustments.
+            target_wait (float): Average checkout wait, in seconds, above
+                which the limit grows.
+            max_latency (float): Average query latency, in seconds, above
+                which the limit shrinks.
+            clock (func): Function returning the current time in seconds.
+            **kw: Arguments of `sqlalchemy.pool.Pool`.
+        """
+        if max_overflow < 0:
+            raise ValueError('An adaptive pool must have a maximum overflow')
+        super().__init__(
+            creator, pool_size=pool_size, max_overflow=max_overflow,
+            timeout=timeout, **kw)
+        self.min_size = pool_size
+        self.max_size = pool_size + max_overflow
+        self.adjust_seconds = adjust_seconds
+        self.target_wait = target_wait
+        self.max_latency = max_latency
+        self.metrics = PoolMetrics()
+        self._clock = clock
+        self._adjust_at = clock() + adjust_seconds
+        self._adjust_lock = threading.Lock()
+
+    @property
+    def limit(self):
+        """int: Current limit of open connections."""
+        return self.size() + self._max_overflow
+
+    def recreate(self):
+        """Recreate the pool, keeping its bounds, limit and metrics."""
+        recreated = super().recreate()
+        recreated.min_size = self.min_size
+        recreated.max_size = self.max_size
+        recreated.adjust_seconds = self.adjust_seconds
+        recreated.target_wait = self.target_wait
+        recreated.max_latency = self.max_latency
+        recreated.metrics = self.metrics
+        recreated._clock = self._clock
+        return recreated
+
+    def adjust(self):
+        """Adjust the limit from the window of metrics, once it is over.
+
+        Returns:
+            int: The limit of open connections.
+        """
+        now = self._clock()
+        if now < self._adjust_at or not self._adjust_lock.acquire(False):
+            return self.limit
+        try:
+            self._adjust_at = now + self.adjust_seconds
+            average_wait, average_latency, peak_in_use = \
+                self.metrics.take_window()
+            limit = self.limit
+            if average_latency > self.max_latency:
+                limit -= max(limit // 4, 1)
+            elif average_wait > self.target_wait:
+                limit += max(limit // 2, 1)
+            elif peak_in_use * 2 <= limit:
+                limit -= 1
+            return self._resize(limit)
+        finally:
+            self._adjust_lock.release()
+
+    def stats(self):
+        """Get the bounds, connections and metrics of the pool.
+
+        Returns:
+            dict: Pool counters.
+        """
+        stats = self.metrics.stats()
+        stats.update({
+            'limit': self.limit,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'idle': self.checkedin(),
+            'overflow': max(self.overflow(), 0)})
+        return stats
+
+    def _resize(self, limit):
+        """Set the limit of open connections, within the bounds.
+
+        Args:
+            limit (int): New limit.
+
+        Returns:
+            int: The limit set.
+        """
+        limit = min(max(limit, self.min_size), self.max_size)
+        with self._overflow_lock:
+            if limit > self.limit:
+                self.metrics.grown += 1
+            elif limit < self.limit:
+                self.metrics.shrunk += 1
+            self._max_overflow = limit - self.size()
+        return limit
+
+    def _do_get(self):
+        """Check out a connection, recording the time waited for it."""
+        started = self._clock()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_wait(self._clock() - started, timed_out=True)
+            self.adjust()
+            raise
+        self.metrics.record_wait(self._clock() - started)
+        self.adjust()
+        return connection
+
+
+def watch(engine):
+    """Record the checkouts and query latencies of an adaptive pool.
+
+    Args:
+        engine (Engine): Engine using an `AdaptivePool`.
+    """
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        """Count the connection as in use."""
+        engine.pool.metrics.record_checkout()
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_connection, connection_record):
+        """Count the connection as returned."""
+        engine.pool.metrics.record_checkin()
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(connection, cursor, statement, parameters,
+                              context, executemany):
+        """Start timing the query."""
+        if context is not None:
+            context.pool_query_started = time.monotonic()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(connection, cursor, statement, parameters,
+                             context, executemany):
+        """Record the latency of the query."""
+        started = getattr(context, 'pool_query_started', None)
+        if started is not None:
+            engine.pool.metrics.record_query(time.monotonic() - started)
+
+
+class IdlePing:
+    """Liveness checks of the connections idle for a while.
+
+    A connection returned to the pool less than `idle_seconds` ago is not
+    pinged when it is checked out. It is marked `UNVERIFIED` until a
+    statement succeeds on it instead, so that a first statement failing on a
+    closed connection can be retried on a new one.
+    """
+
+    def __init__(self, idle_seconds, ping, clock=time.monotonic):
+        """Create liveness checks.
+
+        Args:
+            idle_seconds (float): Time in the pool after which a connection
+                is pinged, 0 to ping every connection.
+            ping (func): `engine_connect` listener pinging a connection,
+                and reconnecting it if it was closed.
+            clock (func): Function returning the current time in seconds.
+        """
+        self.idle_seconds = idle_seconds
+        self._ping = ping
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.pings = 0
+        self.skipped_pings = 0
+        self.reconnects = 0
+
+    def watch(self, engine):
+        """Check the connections of an engine when they are checked out.
+
+        Args:
+            engine (Engine): Engine to check the connections of.
+        """
+        event.listen(engine, 'connect', self._mark_used)
+        event.listen(engine, 'checkin', self._mark_used)
+        event.listen(engine, 'engine_connect', self._check)
+        event.listen(engine, 'after_cursor_execute', self._verify)
+
+    def record_reconnect(self):
+        """Record a first statement retried on a new connection."""
+        with self._lock:
+            self.reconnects += 1
+
+    def stats(self):
+        """Get the counters.
+
+        Returns:
+            dict: Connections pinged, connections not pinged as they were
+            used recently, and first statements retried on a new connection.
+        """
+        with self._lock:
+            return {
+                'pings': self.pings,
+                'skipped_pings': self.skipped_pings,
+                'reconnects': self.reconnects}
+
+    def _mark_used(self, dbapi_connection, connection_record):
+        """Keep the time a pooled connection was opened or last used."""
+        connection_record.info[LAST_USED] = self._clock()
+
+    def _check(self, connection, branch):
+        """Ping a connection checked out after being idle for a while."""
+        if branch:
+            return
+
+        info = connection.info
+        last_used = info.get(LAST_USED)
+        if last_used is not None and \
+                self._clock() - last_used < self.idle_seconds:
+            info[UNVERIFIED] = True
+            with self._lock:
+                self.skipped_pings += 1
+            return
+
+        with self._lock:
+            self.pings += 1
+        self._ping(connection, branch)
+
+    def _verify(self, connection, cursor, statement, parameters, context,
+                executemany):
+        """Clear the mark of a connection once a statement succeeded."""
+        connection.info.pop(UNVERIFIED, None)
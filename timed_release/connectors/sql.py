@@ -3,41 +3,63 @@
 Manages interactions with database schema.
 """
 
+import bisect
+from collections import OrderedDict
+from concurrent import futures
 from contextlib import contextmanager
+from contextlib import ExitStack
 import functools
+import hashlib
+import itertools
+import logging
+import os
+import re
+import sys
+import threading
+import time
 
+import flask
 from oto import response
+from oto.adaptors.flask import flaskify
 from sqlalchemy import create_engine
 from sqlalchemy import event
 from sqlalchemy import exc
 from sqlalchemy import pool
 from sqlalchemy import select
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.expression import Insert
 
 from timed_release import config
+from timed_release import metrics
+from timed_release import tracing
+from timed_release.connectors import db_pool
 from timed_release.connectors import sentry
 
 
-def get_engine():
-    """Create engine based on config settings."""
-    if config.POOL_CLASS == pool.QueuePool:
-        _db_engine = create_engine(
-            config.RDS_DB_URL, pool_size=config.POOL_SIZE,
-            max_overflow=config.POOL_MAX_OVERFLOW,
-            pool_recycle=config.POOL_RECYCLE_MS)
-        if config.POOL_PRE_PING:
-            @event.listens_for(_db_engine, 'engine_connect')
-            def ping_connection(connection, branch):
-                """Wrapper around ping connection."""
-                _ping_connection(connection, branch)
-        return _db_engine
-    return create_engine(config.RDS_DB_URL, poolclass=config.POOL_CLASS)
+logger = logging.getLogger(__name__)
 
-db_engine = get_engine()
-db_session_maker = sessionmaker(bind=db_engine)
+# Literals and bind parameters replaced in the fingerprints of the slow query
+# log, then lists of them and blanks.
+_NORMALIZATIONS = (
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),
+    (re.compile(r'%\(\w+\)s|%s|:\w+|\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?, ...)'),
+    (re.compile(r'\s+'), ' '))
 
-base_model = declarative_base()
+# Statements the slow query log reads the plan of, and how on each database
+_EXPLAINED_OPERATIONS = frozenset(
+    ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE'))
+_EXPLAIN_PREFIXES = {'mysql': 'EXPLAIN ', 'sqlite': 'EXPLAIN QUERY PLAN '}
+
+# Frames skipped when looking for the call site of a slow query
+_PACKAGE_DIRECTORY = os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))
+_SKIPPED_CALL_SITES = tuple(
+    os.path.join(_PACKAGE_DIRECTORY, path)
+    for path in ('connectors', 'metrics.py', 'tracing.py'))
 
 
 def _ping_connection(connection, branch):
@@ -80,22 +102,655 @@ def _ping_connection(connection, branch):
         connection.should_close_with_result = save_should_close_with_result
 
 
+def get_engine(url=None):
+    """Create engine based on config settings.
+
+    Args:
+        url (str): Database URL, `config.RDS_DB_URL` by default.
+    """
+    url = url or config.RDS_DB_URL
+    connect_args = {}
+    if url.startswith('sqlite'):
+        # Connections are used by the threads of `scatter`.
+        connect_args['check_same_thread'] = False
+    if config.POOL_CLASS == pool.QueuePool:
+        if config.POOL_BOUNDED:
+            _db_engine = create_engine(
+                url, poolclass=db_pool.AdaptivePool,
+                pool_size=config.POOL_MIN_SIZE,
+                max_overflow=config.POOL_MAX_SIZE - config.POOL_MIN_SIZE,
+                pool_timeout=config.POOL_TIMEOUT_SECONDS,
+                adjust_seconds=config.POOL_ADJUST_SECONDS,
+                target_wait=config.POOL_TARGET_WAIT_MS / 1000,
+                max_latency=config.POOL_MAX_LATENCY_MS / 1000,
+                pool_recycle=config.POOL_RECYCLE_MS, connect_args=connect_args)
+            db_pool.watch(_db_engine)
+        else:
+            _db_engine = create_engine(
+                url, pool_size=config.POOL_SIZE,
+                max_overflow=config.POOL_MAX_OVERFLOW,
+                pool_recycle=config.POOL_RECYCLE_MS,
+                connect_args=connect_args)
+        if config.POOL_PRE_PING:
+            liveness.watch(_db_engine)
+    else:
+        _db_engine = create_engine(
+            url, poolclass=config.POOL_CLASS, connect_args=connect_args)
+    metrics.watch(_db_engine)
+    tracing.watch(_db_engine)
+    slow_query_log.watch(_db_engine)
+    return _db_engine
+
+
+class ReplicaRouter:
+    """Round robin over the engines of the read replicas.
+
+    A replica that fails to connect is skipped for `retry_seconds`, and
+    reads fall back to the primary when no replica is available.
+    """
+
+    def __init__(self, engines, retry_seconds, clock=time.monotonic):
+        """Create a router.
+
+        Args:
+            engines (list): Engines of the replicas.
+            retry_seconds (float): Time a failing replica is skipped.
+            clock (func): Function returning the current time in seconds.
+        """
+        self.engines = list(engines)
+        self.retry_seconds = retry_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next = 0
+        self._retry_at = {}
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.failures = 0
+
+    def connect(self):
+        """Connect to the next available replica.
+
+        Returns:
+            Connection: Connection to a replica, or None to read from the
+            primary.
+        """
+        for engine in self._candidates():
+            try:
+                connection = engine.connect()
+            except exc.DBAPIError:
+                self._mark_failed(engine)
+                continue
+            with self._lock:
+                self.replica_reads += 1
+            return connection
+
+        with self._lock:
+            self.primary_reads += 1
+        return None
+
+    def count_primary_read(self):
+        """Count a read sent to the primary by a pin."""
+        with self._lock:
+            self.primary_reads += 1
+
+    def stats(self):
+        """Get the counters of the router.
+
+        Returns:
+            dict: reads sent to replicas and to the primary, connection
+            failures and the number of replicas available.
+        """
+        with self._lock:
+            now = self._clock()
+            return {
+                'replica_reads': self.replica_reads,
+                'primary_reads': self.primary_reads,
+                'failures': self.failures,
+                'replicas': len(self.engines),
+                'available_replicas': sum(
+                    1 for engine in self.engines
+                    if self._retry_at.get(engine, 0) <= now)}
+
+    def _candidates(self):
+        """Get the available replicas, from the next one in the round."""
+        with self._lock:
+            now = self._clock()
+            count = len(self.engines)
+            start = self._next
+            self._next = (self._next + 1) % count if count else 0
+            return [
+                self.engines[(start + position) % count]
+                for position in range(count)
+                if self._retry_at.get(
+                    self.engines[(start + position) % count], 0) <= now]
+
+    def _mark_failed(self, engine):
+        """Skip a replica until its retry time."""
+        with self._lock:
+            self.failures += 1
+            self._retry_at[engine] = self._clock() + self.retry_seconds
+
+
+class Shard:
+    """Database holding the product ids the shard map assigns to it."""
+
+    def __init__(self, name, engine, replica_router=None):
+        """Create a shard.
+
+        Args:
+            name (str): Name of the shard, which places it on the hash ring.
+            engine (Engine): Engine of the primary of the shard.
+            replica_router (ReplicaRouter): Replicas of the shard, if any.
+        """
+        self.name = name
+        self.engine = engine
+        self.session_maker = sessionmaker(bind=engine)
+        self.replica_router = replica_router or ReplicaRouter(
+            [], config.REPLICA_RETRY_SECONDS)
+
+    def __repr__(self):
+        """Represent the shard by its name."""
+        return 'Shard({!r})'.format(self.name)
+
+
+class ShardMap:
+    """Consistent hash ring assigning product ids to shards.
+
+    Each shard is placed on the ring at `virtual_nodes` points hashed from
+    its name, and a product id belongs to the shard of the first point at or
+    after the hash of the id. Adding a shard only moves the ids of the points
+    it takes over, about 1/N of them.
+    """
+
+    def __init__(self, shards, virtual_nodes):
+        """Create a shard map.
+
+        Args:
+            shards (list): Shards, with unique names.
+            virtual_nodes (int): Points of each shard on the ring.
+        """
+        self.shards = list(shards)
+        points = sorted(
+            (_hash('{}-{}'.format(shard.name, index)), position)
+            for position, shard in enumerate(self.shards)
+            for index in range(virtual_nodes))
+        self._hashes = [point_hash for point_hash, _ in points]
+        self._owners = [self.shards[position] for _, position in points]
+
+    def get(self, product_id):
+        """Get the shard of a product id.
+
+        Args:
+            product_id (int|str): Product id.
+
+        Returns:
+            Shard: The shard holding the product id.
+        """
+        if len(self.shards) == 1:
+            return self.shards[0]
+        index = bisect.bisect_left(self._hashes, _hash(int(product_id)))
+        return self._owners[index % len(self._owners)]
+
+    def group(self, items, key=None):
+        """Group items by the shard of their product id.
+
+        Args:
+            items (iterable): Product ids, or items holding one.
+            key (func): Function getting the product id of an item.
+
+        Returns:
+            list: (Shard, list of its items) tuples, items in their order.
+        """
+        groups = OrderedDict()
+        for item in items:
+            shard = self.get(key(item) if key else item)
+            groups.setdefault(shard, []).append(item)
+        return list(groups.items())
+
+
+def create_shard_map(shard_urls):
+    """Create the shard map of the primary database and other shards.
+
+    The primary of `config.RDS_DB_URL`, with its replicas, is the first
+    shard, `shard0`. The shards of the URLs are named `shard1`, `shard2`...
+    in order, so that appending URLs keeps the ids of the existing shards on
+    their ring points.
+
+    Args:
+        shard_urls (list): URLs of the shards after the first one.
+
+    Returns:
+        ShardMap: The shard map.
+    """
+    shards = [Shard('shard0', db_engine, replica_router)]
+    shards.extend(
+        Shard('shard{}'.format(position), get_engine(url))
+        for position, url in enumerate(shard_urls, 1))
+    return ShardMap(shards, config.SHARD_VIRTUAL_NODES)
+
+
+def _hash(value):
+    """Hash a value to a position of the ring, the same in every process."""
+    return int(hashlib.md5(str(value).encode('utf-8')).hexdigest()[:16], 16)
+
+
+class SlowQueryLog:
+    """Log of the statements slower than a threshold.
+
+    Statements are normalized into fingerprints: literals and bind
+    parameters become `?`, lists of them `(?, ...)`, and blanks a single
+    space. Each slow execution is logged with the shape of its parameters,
+    its duration and the code of the service that ran it. The first time a
+    fingerprint is slow, its plan is read with EXPLAIN on the same
+    connection, on MySQL and SQLite, and kept with its counters.
+    """
+
+    def __init__(self, threshold, explain=True, max_size=500,
+                 clock=time.perf_counter):
+        """Create a slow query log.
+
+        Args:
+            threshold (float): Duration, in seconds, above which statements
+                are logged.
+            explain (bool): Read the plan of each new slow statement.
+            max_size (int): Fingerprints kept, least recent ones first
+                evicted.
+            clock (func): Function returning the current time in seconds.
+        """
+        self.threshold = threshold
+        self.explain = explain
+        self.max_size = max_size
+        self._clock = clock
+        self._statements = OrderedDict()
+        self._lock = threading.Lock()
+        self.slow_queries = 0
+        self.explained = 0
+
+    def watch(self, engine):
+        """Time the statements of an engine.
+
+        Args:
+            engine (Engine): Engine to watch.
+        """
+        event.listen(engine, 'before_cursor_execute', self._start)
+        event.listen(engine, 'after_cursor_execute', self._finish)
+
+    def record(self, connection, statement, parameters, executemany,
+               duration):
+        """Record a slow statement.
+
+        Args:
+            connection (Connection): Connection the statement ran on.
+            statement (str): SQL sent to the database.
+            parameters (tuple|dict|list): Parameters sent with it.
+            executemany (bool): Whether it ran with a list of parameters.
+            duration (float): Time it took, in seconds.
+        """
+        fingerprint = normalize_statement(statement)
+        shape = _parameters_shape(parameters, executemany)
+        call_site = _call_site()
+        with self._lock:
+            self.slow_queries += 1
+            entry = self._statements.get(fingerprint)
+            new = entry is None
+            if new:
+                entry = self._statements[fingerprint] = {
+                    'statement': fingerprint, 'count': 0,
+                    'total_seconds': 0.0, 'max_seconds': 0.0,
+                    'parameters': shape, 'call_site': call_site,
+                    'explain': None}
+                if len(self._statements) > self.max_size:
+                    self._statements.popitem(last=False)
+            else:
+                self._statements.move_to_end(fingerprint)
+            entry['count'] += 1
+            entry['total_seconds'] += duration
+            entry['max_seconds'] = max(entry['max_seconds'], duration)
+
+        logger.warning(
+            'Slow query of %.1f ms at %s: %s with parameters %s',
+            duration * 1000, call_site, fingerprint, shape)
+        if new and self.explain and not executemany:
+            plan = _explain(connection, statement, parameters)
+            if plan is not None:
+                entry['explain'] = plan
+                with self._lock:
+                    self.explained += 1
+                logger.warning('EXPLAIN of %s: %s', fingerprint, plan)
+
+    def report(self):
+        """Get the slow statements, slowest in total first.
+
+        Returns:
+            list: dict of each fingerprint, with its count, total and
+            maximum seconds, parameters shape, call site and plan.
+        """
+        with self._lock:
+            entries = [dict(entry) for entry in self._statements.values()]
+        return sorted(
+            entries, key=lambda entry: entry['total_seconds'], reverse=True)
+
+    def stats(self):
+        """Get the counters of the log.
+
+        Returns:
+            dict: slow queries, fingerprints kept and plans read.
+        """
+        with self._lock:
+            return {
+                'slow_queries': self.slow_queries,
+                'statements': len(self._statements),
+                'explained': self.explained}
+
+    def _start(self, connection, cursor, statement, parameters, context,
+               executemany):
+        """Start timing a statement."""
+        if context is not None:
+            context.slow_query_started = self._clock()
+
+    def _finish(self, connection, cursor, statement, parameters, context,
+                executemany):
+        """Record the statement if it was slow."""
+        started = getattr(context, 'slow_query_started', None)
+        if started is None:
+            return
+        duration = self._clock() - started
+        if duration >= self.threshold:
+            self.record(
+                connection, statement, parameters, executemany, duration)
+
+
+def normalize_statement(statement):
+    """Normalize a statement into the fingerprint of its slow query log.
+
+    Args:
+        statement (str): SQL statement.
+
+    Returns:
+        str: The statement without literals nor bind parameters.
+    """
+    for pattern, replacement in _NORMALIZATIONS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def _parameters_shape(parameters, executemany):
+    """Describe the parameters of a statement by their types.
+
+    Args:
+        parameters (tuple|dict|list): Parameters of the statement.
+        executemany (bool): Whether it is a list of parameters.
+
+    Returns:
+        str: Types of the parameters, repeated ones counted.
+    """
+    if executemany:
+        if not parameters:
+            return '0 x ()'
+        return '{} x {}'.format(
+            len(parameters), _parameters_shape(parameters[0], False))
+    if isinstance(parameters, dict):
+        return '{{{}}}'.format(', '.join(
+            '{}: {}'.format(name, type(value).__name__)
+            for name, value in sorted(parameters.items())))
+
+    types = []
+    for _, group in itertools.groupby(
+            type(value).__name__ for value in parameters or ()):
+        group = list(group)
+        types.append(group[0] if len(group) == 1 else '{} x {}'.format(
+            group[0], len(group)))
+    return '({})'.format(', '.join(types))
+
+
+def _call_site():
+    """Get the code of the service that ran the current statement.
+
+    Returns:
+        str: File, relative to the package, line and function of the first
+        frame out of the connectors, the metrics and the tracing, or None.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_PACKAGE_DIRECTORY) and \
+                not filename.startswith(_SKIPPED_CALL_SITES):
+            return '{}:{} in {}'.format(
+                os.path.relpath(filename, _PACKAGE_DIRECTORY),
+                frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+
+def _explain(connection, statement, parameters):
+    """Read the plan of a statement on its connection.
+
+    Args:
+        connection (Connection): Connection the statement ran on.
+        statement (str): SQL sent to the database.
+        parameters (tuple|dict): Parameters sent with it.
+
+    Returns:
+        list|str: Rows of the plan, the error when it could not be read, or
+        None when the database or the statement cannot be explained.
+    """
+    prefix = _EXPLAIN_PREFIXES.get(connection.dialect.name)
+    operation = statement.split(None, 1)[0].upper() if statement else ''
+    if prefix is None or operation not in _EXPLAINED_OPERATIONS:
+        return None
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [list(row) for row in cursor.fetchall()]
+    except Exception as error:
+        return 'EXPLAIN failed: {}'.format(error)
+    finally:
+        cursor.close()
+
+
+# Connections checked out after being idle for a while are pinged, others
+# run their first statement again on a new connection if theirs was closed.
+liveness = db_pool.IdlePing(config.POOL_PING_IDLE_SECONDS, _ping_connection)
+
+slow_query_log = SlowQueryLog(
+    config.SLOW_QUERY_MS / 1000, config.SLOW_QUERY_EXPLAIN,
+    config.SLOW_QUERY_MAX_STATEMENTS)
+
+db_engine = get_engine()
+db_session_maker = sessionmaker(bind=db_engine)
+replica_router = ReplicaRouter(
+    [get_engine(url) for url in config.RDS_REPLICA_URLS],
+    config.REPLICA_RETRY_SECONDS)
+shard_map = create_shard_map(config.RDS_SHARD_URLS)
+
+base_model = declarative_base()
+
+# Time until which the reads of each thread go to the primary, outside
+# requests, after the thread wrote.
+_thread_pins = threading.local()
+
+_scatter_executor = futures.ThreadPoolExecutor(
+    max_workers=config.SHARD_SCATTER_THREADS)
+
+
+class RequestScope:
+    """Connections and sessions shared by everything a request does.
+
+    On each shard, the connection to the primary is checked out on the first
+    write of the request, or on its first read when the request is pinned to
+    the primary. Other reads share a connection to a replica. Sessions are
+    only created on the first write. Changes are committed once, by `commit`,
+    and `close` rolls back whatever was not committed.
+    """
+
+    def __init__(self, read_only=False, pinned=False):
+        """Create the scope of a request.
+
+        Args:
+            read_only (bool): Run the request in a read only transaction,
+                with `config.READ_ONLY_TRANSACTIONS`.
+            pinned (bool): Read from the primary, as the client wrote
+                recently.
+        """
+        self.read_only = read_only
+        self.pinned = pinned
+        self.connections = {}
+        self.replica_connections = {}
+        self.sessions = {}
+        self.callbacks = []
+
+    def get_connection(self, shard):
+        """Get the connection of the request to a shard, checked out once."""
+        connection = self.connections.get(shard)
+        if connection is None:
+            connection = self.connections[shard] = _connect(
+                shard.engine, self.read_only)
+        return connection
+
+    def get_read_connection(self, shard):
+        """Get the connection reads of the request use on a shard.
+
+        Reads go to a replica until the request writes, as they must then see
+        its writes, unless the request is pinned to the primary.
+        """
+        if shard in self.sessions or shard in self.connections:
+            return self.get_connection(shard)
+        if shard not in self.replica_connections:
+            self.replica_connections[shard] = _connect_replica(
+                shard, self.pinned)
+        connection = self.replica_connections[shard]
+        if connection is None:
+            return self.get_connection(shard)
+        return connection
+
+    def get_session(self, shard):
+        """Get the session of the request on a shard, on its connection."""
+        session = self.sessions.get(shard)
+        if session is None:
+            session = self.sessions[shard] = shard.session_maker(
+                bind=self.get_connection(shard))
+        return session
+
+    def commit(self):
+        """Commit the changes of the request, then call `after_commit`.
+
+        Shards are committed one after the other: a request writing to
+        several shards is not atomic across them.
+        """
+        for session in self.sessions.values():
+            session.commit()
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        """Roll back what was not committed and release the connections."""
+        self.callbacks = []
+        for session in self.sessions.values():
+            session.close()
+        for connection in list(self.connections.values()) + list(
+                self.replica_connections.values()):
+            if connection is not None:
+                connection.close()
+        self.sessions = {}
+        self.connections = {}
+        self.replica_connections = {}
+
+
+def init_app(app):
+    """Share a connection and a session within each request of an app.
+
+    Every `db_session` and `db_read_connection` of a request uses the same
+    connection, and the writes are committed once, after the handler, unless
+    it returned a server error. Outside requests, in the CLI, the scheduler
+    or tests, each `db_session` remains its own transaction.
+
+    Args:
+        app (flask.Flask): Application to set up.
+    """
+    app.before_request(_open_request_scope)
+    app.after_request(_commit_request_scope)
+    app.teardown_request(_close_request_scope)
+
+
+def after_commit(callback):
+    """Call a function once the current changes are committed.
+
+    Within a request the function is called after its commit, and dropped if
+    the request is rolled back. Elsewhere, writes are committed when their
+    `db_session` exits, so the function is called right away.
+
+    Args:
+        callback (func): Function to call, without arguments.
+    """
+    scope = _get_request_scope()
+    if scope is None:
+        callback()
+    else:
+        scope.callbacks.append(callback)
+
+
+def has_uncommitted_writes():
+    """Check whether reads may see writes that are not committed yet.
+
+    Returns:
+        bool: True within a request that wrote with `db_session`.
+    """
+    scope = _get_request_scope()
+    return scope is not None and bool(scope.sessions)
+
+
+def is_request_pinned():
+    """Check whether the reads of a request must see the client's writes.
+
+    Returns:
+        bool: True within a request pinned to the primary by the
+        `config.REPLICA_PIN_COOKIE` cookie, which the client may have got
+        from another process.
+    """
+    scope = _get_request_scope()
+    return scope is not None and scope.pinned
+
+
 @contextmanager
-def db_session():
+def db_session(shard=None, request_scoped=True, savepoint=False):
     """Provide a transactional scope around a series of operations.
 
     Taken from http://docs.sqlalchemy.org/en/latest/orm/session_basics.html
     This handles rollback and closing of session, so there is no need
     to do that throughout the code.
 
+    Within a request set up by `init_app`, the session of the request is used
+    and is committed with the request. An error rolls back the whole request,
+    or only the operations of the block with a savepoint. Outside requests,
+    the reads of the thread go to the primary for
+    `config.REPLICA_PIN_SECONDS` after the commit.
+
     Usage:
-        with db_session() as session:
+        with db_session(shard_map.get(product_id)) as session:
             session.execute(query)
+
+    Args:
+        shard (Shard): Shard to write to, which can only be omitted when
+            there is a single shard.
+        request_scoped (bool): Use the session of the current request, False
+            to commit the block on its own.
+        savepoint (bool): Within a request, roll back only the block on
+            errors.
     """
-    session = db_session_maker()
+    shard = _get_shard(shard)
+    scope = _get_request_scope() if request_scoped else None
+    if scope is not None:
+        with _request_session(scope, shard, savepoint) as session:
+            yield session
+        return
+
+    session = shard.session_maker()
     try:
         yield session
         session.commit()
+        _thread_pins.until = time.time() + config.REPLICA_PIN_SECONDS
     except:
         session.rollback()
         raise
@@ -103,6 +758,385 @@ def db_session():
         session.close()
 
 
+class StatementCache:
+    """Bounded LRU cache of compiled statements, with counters.
+
+    Given to SQLAlchemy as the `compiled_cache` execution option: statements
+    are looked up with `get` and stored with item assignment, keyed by the
+    dialect, the statement object and the names of its parameters. Only
+    statements built once and executed many times hit the cache.
+    """
+
+    def __init__(self, max_size):
+        """Create a statement cache.
+
+        Args:
+            max_size (int): Maximum number of compiled statements.
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Get the compiled statement of a key.
+
+        Args:
+            key: Key built by SQLAlchemy.
+            default: Returned when the statement is not compiled yet.
+
+        Returns:
+            The compiled statement, or the default.
+        """
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return compiled
+
+    def __setitem__(self, key, compiled):
+        """Cache a compiled statement, evicting the least recently used."""
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        """Return the number of compiled statements."""
+        return len(self._entries)
+
+    def clear(self):
+        """Remove all the compiled statements."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Get the counters of the cache.
+
+        Returns:
+            dict: hits, misses, evictions, size and max size.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_size': self.max_size}
+
+
+statement_cache = StatementCache(config.STATEMENT_CACHE_MAX_SIZE)
+
+
+def execute(session, statement, parameters=None, **execution_options):
+    """Execute a Core statement, compiling it once per process.
+
+    The statement runs on the connection of the session, within its
+    transaction, or on a connection of `db_read_connection`, with
+    `statement_cache` as compiled cache. Statements must be
+    built once, with `bindparam` for the values, to be compiled once.
+
+    A first statement finding that the connection, not pinged by `liveness`,
+    was closed runs again on a new connection, unless the connection is in a
+    transaction outside a session.
+
+    Usage:
+        statement = table.delete().where(table.c.id == bindparam('id'))
+        with db_session() as session:
+            execute(session, statement, {'id': 1})
+
+    Args:
+        session (Session|Connection): Session or connection to execute the
+            statement in.
+        statement (ClauseElement): Statement to execute.
+        parameters (dict|list): Parameters of the statement, a list of them
+            to execute it with executemany.
+        **execution_options: Other execution options of the connection, like
+            `stream_results`.
+
+    Returns:
+        ResultProxy: Result of the statement.
+    """
+    connection = session
+    if isinstance(session, Session):
+        connection = session.connection()
+    unverified = connection.info.get(db_pool.UNVERIFIED)
+    try:
+        return connection.execution_options(
+            compiled_cache=statement_cache, **execution_options).execute(
+                statement, parameters or {})
+    except exc.DBAPIError as err:
+        if not (unverified and err.connection_invalidated):
+            raise
+        if isinstance(session, Session):
+            session.rollback()
+            connection = session.connection()
+        elif connection.in_transaction():
+            raise
+        else:
+            # Only the copy of the connection with the execution options was
+            # invalidated.
+            connection.invalidate()
+
+    # The connection was closed while idle in the pool, and nothing ran on it
+    # yet: the statement runs again on a new connection.
+    liveness.record_reconnect()
+    return connection.execution_options(
+        compiled_cache=statement_cache, **execution_options).execute(
+            statement, parameters or {})
+
+
+@contextmanager
+def db_read_connection(shard=None):
+    """Provide a connection for a series of reads.
+
+    Reads do not need the ORM session of `db_session`, nor its COMMIT: the
+    connection is checked out of the pool without a session, and whatever the
+    database began implicitly is rolled back when the pool takes it back.
+    With `config.READ_ONLY_TRANSACTIONS`, MySQL reads run in a read only
+    transaction, which skips the bookkeeping of write transactions.
+
+    Reads go to the replicas of `config.RDS_REPLICA_URLS` in turn, and to the
+    primary when there are none or when the thread wrote recently. Within a
+    request set up by `init_app`, the read connection of the request is used.
+
+    Usage:
+        with db_read_connection(shard_map.get(product_id)) as connection:
+            execute(connection, statement, {'id': 1})
+
+    Args:
+        shard (Shard): Shard to read, which can only be omitted when there is
+            a single shard.
+    """
+    shard = _get_shard(shard)
+    scope = _get_request_scope()
+    if scope is not None:
+        yield scope.get_read_connection(shard)
+        return
+
+    connection = _connect_replica(
+        shard, getattr(_thread_pins, 'until', 0) > time.time())
+    if connection is None:
+        connection = _connect(shard.engine, read_only=True)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+def pool_stats():
+    """Get the counters of the bounded connection pools.
+
+    Returns:
+        dict: Counters of the pool of each shard and replica, keyed by
+        `shard0`, `shard0/replica0`..., empty unless `config.POOL_BOUNDED`.
+    """
+    engines = []
+    for shard in shard_map.shards:
+        engines.append((shard.name, shard.engine))
+        engines.extend(
+            ('{}/replica{}'.format(shard.name, position), engine)
+            for position, engine in enumerate(shard.replica_router.engines))
+    return {
+        name: engine.pool.stats() for name, engine in engines
+        if isinstance(engine.pool, db_pool.AdaptivePool)}
+
+
+def scatter(function, shards=None):
+    """Run a read on several shards in parallel.
+
+    Read connections are checked out in the calling thread, so that the
+    reads of a request use its connections, then the function runs on each
+    shard in a pool of `config.SHARD_SCATTER_THREADS` threads. A single
+    shard is read in the calling thread.
+
+    Usage:
+        counts = scatter(lambda shard, connection: execute(
+            connection, count_statement).scalar())
+
+    Args:
+        function (func): Function called with a shard and a read connection
+            to it, which must not use the request.
+        shards (list): Shards to read, all of them by default.
+
+    Returns:
+        list: Result of the function on each shard, in the order of the
+        shards.
+    """
+    shards = shard_map.shards if shards is None else list(shards)
+    with ExitStack() as stack:
+        connections = [
+            stack.enter_context(db_read_connection(shard))
+            for shard in shards]
+        if len(shards) == 1:
+            return [function(shards[0], connections[0])]
+        results = [
+            _scatter_executor.submit(function, shard, connection)
+            for shard, connection in zip(shards, connections)]
+        return [result.result() for result in results]
+
+
+def _connect(engine, read_only):
+    """Check a connection out of the pool of an engine.
+
+    Args:
+        engine (Engine): Engine of the database.
+        read_only (bool): Start a read only transaction on MySQL, with
+            `config.READ_ONLY_TRANSACTIONS`.
+
+    Returns:
+        Connection: The connection, to close once done.
+    """
+    connection = engine.connect()
+    if read_only:
+        _begin_read_only(connection)
+    return connection
+
+
+def _connect_replica(shard, pinned):
+    """Check a read only connection out of the next available replica.
+
+    Args:
+        shard (Shard): Shard to read.
+        pinned (bool): The reads must go to the primary.
+
+    Returns:
+        Connection: The connection, or None to read from the primary.
+    """
+    if pinned:
+        if shard.replica_router.engines:
+            shard.replica_router.count_primary_read()
+        return None
+    connection = shard.replica_router.connect()
+    if connection is not None:
+        _begin_read_only(connection)
+    return connection
+
+
+def _begin_read_only(connection):
+    """Start a read only transaction, with `config.READ_ONLY_TRANSACTIONS`.
+
+    Args:
+        connection (Connection): Connection that did not run anything yet.
+    """
+    if config.READ_ONLY_TRANSACTIONS and connection.dialect.name == 'mysql':
+        connection.execute('START TRANSACTION READ ONLY')
+
+
+def _get_shard(shard):
+    """Get the shard to use, the only one when it is omitted.
+
+    Raises:
+        ValueError: when the shard is omitted and there are several shards.
+    """
+    if shard is not None:
+        return shard
+    if len(shard_map.shards) > 1:
+        raise ValueError('A shard is required when there are several shards')
+    return shard_map.shards[0]
+
+
+@contextmanager
+def _request_session(scope, shard, savepoint):
+    """Run a block of operations in the session of a request.
+
+    Args:
+        scope (RequestScope): Scope of the request.
+        shard (Shard): Shard to write to.
+        savepoint (bool): Roll back only the block on errors.
+
+    Yields:
+        Session: The session of the request on the shard.
+    """
+    session = scope.get_session(shard)
+    transaction = session.begin_nested() if savepoint else None
+    try:
+        yield session
+        session.flush()
+        if transaction is not None:
+            transaction.commit()
+    except Exception:
+        if transaction is not None:
+            transaction.rollback()
+        else:
+            session.rollback()
+            scope.callbacks = []
+        raise
+
+
+def _get_request_scope():
+    """Get the scope of the current request, None outside requests."""
+    if not flask.has_request_context():
+        return None
+    return getattr(flask.g, 'db_scope', None)
+
+
+def _open_request_scope():
+    """Create the scope of a request, read only for GET requests.
+
+    The request is pinned to the primary when the cookie of the client says
+    it wrote less than `config.REPLICA_PIN_SECONDS` ago.
+    """
+    try:
+        last_write = float(
+            flask.request.cookies.get(config.REPLICA_PIN_COOKIE, 0))
+    except ValueError:
+        last_write = 0
+    flask.g.db_scope = RequestScope(
+        read_only=flask.request.method in ('GET', 'HEAD'),
+        pinned=last_write + config.REPLICA_PIN_SECONDS > time.time())
+
+
+def _commit_request_scope(flask_response):
+    """Commit the request, unless its handler returned a server error.
+
+    When the request wrote and there are replicas, the time of the write is
+    set in the `config.REPLICA_PIN_COOKIE` cookie, to pin the next reads of
+    the client to the primary.
+
+    Args:
+        flask_response (flask.Response): Response of the handler.
+
+    Returns:
+        flask.Response: The response of the handler, or a fatal response when
+        the commit fails.
+    """
+    scope = _get_request_scope()
+    if scope is None or flask_response.status_code >= 500:
+        return flask_response
+    wrote = bool(scope.sessions)
+    try:
+        scope.commit()
+    except exc.SQLAlchemyError as exception:
+        scope.close()
+        sentry.sentry_client.captureMessage(exception, stack=True)
+        return flaskify(response.create_fatal_response())
+    if wrote and any(
+            shard.replica_router.engines for shard in shard_map.shards):
+        flask_response.set_cookie(
+            config.REPLICA_PIN_COOKIE, str(time.time()),
+            max_age=config.REPLICA_PIN_SECONDS)
+    return flask_response
+
+
+def _close_request_scope(exception):
+    """Roll back what the request did not commit and release its connection.
+
+    Args:
+        exception (Exception): Error that ended the request, if any.
+    """
+    scope = _get_request_scope()
+    if scope is not None:
+        scope.close()
+
+
 def wrap_db_errors(function):
     """Decorate the given function with logic to handle SQLAlchemy errors.
 
@@ -125,3 +1159,60 @@ def wrap_db_errors(function):
 
         return function_return
     return call_function_with_error_handling
+
+
+class Upsert(Insert):
+    """INSERT statement updating the existing row on a key conflict.
+
+    The statement is compiled with the native syntax of the dialect:
+    `INSERT ... ON DUPLICATE KEY UPDATE` on MySQL and
+    `INSERT ... ON CONFLICT (...) DO UPDATE` on SQLite. When executed with
+    a list of parameters, the whole list is sent as one executemany.
+
+    Usage:
+        statement = Upsert(table, ['id'], ['name'])
+        session.execute(statement, [{'id': 1, 'name': 'a'}])
+    """
+
+    def __init__(self, table, key_columns, update_columns, **kwargs):
+        """Create an upsert statement.
+
+        Args:
+            table (Table): Table to insert into.
+            key_columns (list): Names of the columns of the unique key.
+            update_columns (list): Names of the columns to update when a row
+                with the same key already exists.
+        """
+        super().__init__(table, **kwargs)
+        self.key_columns = key_columns
+        self.update_columns = update_columns
+
+
+@compiles(Upsert)
+def _compile_upsert(upsert, compiler, **kwargs):
+    """Refuse to compile an upsert for dialects without native support."""
+    raise exc.CompileError(
+        'Upsert is not supported by the {} dialect'.format(
+            compiler.dialect.name))
+
+
+@compiles(Upsert, 'mysql')
+def _compile_upsert_mysql(upsert, compiler, **kwargs):
+    """Compile an upsert with MySQL ON DUPLICATE KEY UPDATE."""
+    assignments = ', '.join(
+        '{0} = VALUES({0})'.format(compiler.preparer.quote(column))
+        for column in upsert.update_columns)
+    return '{} ON DUPLICATE KEY UPDATE {}'.format(
+        compiler.visit_insert(upsert, **kwargs), assignments)
+
+
+@compiles(Upsert, 'sqlite')
+def _compile_upsert_sqlite(upsert, compiler, **kwargs):
+    """Compile an upsert with SQLite ON CONFLICT DO UPDATE."""
+    keys = ', '.join(
+        compiler.preparer.quote(column) for column in upsert.key_columns)
+    assignments = ', '.join(
+        '{0} = excluded.{0}'.format(compiler.preparer.quote(column))
+        for column in upsert.update_columns)
+    return '{} ON CONFLICT ({}) DO UPDATE SET {}'.format(
+        compiler.visit_insert(upsert, **kwargs), keys, assignments)
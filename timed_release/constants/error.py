@@ -4,6 +4,7 @@ ERROR_CODE_AUTHORIZATION = 'authorization_error'
 ERROR_CODE_BAD_GRASS_REQUEST = 'bad_grass_request_error'
 ERROR_CODE_NOT_FOUND = 'not_found'
 ERROR_CODE_BAD_REQUEST = 'bad_request'
+ERROR_CODE_CONFLICT = 'conflict'
 
 ERROR_MESSAGE_MISSING_GRASS_HEADERS = 'Missing Grass Headers'
 ERROR_MESSAGE_INCOMPLETE_GRASS_HEADERS = 'Incomplete Grass Headers'
@@ -15,5 +16,27 @@ ERROR_MESSAGE_TIME_ZONE = 'Time Zone should be GMT or local'
 ERROR_MESSAGE_PRODUCT_NOT_FOUND = 'Requested product id {} not found.'
 ERROR_MESSAGE_INTEGER_NON_NEGATIVE = '{} must be integer and greater than zero'
 ERROR_MESSAGE_INVALID_REQUEST_BODY = 'Invalid request body'
+ERROR_MESSAGE_PRODUCT_IDS_REQUIRED = 'At least one product id is required'
+ERROR_MESSAGE_TOO_MANY_PRODUCT_IDS = \
+    'No more than {} product ids can be requested at once'
+ERROR_MESSAGE_INVALID_PRODUCT_IDS = \
+    'Product ids must be integer and greater than zero: {}'
+ERROR_MESSAGE_RECORDS_REQUIRED = 'At least one record is required'
+ERROR_MESSAGE_TOO_MANY_RECORDS = \
+    'No more than {} records can be sent at once'
+ERROR_MESSAGE_INVALID_RECORD = 'Record must be an object'
+ERROR_MESSAGE_DUPLICATED_PRODUCT_ID = \
+    'Product id {} is present more than once in the request'
+ERROR_MESSAGE_PRODUCT_ALREADY_EXISTS = 'Product id {} already exists'
+ERROR_MESSAGE_EXPORT_FORMAT = 'Format should be one of: {}'
+ERROR_MESSAGE_INVALID_JSON_LINE = 'Line is not a valid JSON object'
+ERROR_MESSAGE_INVALID_ENCODING = 'Line is not valid UTF-8'
+ERROR_MESSAGE_IMPORT_OFFSET = 'Offset must be a positive integer or zero'
+ERROR_MESSAGE_IMPORT_FAILED = \
+    'Import failed, it can be resumed from the committed offset'
+ERROR_MESSAGE_PAGE_SIZE = 'limit must be an integer between 1 and {}'
+ERROR_MESSAGE_INVALID_CURSOR = 'Invalid cursor'
+ERROR_MESSAGE_REFERENCE_TIME = \
+    'at must be an integer number of seconds since the epoch'
 
 SUCCESS_CODE = 'ok'
@@ -0,0 +1,53 @@
+"""Entity tags.
+
+Computes stable entity tags of product live times, so that clients can send
+them back in `If-None-Match` and get a `304 Not Modified` instead of the full
+body when nothing changed. Tags are computed from the fields of the products,
+without serializing the response.
+"""
+
+import hashlib
+
+
+def compute_product_etag(product):
+    """Compute the entity tag of a product live time.
+
+    Args:
+        product (dict): Product live time dict.
+
+    Returns:
+        str: The entity tag, without quotes.
+    """
+    return _digest('{product_id}|{time_of_day_product}|{time_zone}|'
+                   '{store_id}'.format(**product))
+
+
+def compute_collection_etag(products, missing_product_ids=()):
+    """Compute the entity tag of a collection of product live times.
+
+    The tag does not depend on the order of the products.
+
+    Args:
+        products (iterable): Product live time dicts.
+        missing_product_ids (iterable): Requested product ids not found.
+
+    Returns:
+        str: The entity tag, without quotes.
+    """
+    product_etags = sorted(
+        '{}:{}'.format(product['product_id'], compute_product_etag(product))
+        for product in products)
+    missing = sorted(str(product_id) for product_id in missing_product_ids)
+    return _digest('{}/{}'.format(','.join(product_etags), ','.join(missing)))
+
+
+def _digest(value):
+    """Hash a string into an entity tag.
+
+    Args:
+        value (str): Value to hash.
+
+    Returns:
+        str: Hexadecimal digest of the value.
+    """
+    return hashlib.md5(value.encode()).hexdigest()
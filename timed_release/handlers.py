@@ -16,16 +16,25 @@ See:
 from flask import g
 from flask import jsonify
 from flask import request
+from flask import Response
+from flask import stream_with_context
 
 from oto import response
 from oto.adaptors.flask import flaskify
 from werkzeug.exceptions import BadRequest
 
 from timed_release import config
+from timed_release import etag
+from timed_release import metrics
+from timed_release import serialization
 from timed_release.api import app
 from timed_release.constants import error
 from timed_release.logic import hello
+from timed_release.logic import product_export
+from timed_release.logic import product_import
 from timed_release.logic import product_live_time
+from timed_release.logic import stats
+from timed_release.validation import validators
 
 
 @app.route('/', methods=['GET'])
@@ -51,6 +60,19 @@ def health():
     return jsonify({'status': 'ok'})
 
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Get the counters of the in-process caches."""
+    return flaskify(stats.get_stats())
+
+
+@app.route(config.METRICS_PATH, methods=['GET'])
+def get_metrics():
+    """Get the metrics of the service, in the Prometheus text format."""
+    return Response(
+        stats.get_metrics().message, content_type=metrics.CONTENT_TYPE)
+
+
 @app.errorhandler(500)
 def exception_handler(error):
     """Default handler when uncaught exception is raised.
@@ -78,8 +100,9 @@ def get_product_live_detail_by_id(product_id):
         flask.response: Response contains dict describing product live time
         details, or validation message.
     """
-    return flaskify(product_live_time.get_product_live_time_details(
-        product_id))
+    return _conditional_flaskify(
+        product_live_time.get_product_live_time_details(product_id),
+        etag.compute_product_etag, serialization.encode_product)
 
 
 @app.route('/product', methods=['POST'])
@@ -90,21 +113,215 @@ def create_product_live_time_detail():
         flask.Response: Response contains dict describing product live time
         details, or validation message.
     """
-    valid_request_json = True
-    try:
-        timed_release_data = request.get_json()
-        if not isinstance(timed_release_data, dict):
-            valid_request_json = False
-    except BadRequest:
-        valid_request_json = False
+    timed_release_data = _get_request_json(dict)
+    if timed_release_data is None:
+        return _invalid_request_body()
+
+    return flaskify(product_live_time.create_product_live_time_detail(
+        timed_release_data))
+
+
+@app.route('/product/<product_id>', methods=['PUT'])
+def upsert_product_live_time_detail(product_id):
+    """Create or replace product live time detail of a product id.
+
+    Args:
+        product_id (str): Product id to create or replace.
+
+    Returns:
+        flask.Response: Response contains dict describing product live time
+        details, or validation message.
+    """
+    timed_release_data = _get_request_json(dict)
+    if timed_release_data is None:
+        return _invalid_request_body()
+
+    return flaskify(product_live_time.upsert_product_live_time_detail(
+        product_id, timed_release_data))
+
+
+@app.route('/products', methods=['PUT'])
+def upsert_product_live_time_details_bulk():
+    """Create or replace several product live time details.
+
+    The body is a JSON array of product live time details.
+
+    Returns:
+        flask.Response: Response contains the result of each record, or
+        validation message.
+    """
+    timed_release_records = _get_request_json(list)
+    if timed_release_records is None:
+        return _invalid_request_body()
+
+    return flaskify(product_live_time.upsert_product_live_time_details_bulk(
+        timed_release_records))
+
+
+@app.route('/products', methods=['POST'])
+def create_product_live_time_details_bulk():
+    """Save info about several product live time details.
+
+    The body is a JSON array of product live time details.
+
+    Returns:
+        flask.Response: Response contains the result of each record, or
+        validation message.
+    """
+    timed_release_records = _get_request_json(list)
+    if timed_release_records is None:
+        return _invalid_request_body()
+
+    return flaskify(product_live_time.create_product_live_time_details_bulk(
+        timed_release_records))
+
+
+@app.route('/products', methods=['GET'])
+def get_product_live_details_batch():
+    """Get product live time details for a comma separated list of ids.
+
+    Example: `/products?ids=1,2,3`
+
+    Returns:
+        flask.Response: Response contains the found product live time
+        details keyed by product id and the list of missing ids, or
+        validation message.
+    """
+    product_ids = [
+        product_id for product_id in request.args.get('ids', '').split(',')
+        if product_id]
+    return _conditional_flaskify(
+        product_live_time.get_product_live_time_details_batch(product_ids),
+        _compute_batch_etag, serialization.encode_product_batch)
+
+
+@app.route('/products/next-release', methods=['GET'])
+def get_next_releases():
+    """Get the next instant each product of a list goes live.
+
+    Example: `/products/next-release?ids=1,2,3&at=1451606400`, `at` being the
+    reference time in seconds since the epoch, now by default.
+
+    Returns:
+        flask.Response: Response contains the next release of the found
+        products keyed by product id and the list of missing ids, or
+        validation message.
+    """
+    product_ids = [
+        product_id for product_id in request.args.get('ids', '').split(',')
+        if product_id]
+    return flaskify(product_live_time.get_next_releases(
+        product_ids, request.args.get('at')))
+
+
+@app.route('/products/window', methods=['GET'])
+def get_products_going_live():
+    """Get the products going live between two times of the day.
+
+    Example: `/products/window?start=23:30:00&end=00:30:00&store_id=1`, the
+    window wraps past midnight when the start is after the end.
+
+    Returns:
+        flask.Response: Response contains the products going live ordered by
+        time of day, or validation message.
+    """
+    return flaskify(product_live_time.get_products_going_live(
+        request.args.get('start', ''), request.args.get('end', ''),
+        request.args.get('store_id')))
+
+
+@app.route('/store/<store_id>/products', methods=['GET'])
+def get_store_products(store_id):
+    """Get a page of the products of a store, ordered by time of day.
+
+    Example: `/store/1/products?limit=100`, then
+    `/store/1/products?limit=100&cursor=<next_cursor>` for the next page.
+
+    Args:
+        store_id (str): Store of the products.
 
-    if not valid_request_json:
+    Returns:
+        flask.Response: Response contains the products of the page and the
+        cursor of the next page, or validation message.
+    """
+    return flaskify(product_live_time.get_store_products(
+        store_id, request.args.get('limit'), request.args.get('cursor')))
+
+
+@app.route('/products/export', methods=['GET'])
+def export_product_live_details():
+    """Stream all the product live time details.
+
+    Query parameters: `format` (`ndjson` or `csv`, defaults to `ndjson`),
+    and the optional `store_id` and `time_zone` filters.
+
+    Returns:
+        flask.Response: Streamed response with one product per line, or
+        validation message.
+    """
+    export_format = request.args.get('format', product_export.FORMAT_NDJSON)
+    export_response = product_export.export_product_live_times(
+        export_format, request.args.get('store_id'),
+        request.args.get('time_zone'))
+    if not export_response:
+        return flaskify(export_response)
+
+    return Response(
+        stream_with_context(export_response.message),
+        mimetype=product_export.EXPORT_MIMETYPES[export_format])
+
+
+@app.route('/products/import', methods=['POST'])
+def import_product_live_details():
+    """Import product live time details streamed in the request body.
+
+    The body is read as it is received, so it can be of any size. Query
+    parameters: `format` (`ndjson` or `csv`, defaults to `csv` for a
+    `text/csv` body and to `ndjson` otherwise) and `offset`, the number of
+    rows to skip to resume a previous import.
+
+    Returns:
+        flask.Response: Response contains the summary of the import, or
+        validation message.
+    """
+    default_format = product_import.FORMAT_NDJSON
+    if request.mimetype == 'text/csv':
+        default_format = product_import.FORMAT_CSV
+    offset = request.args.get('offset', '0')
+    if not offset or not validators.ASCII_DIGITS.issuperset(offset):
         return flaskify(response.create_error_response(
             code=error.ERROR_CODE_BAD_REQUEST,
-            message=error.ERROR_MESSAGE_INVALID_REQUEST_BODY))
+            message=error.ERROR_MESSAGE_IMPORT_OFFSET))
 
-    return flaskify(product_live_time.create_product_live_time_detail(
-        timed_release_data))
+    def log_progress(summary):
+        g.log.info('Import progress: {} rows committed'.format(
+            summary['committed_offset']))
+
+    return flaskify(product_import.import_product_live_times(
+        request.stream, request.args.get('format', default_format),
+        int(offset), log_progress))
+
+
+@app.route('/products/lookup', methods=['POST'])
+def lookup_product_live_details():
+    """Get product live time details for the ids given in the body.
+
+    The body is a JSON object: `{"product_ids": [1, 2, 3]}`.
+
+    Returns:
+        flask.Response: Response contains the found product live time
+        details keyed by product id and the list of missing ids, or
+        validation message.
+    """
+    lookup_data = _get_request_json(dict)
+    if lookup_data is None or \
+            not isinstance(lookup_data.get('product_ids'), list):
+        return _invalid_request_body()
+
+    return _conditional_flaskify(
+        product_live_time.get_product_live_time_details_batch(
+            lookup_data['product_ids']),
+        _compute_batch_etag, serialization.encode_product_batch)
 
 
 @app.route('/product/<product_id>', methods=['DELETE'])
@@ -119,3 +336,78 @@ def delete_product_live_details(product_id):
     """
     return flaskify(product_live_time.delete_product_live_time_details(
         product_id))
+
+
+def _conditional_flaskify(message_response, compute_etag, encode):
+    """Format a response with its ETag, honoring `If-None-Match`.
+
+    Args:
+        message_response (response.Response): Response of the logic layer.
+        compute_etag (func): Function computing the entity tag of the
+            message of a successful response.
+        encode (func): Function encoding the message of a successful
+            response as JSON.
+
+    Returns:
+        flask.Response: A 304 response without body when the client already
+        has the current version, the formatted response with its ETag
+        otherwise.
+    """
+    if not message_response:
+        return flaskify(message_response)
+
+    entity_tag = compute_etag(message_response.message)
+    if request.if_none_match.contains_weak(entity_tag):
+        not_modified_response = Response(status=304)
+        not_modified_response.set_etag(entity_tag)
+        return not_modified_response
+
+    flask_response = Response(
+        encode(message_response.message), status=message_response.status,
+        mimetype='application/json')
+    flask_response.set_etag(entity_tag)
+    return flask_response
+
+
+def _compute_batch_etag(batch):
+    """Compute the entity tag of a batch of product live times.
+
+    Args:
+        batch (dict): found products and missing product ids.
+
+    Returns:
+        str: The entity tag of the batch.
+    """
+    return etag.compute_collection_etag(
+        batch['products'].values(), batch['missing'])
+
+
+def _get_request_json(expected_type):
+    """Get the JSON body of the current request.
+
+    Args:
+        expected_type (type): Type the decoded body must have.
+
+    Returns:
+        The decoded body, or None if it is not valid JSON of the expected
+        type.
+    """
+    try:
+        request_data = request.get_json()
+    except BadRequest:
+        return None
+
+    if not isinstance(request_data, expected_type):
+        return None
+    return request_data
+
+
+def _invalid_request_body():
+    """Return the response for a request with an invalid body.
+
+    Returns:
+        flask.Response: A 400 response.
+    """
+    return flaskify(response.create_error_response(
+        code=error.ERROR_CODE_BAD_REQUEST,
+        message=error.ERROR_MESSAGE_INVALID_REQUEST_BODY))
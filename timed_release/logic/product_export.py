@@ -0,0 +1,125 @@
+"""Product Live Time Export Logic.
+
+Serializes the whole product_live_time table as NDJSON or CSV. The output is
+produced by generators, one chunk of `config.EXPORT_BATCH_SIZE` rows at a
+time, so it can be streamed by the handlers or written to a file by the CLI
+without holding the table in memory.
+"""
+
+import csv
+import io
+import json
+
+from oto import response
+
+from timed_release import config
+from timed_release.constants import error
+from timed_release.models import product_live_time
+from timed_release.validation import validators
+
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+
+# Mimetype of each export format
+EXPORT_MIMETYPES = {
+    FORMAT_NDJSON: 'application/x-ndjson',
+    FORMAT_CSV: 'text/csv'
+}
+
+CSV_FIELDS = ('product_id', 'time_of_day_product', 'time_zone', 'store_id')
+
+
+def export_product_live_times(
+        export_format=FORMAT_NDJSON, store_id=None, time_zone=None):
+    """Validate the export parameters and prepare the export.
+
+    Args:
+        export_format (str): `ndjson` or `csv`.
+        store_id (str): Only export the products of this store.
+        time_zone (str): Only export the products with this time zone.
+
+    Returns:
+        response.Response: message containing a generator of the exported
+        text chunks, or validation message.
+    """
+    if export_format not in EXPORT_MIMETYPES:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_EXPORT_FORMAT.format(
+                ', '.join(sorted(EXPORT_MIMETYPES))))
+
+    if store_id is not None:
+        if not validators.is_digit_and_non_zero(store_id):
+            return response.create_error_response(
+                code=error.ERROR_CODE_BAD_REQUEST,
+                message=error.ERROR_MESSAGE_INTEGER_NON_NEGATIVE.format(
+                    'store_id'))
+        store_id = int(store_id)
+
+    if time_zone is not None and not validators.validate_time_zone(
+            time_zone):
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_TIME_ZONE)
+
+    products = product_live_time.iter_product_live_times(
+        store_id=store_id, time_zone=time_zone)
+    if export_format == FORMAT_CSV:
+        return response.Response(message=_to_csv(products))
+    return response.Response(message=_to_ndjson(products))
+
+
+def _to_ndjson(products):
+    """Serialize products as newline delimited JSON.
+
+    Args:
+        products (iterable): Product live time dicts.
+
+    Yields:
+        str: Chunks of `config.EXPORT_BATCH_SIZE` lines.
+    """
+    for batch in _batches(products, config.EXPORT_BATCH_SIZE):
+        yield ''.join(
+            json.dumps(product, sort_keys=True) + '\n' for product in batch)
+
+
+def _to_csv(products):
+    """Serialize products as CSV with a header line.
+
+    Args:
+        products (iterable): Product live time dicts.
+
+    Yields:
+        str: The header, then chunks of `config.EXPORT_BATCH_SIZE` lines.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_FIELDS, lineterminator='\n')
+    writer.writeheader()
+    yield buffer.getvalue()
+
+    for batch in _batches(products, config.EXPORT_BATCH_SIZE):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+def _batches(items, size):
+    """Group the items of an iterator into lists.
+
+    Args:
+        items (iterable): Items to group.
+        size (int): Maximum size of each list.
+
+    Yields:
+        list: The next list of items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,223 @@
+"""Product Live Time Import Logic.
+
+Loads NDJSON or CSV product live times from a binary stream, such as the body
+of a request or a file. The stream is parsed one row at a time, rows are
+validated in batches, each row getting its own errors, and valid rows are
+upserted in transactions of `config.IMPORT_COMMIT_SIZE` rows. An import that
+fails can be resumed with the `committed_offset` of its summary: rows before
+the offset are skipped.
+"""
+
+import csv
+import itertools
+import json
+import re
+
+from oto import response
+
+from timed_release import config
+from timed_release.constants import error
+from timed_release.models import product_live_time
+from timed_release.validation import validators
+
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+IMPORT_FORMATS = (FORMAT_NDJSON, FORMAT_CSV)
+
+# CSV columns holding integers, empty values are read as None
+CSV_INTEGER_FIELDS = ('product_id', 'store_id')
+
+# Characters the bytes that are not UTF-8 are decoded to, with the
+# surrogateescape error handler
+_UNDECODABLE = re.compile('[\udc80-\udcff]')
+
+
+def import_product_live_times(
+        stream, import_format=FORMAT_NDJSON, offset=0, progress=None):
+    """Import product live times from a stream.
+
+    Args:
+        stream (file): Binary stream of NDJSON or CSV rows.
+        import_format (str): `ndjson` or `csv`.
+        offset (int): Number of rows to skip, from a previous import.
+        progress (func): Called with the current summary after each commit.
+
+    Returns:
+        response.Response: Summary of the import: rows `processed`,
+        `inserted`, `updated` and `rejected`, the first rejected rows with
+        their errors and the `committed_offset`. A fatal response with the
+        summary when the database fails, or validation message.
+    """
+    if import_format not in IMPORT_FORMATS:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_EXPORT_FORMAT.format(
+                ', '.join(IMPORT_FORMATS)))
+
+    if not isinstance(offset, int) or offset < 0:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_IMPORT_OFFSET)
+
+    summary = {
+        'processed': 0,
+        'inserted': 0,
+        'updated': 0,
+        'rejected': 0,
+        'rejections': [],
+        'committed_offset': offset
+    }
+    rows = _read_csv(stream) if import_format == FORMAT_CSV else \
+        _read_ndjson(stream)
+
+    pending_records = []
+    for row_number, (record, row_error) in enumerate(
+            _validate_rows(itertools.islice(rows, offset, None)), offset):
+        summary['processed'] += 1
+        if row_error:
+            _reject(summary, row_number, row_error)
+        else:
+            pending_records.append(record)
+
+        if len(pending_records) == config.IMPORT_COMMIT_SIZE:
+            commit_response = _commit(
+                summary, pending_records, row_number + 1, progress)
+            if not commit_response:
+                return commit_response
+            pending_records = []
+
+    commit_response = _commit(
+        summary, pending_records, offset + summary['processed'], progress)
+    if not commit_response:
+        return commit_response
+    return response.Response(message=summary)
+
+
+def _validate_rows(rows):
+    """Validate the records of rows, in batches of `config.IMPORT_COMMIT_SIZE`.
+
+    Batches are validated with `validators.validate_timed_release_records`,
+    as columns when they are large enough.
+
+    Args:
+        rows (iterator): Rows read, as (record, errors) tuples.
+
+    Yields:
+        tuple: The record and None, or the record and the errors of the row.
+    """
+    while True:
+        batch = list(itertools.islice(rows, config.IMPORT_COMMIT_SIZE))
+        if not batch:
+            return
+
+        validation_errors = iter(validators.validate_timed_release_records(
+            [record for record, row_error in batch if not row_error],
+            validators.TIMED_RELEASE_REQUIRED_FIELDS))
+        for record, row_error in batch:
+            yield record, row_error or next(validation_errors) or None
+
+
+def _commit(summary, records, next_offset, progress):
+    """Write the pending records and update the summary.
+
+    Args:
+        summary (dict): Summary of the import.
+        records (list): Validated records to write.
+        next_offset (int): Offset of the first row after the records.
+        progress (func): Called with the summary once committed.
+
+    Returns:
+        response.Response: The summary, or a fatal response with the summary
+        when the records could not be written.
+    """
+    if records:
+        import_response = product_live_time.import_product_live_time_details(
+            records)
+        if not import_response:
+            return response.create_fatal_response({
+                'error': error.ERROR_MESSAGE_IMPORT_FAILED,
+                'summary': summary})
+        summary['inserted'] += import_response.message['inserted']
+        summary['updated'] += import_response.message['updated']
+
+    summary['committed_offset'] = next_offset
+    if progress:
+        progress(summary)
+    return response.Response(message=summary)
+
+
+def _reject(summary, row_number, row_error):
+    """Count a rejected row, and report it unless too many were reported.
+
+    Args:
+        summary (dict): Summary of the import.
+        row_number (int): Number of the row, starting from 0.
+        row_error (list): Errors of the row.
+    """
+    summary['rejected'] += 1
+    if len(summary['rejections']) < config.IMPORT_MAX_REPORTED_REJECTIONS:
+        summary['rejections'].append({'row': row_number, 'errors': row_error})
+
+
+def _read_ndjson(lines):
+    """Read records from newline delimited JSON, ignoring blank lines.
+
+    Args:
+        lines (iterable): UTF-8 encoded lines to read (bytes).
+
+    Yields:
+        tuple: The record (dict) and None, or None and the errors of the
+        line when it is not a UTF-8 JSON object.
+    """
+    for line in lines:
+        try:
+            line = line.decode('utf-8')
+        except UnicodeDecodeError:
+            yield None, [
+                {'invalid record': error.ERROR_MESSAGE_INVALID_ENCODING}]
+            continue
+
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+
+        if isinstance(record, dict):
+            yield record, None
+        else:
+            yield None, [{
+                'invalid record': error.ERROR_MESSAGE_INVALID_JSON_LINE}]
+
+
+def _read_csv(lines):
+    """Read records from CSV with a header line.
+
+    Integer columns are converted when they only contain digits, so that
+    other values are rejected by the validators.
+
+    Args:
+        lines (iterable): UTF-8 encoded lines to read (bytes).
+
+    Yields:
+        tuple: The record (dict) and None, or None and the errors of the
+        row when it is not UTF-8.
+    """
+    decoded_lines = (
+        line.decode('utf-8', 'surrogateescape') for line in lines)
+    for record in csv.DictReader(decoded_lines):
+        if any(isinstance(value, str) and _UNDECODABLE.search(value)
+               for value in record.values()):
+            yield None, [
+                {'invalid record': error.ERROR_MESSAGE_INVALID_ENCODING}]
+            continue
+
+        for field in CSV_INTEGER_FIELDS:
+            value = record.get(field)
+            if not value:
+                record[field] = None
+            elif validators.ASCII_DIGITS.issuperset(value):
+                record[field] = int(value)
+        yield record, None
@@ -1,12 +1,25 @@
 """Product Live Time Logic CRUD operation."""
 
+import base64
+import binascii
+from collections import OrderedDict
+import json
+import time
+
 from oto import response
+from oto import status
 
+from timed_release import config
+from timed_release import release_time
+from timed_release import tracing
 from timed_release.constants import error
 from timed_release.models import product_live_time
+from timed_release.models import time_index
+from timed_release.validation import engine
 from timed_release.validation import validators
 
 
+@tracing.traced('logic')
 def get_product_live_time_details(product_id):
     """Check if product id exist in product live table and return it.
 
@@ -25,6 +38,196 @@ def get_product_live_time_details(product_id):
     return product_live_time.get_product_live_time_details(product_id)
 
 
+@tracing.traced('logic')
+def get_product_live_time_details_batch(product_ids):
+    """Validate a list of product ids and fetch all of them at once.
+
+    Duplicated ids are only looked up once, the order of the first
+    occurrence is kept for the list of missing ids.
+
+    Args:
+        product_ids (list): Product ids (str or int) to fetch.
+
+    Return:
+        response.Response: dict with the found products and the missing ids
+        on successful fetch or error response.
+    """
+    if not product_ids:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_PRODUCT_IDS_REQUIRED)
+
+    if len(product_ids) > config.BATCH_MAX_PRODUCT_IDS:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_TOO_MANY_PRODUCT_IDS.format(
+                config.BATCH_MAX_PRODUCT_IDS))
+
+    invalid_product_ids = [
+        product_id for product_id in product_ids
+        if not validators.is_digit_and_non_zero(str(product_id))]
+    if invalid_product_ids:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_INVALID_PRODUCT_IDS.format(
+                ', '.join(str(product_id)
+                          for product_id in invalid_product_ids)))
+
+    unique_product_ids = list(OrderedDict.fromkeys(
+        int(product_id) for product_id in product_ids))
+    return product_live_time.get_product_live_time_details_batch(
+        unique_product_ids)
+
+
+@tracing.traced('logic')
+def get_next_releases(product_ids, reference=None):
+    """Get the next instant each product of a list goes live.
+
+    Args:
+        product_ids (list): Product ids (str or int) to fetch.
+        reference (str): Seconds since the epoch to get the next releases
+            after, defaults to now.
+
+    Return:
+        response.Response: next release of the found products keyed by
+        product id, in seconds since the epoch and in ISO 8601 UTC, with
+        the time zone it was resolved in, and the list of missing ids, or
+        error response.
+    """
+    if reference is None:
+        reference = int(time.time())
+    elif validators.is_digit_and_non_zero(reference):
+        reference = int(reference)
+    else:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_REFERENCE_TIME)
+
+    batch_response = get_product_live_time_details_batch(product_ids)
+    if not batch_response:
+        return batch_response
+
+    products = list(batch_response.message['products'].values())
+    next_releases = release_time.compute_next_releases(products, reference)
+    releases = {}
+    for product, next_release in zip(products, next_releases.tolist()):
+        releases[str(product['product_id'])] = {
+            'next_release': next_release,
+            'next_release_utc': time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(next_release)),
+            'time_zone_name': str(release_time.resolve_time_zone(
+                product['time_zone'], product['store_id']))}
+    return response.Response(message={
+        'releases': releases,
+        'missing': batch_response.message['missing']})
+
+
+@tracing.traced('logic')
+def get_products_going_live(start_time, end_time, store_id=None):
+    """Get the products going live within a time of day window.
+
+    The window includes its bounds and wraps past midnight when the start is
+    after the end. It is answered from the in-memory time index when
+    `config.WINDOW_INDEX_IN_MEMORY` is set, from the database otherwise.
+
+    Args:
+        start_time (str): Start of the window, HH:MM:SS.
+        end_time (str): End of the window, HH:MM:SS.
+        store_id (str): Only get the products of this store.
+
+    Return:
+        response.Response: products going live and whether the list is
+        truncated, or error response.
+    """
+    if not validators.validate_time(start_time) or \
+            not validators.validate_time(end_time):
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_TIME_OF_DAY_RELEASE)
+
+    if store_id is not None:
+        if not validators.is_digit_and_non_zero(store_id):
+            return response.create_error_response(
+                code=error.ERROR_CODE_BAD_REQUEST,
+                message=error.ERROR_MESSAGE_INTEGER_NON_NEGATIVE.format(
+                    'store_id'))
+        store_id = int(store_id)
+
+    if not config.WINDOW_INDEX_IN_MEMORY:
+        return product_live_time.get_products_going_live(
+            start_time, end_time, store_id)
+
+    product_ids = time_index.get_time_index().window(
+        engine.parse_time(start_time), engine.parse_time(end_time), store_id,
+        limit=config.WINDOW_MAX_RESULTS + 1)
+    batch_response = product_live_time.get_product_live_time_details_batch(
+        product_ids[:config.WINDOW_MAX_RESULTS])
+    if not batch_response:
+        return batch_response
+
+    products = batch_response.message['products']
+    return response.Response(message={
+        'products': [
+            dict(products[str(product_id)]) for product_id in product_ids
+            if str(product_id) in products],
+        'truncated': len(product_ids) > config.WINDOW_MAX_RESULTS})
+
+
+@tracing.traced('logic')
+def get_store_products(store_id, limit=None, cursor=None):
+    """Get a page of the products of a store, ordered by time of day.
+
+    Args:
+        store_id (str): Store of the products.
+        limit (str): Maximum number of products of the page, defaults to
+            `config.STORE_PRODUCTS_PAGE_SIZE`.
+        cursor (str): `next_cursor` of the previous page, None for the first
+            page.
+
+    Return:
+        response.Response: products of the page and the cursor of the next
+        page, None on the last page, or error response.
+    """
+    if not validators.is_digit_and_non_zero(store_id):
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_INTEGER_NON_NEGATIVE.format(
+                'store_id'))
+
+    if limit is None:
+        limit = str(config.STORE_PRODUCTS_PAGE_SIZE)
+    if not validators.is_digit_and_non_zero(limit) or \
+            int(limit) > config.STORE_PRODUCTS_MAX_PAGE_SIZE:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_PAGE_SIZE.format(
+                config.STORE_PRODUCTS_MAX_PAGE_SIZE))
+
+    after = None
+    if cursor is not None:
+        after = _decode_cursor(cursor)
+        if after is None:
+            return response.create_error_response(
+                code=error.ERROR_CODE_BAD_REQUEST,
+                message=error.ERROR_MESSAGE_INVALID_CURSOR)
+
+    page_response = product_live_time.get_store_products(
+        int(store_id), int(limit), after)
+    if not page_response:
+        return page_response
+
+    products = page_response.message['products']
+    next_cursor = None
+    if page_response.message['has_more']:
+        last_product = products[-1]
+        next_cursor = _encode_cursor(
+            last_product['time_of_day_product'], last_product['product_id'])
+    return response.Response(message={
+        'products': products,
+        'next_cursor': next_cursor})
+
+
+@tracing.traced('logic')
 def create_product_live_time_detail(timed_release_data):
     """Create product live time details.
 
@@ -44,6 +247,70 @@ def create_product_live_time_detail(timed_release_data):
         product_id, time_of_day_product, time_zone, store_id)
 
 
+@tracing.traced('logic')
+def create_product_live_time_details_bulk(timed_release_records):
+    """Create product live time details for a list of records.
+
+    Every record is validated on its own: invalid records are reported and
+    the valid ones are still created.
+
+    Args:
+        timed_release_records (list): Timed release data to create.
+
+    Returns:
+        response.Response: Message contains the result of each record,
+        identified by its index in the request, with the number of created
+        and failed records, or validation message.
+    """
+    return _write_records_in_bulk(
+        timed_release_records,
+        product_live_time.create_product_live_time_details_bulk, 'created')
+
+
+@tracing.traced('logic')
+def upsert_product_live_time_detail(product_id, timed_release_data):
+    """Create or replace product live time details of a product id.
+
+    Args:
+        product_id (str): Product id to create or replace.
+        timed_release_data (dict): Timed release data to write.
+
+    Returns:
+        response.Response: Message contains dict describing product live time
+        details, or validation message.
+    """
+    if not validators.is_digit_and_non_zero(product_id):
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_INTEGER_NON_NEGATIVE.format(
+                product_id))
+
+    return product_live_time.upsert_product_live_time_details(
+        int(product_id), timed_release_data.get('time_of_day_product'),
+        timed_release_data.get('time_zone'),
+        timed_release_data.get('store_id'))
+
+
+@tracing.traced('logic')
+def upsert_product_live_time_details_bulk(timed_release_records):
+    """Create or replace product live time details for a list of records.
+
+    Every record is validated on its own: invalid records are reported and
+    the valid ones are still written.
+
+    Args:
+        timed_release_records (list): Timed release data to write.
+
+    Returns:
+        response.Response: Message contains the result of each record,
+        identified by its index in the request, or validation message.
+    """
+    return _write_records_in_bulk(
+        timed_release_records,
+        product_live_time.upsert_product_live_time_details_bulk, 'upserted')
+
+
+@tracing.traced('logic')
 def delete_product_live_time_details(product_id):
     """Delete product live time details by product id.
 
@@ -61,6 +328,7 @@ def delete_product_live_time_details(product_id):
     return product_live_time.delete_product_live_time_details(product_id)
 
 
+@tracing.traced('logic')
 def update_product_live_time(product_id, data):
     """Update product live time details.
 
@@ -84,3 +352,147 @@ def update_product_live_time(product_id, data):
         return response.create_error_response(
             code=error.ERROR_CODE_BAD_REQUEST, message=validation_error)
     return product_live_time.update_product_live_time_details(product_id, data)
+
+
+def _write_records_in_bulk(timed_release_records, write_records, success):
+    """Validate records and write the valid ones with the given function.
+
+    Args:
+        timed_release_records (list): Timed release data to write.
+        write_records (func): Model function writing a list of valid records
+            and returning the errors of each of them.
+        success (str): Status of the records written successfully.
+
+    Returns:
+        response.Response: Message contains the result of each record, or
+        validation message.
+    """
+    if not timed_release_records:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_RECORDS_REQUIRED)
+
+    if len(timed_release_records) > config.BULK_MAX_RECORDS:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST,
+            message=error.ERROR_MESSAGE_TOO_MANY_RECORDS.format(
+                config.BULK_MAX_RECORDS))
+
+    record_errors = _validate_records(timed_release_records)
+    valid_indexes = [
+        index for index, record_error in enumerate(record_errors)
+        if not record_error]
+
+    if valid_indexes:
+        write_response = write_records(
+            [timed_release_records[index] for index in valid_indexes])
+        if not write_response:
+            return write_response
+        for index, record_error in zip(valid_indexes, write_response.message):
+            record_errors[index] = record_error
+
+    return _create_bulk_response(
+        timed_release_records, record_errors, success)
+
+
+@tracing.traced('validation')
+def _validate_records(timed_release_records):
+    """Validate each record of a bulk request.
+
+    Large requests are validated as columns, see
+    `validators.validate_timed_release_records`.
+
+    Args:
+        timed_release_records (list): Timed release data to validate.
+
+    Returns:
+        list: For each record, None if it is valid or the list of errors.
+    """
+    record_errors = [
+        None if isinstance(timed_release_data, dict) else
+        [{'invalid record': error.ERROR_MESSAGE_INVALID_RECORD}]
+        for timed_release_data in timed_release_records]
+    positions = [
+        position for position, record_error in enumerate(record_errors)
+        if record_error is None]
+    validation_errors = validators.validate_timed_release_records(
+        [timed_release_records[position] for position in positions],
+        validators.TIMED_RELEASE_REQUIRED_FIELDS, check_duplicates=True)
+    for position, validation_error in zip(positions, validation_errors):
+        record_errors[position] = validation_error or None
+    return record_errors
+
+
+def _create_bulk_response(timed_release_records, record_errors, success):
+    """Create the response of a bulk request.
+
+    Args:
+        timed_release_records (list): Timed release data of the request.
+        record_errors (list): For each record, None if it succeeded or the
+            list of its errors.
+        success (str): Status of the records that succeeded.
+
+    Returns:
+        response.Response: Response with one result per record. The status is
+        a 207 when at least one record failed.
+    """
+    results = []
+    for index, record_error in enumerate(record_errors):
+        result = {'index': index, 'status': success}
+        if isinstance(timed_release_records[index], dict):
+            result['product_id'] = timed_release_records[index].get(
+                'product_id')
+        if record_error:
+            result['status'] = 'error'
+            result['errors'] = record_error
+        results.append(result)
+
+    failed_count = sum(1 for record_error in record_errors if record_error)
+    return response.Response(
+        message={
+            'results': results,
+            success: len(record_errors) - failed_count,
+            'failed': failed_count},
+        status=status.MULTIPLE_STATUS if failed_count else status.OK)
+
+
+def _encode_cursor(time_of_day_product, product_id):
+    """Encode the position of a product into an opaque page cursor.
+
+    Args:
+        time_of_day_product (str): Time of day of the product, HH:MM:SS.
+        product_id (int): Id of the product.
+
+    Returns:
+        str: URL safe cursor.
+    """
+    position = json.dumps([time_of_day_product, product_id])
+    return base64.urlsafe_b64encode(
+        position.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    """Decode a page cursor made by `_encode_cursor`.
+
+    Args:
+        cursor (str): Cursor to decode.
+
+    Returns:
+        tuple: Time of day (str) and product id (int), or None if the cursor
+        is not valid.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(
+            (cursor + '=' * (-len(cursor) % 4)).encode('ascii')).decode(
+                'utf-8'))
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+    if not isinstance(position, list) or len(position) != 2:
+        return None
+    time_of_day_product, product_id = position
+    if not isinstance(time_of_day_product, str) or \
+            not validators.validate_time(time_of_day_product) or \
+            not validators.is_integer_and_non_negative(product_id):
+        return None
+    return time_of_day_product, product_id
@@ -0,0 +1,101 @@
+"""Logic for Stats.
+
+Gathers the counters of the in-process caches so they can be scraped, as
+JSON, or in the Prometheus text format with the request and query metrics.
+"""
+
+from oto import response
+
+from timed_release import metrics
+from timed_release.connectors import sql
+from timed_release.models import product_live_time
+
+
+def get_stats():
+    """Get the counters of the service.
+
+    Returns:
+        response.Response: dict of counters, grouped by component.
+    """
+    return response.Response(message={
+        'product_cache': product_live_time.product_cache.stats(),
+        'statement_cache': sql.statement_cache.stats(),
+        'replicas': sql.replica_router.stats(),
+        'pools': sql.pool_stats(),
+        'liveness': sql.liveness.stats(),
+        'slow_queries': sql.slow_query_log.stats()})
+
+
+def get_metrics():
+    """Get the metrics of the service, in the Prometheus text format.
+
+    Returns:
+        response.Response: the metrics (str).
+    """
+    return response.Response(
+        message=metrics.registry.render(_get_stats_families()))
+
+
+def _get_stats_families():
+    """Turn the counters of `get_stats` into metrics.
+
+    Returns:
+        list: (name, type, help, samples) tuples of `metrics.render`.
+    """
+    stats = get_stats().message
+    caches = [
+        ({'cache': 'product'}, stats['product_cache']),
+        ({'cache': 'statement'}, stats['statement_cache'])]
+    pools = sorted(stats['pools'].items())
+    replicas = stats['replicas']
+    liveness = stats['liveness']
+    slow_queries = stats['slow_queries']
+
+    families = [
+        ('timed_release_cache_{}_total'.format(counter), 'counter',
+         'Cache {}.'.format(counter),
+         [(labels, cache[counter]) for labels, cache in caches])
+        for counter in ('hits', 'misses', 'evictions')]
+    families.extend([
+        ('timed_release_cache_size', 'gauge', 'Entries in the cache.',
+         [(labels, cache['size']) for labels, cache in caches]),
+        ('timed_release_cache_max_size', 'gauge', 'Entries the cache holds.',
+         [(labels, cache['max_size']) for labels, cache in caches]),
+        ('timed_release_pool_connections', 'gauge',
+         'Connections of the pool, in use, idle or above its size.',
+         [({'pool': name, 'state': state}, pool[state])
+          for name, pool in pools
+          for state in ('in_use', 'idle', 'overflow')]),
+        ('timed_release_pool_limit', 'gauge',
+         'Connections the pool opens at most.',
+         [({'pool': name}, pool['limit']) for name, pool in pools]),
+        ('timed_release_pool_checkouts_total', 'counter',
+         'Connections checked out of the pool.',
+         [({'pool': name}, pool['checkouts']) for name, pool in pools]),
+        ('timed_release_pool_timeouts_total', 'counter',
+         'Checkouts that timed out waiting for a connection.',
+         [({'pool': name}, pool['timeouts']) for name, pool in pools]),
+        ('timed_release_pool_wait_seconds_total', 'counter',
+         'Time checkouts waited for a connection.',
+         [({'pool': name}, pool['wait_seconds']) for name, pool in pools]),
+        ('timed_release_replica_reads_total', 'counter',
+         'Reads sent to the replicas, or to the primary.',
+         [({'target': 'replica'}, replicas['replica_reads']),
+          ({'target': 'primary'}, replicas['primary_reads'])]),
+        ('timed_release_replica_failures_total', 'counter',
+         'Replicas that failed to connect.',
+         [({}, replicas['failures'])]),
+        ('timed_release_replicas_available', 'gauge',
+         'Replicas reads can go to.',
+         [({}, replicas['available_replicas'])]),
+        ('timed_release_connection_checks_total', 'counter',
+         'Connections checked out, pinged or not.',
+         [({'result': 'pinged'}, liveness['pings']),
+          ({'result': 'skipped'}, liveness['skipped_pings'])]),
+        ('timed_release_connection_reconnects_total', 'counter',
+         'First statements run again on a new connection.',
+         [({}, liveness['reconnects'])]),
+        ('timed_release_slow_queries_total', 'counter',
+         'Statements slower than the slow query threshold.',
+         [({}, slow_queries['slow_queries'])])])
+    return families
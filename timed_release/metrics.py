@@ -0,0 +1,347 @@
+"""Metrics.
+
+Counters and latency histograms of the service, exposed in the Prometheus
+text format at `config.METRICS_PATH`. `init_app` records the rate, errors
+and duration of the requests per endpoint and status code, and `watch`
+the count and duration of the SQL queries of an engine.
+
+Recording does not take a lock: every thread adds to its own values, and
+the values of all the threads are only summed when the metrics are
+rendered. Values of the threads that ended are merged into a single set, so
+that a server starting a thread per request does not keep them all.
+
+Usage:
+    queries = Counter('queries_total', 'Queries run.', ('operation',))
+    queries.inc(('SELECT',))
+    text = registry.render()
+"""
+
+import bisect
+import threading
+import time
+
+import flask
+from sqlalchemy import event
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the latency histograms, in seconds
+REQUEST_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# SQL operations queries are labelled with, the others being OTHER
+_OPERATIONS = frozenset(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE'))
+
+
+class Registry:
+    """Metrics and the values recorded by each thread."""
+
+    def __init__(self):
+        """Create an empty registry."""
+        self.metrics = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._retired = {}
+
+    def register(self, metric):
+        """Add a metric to render.
+
+        Args:
+            metric (Counter|Histogram): The metric.
+
+        Returns:
+            The metric.
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def values(self):
+        """Get the values the current thread records.
+
+        Returns:
+            dict: Values keyed by metric name and label values.
+        """
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._threads.append((threading.current_thread(), values))
+            return values
+
+    def collect(self):
+        """Sum the values recorded by all the threads.
+
+        Returns:
+            dict: Values keyed by metric name and label values.
+        """
+        with self._lock:
+            alive = []
+            for thread, values in self._threads:
+                if thread.is_alive():
+                    alive.append((thread, values))
+                else:
+                    _merge(self._retired, values)
+            self._threads = alive
+            totals = {}
+            _merge(totals, self._retired)
+            for _, values in alive:
+                _merge(totals, values)
+        return totals
+
+    def render(self, families=()):
+        """Render the metrics in the Prometheus text format.
+
+        Args:
+            families (iterable): Other metrics, computed when rendered, as
+                (name, type, help, samples) tuples, samples being
+                (labels dict, value) tuples.
+
+        Returns:
+            str: The metrics.
+        """
+        totals = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(totals))
+        for name, metric_type, help_text, samples in families:
+            lines.extend(_header(name, metric_type, help_text))
+            lines.extend(
+                _sample(name, labels, value) for labels, value in samples)
+        return ''.join(line + '\n' for line in lines)
+
+
+registry = Registry()
+
+
+class Counter:
+    """Counter of events, by label values."""
+
+    def __init__(self, name, help_text, label_names=()):
+        """Create a counter in the registry.
+
+        Args:
+            name (str): Name of the metric.
+            help_text (str): Description of the metric.
+            label_names (tuple): Names of the labels.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        registry.register(self)
+
+    def inc(self, label_values=(), amount=1):
+        """Add to the counter.
+
+        Args:
+            label_values (tuple): Values of the labels.
+            amount (float): Amount to add.
+        """
+        values = registry.values()
+        key = (self.name, label_values)
+        values[key] = values.get(key, 0) + amount
+
+    def render(self, totals):
+        """Render the counter.
+
+        Args:
+            totals (dict): Values of all the threads.
+
+        Returns:
+            list: Lines of the counter.
+        """
+        lines = _header(self.name, 'counter', self.help_text)
+        for (name, label_values), value in sorted(totals.items()):
+            if name == self.name:
+                lines.append(_sample(
+                    name, zip(self.label_names, label_values), value))
+        return lines
+
+
+class Histogram:
+    """Distribution of durations, by label values."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=()):
+        """Create a histogram in the registry.
+
+        Args:
+            name (str): Name of the metric.
+            help_text (str): Description of the metric.
+            label_names (tuple): Names of the labels.
+            buckets (tuple): Sorted upper bounds of the buckets.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        registry.register(self)
+
+    def observe(self, value, label_values=()):
+        """Record a value.
+
+        Args:
+            value (float): The value.
+            label_values (tuple): Values of the labels.
+        """
+        values = registry.values()
+        key = (self.name, label_values)
+        counts = values.get(key)
+        if counts is None:
+            # Count of each bucket and above the last one, sum and count
+            counts = values[key] = [0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def render(self, totals):
+        """Render the histogram, with cumulative buckets.
+
+        Args:
+            totals (dict): Values of all the threads.
+
+        Returns:
+            list: Lines of the histogram.
+        """
+        lines = _header(self.name, 'histogram', self.help_text)
+        bounds = [_format(bound) for bound in self.buckets] + ['+Inf']
+        for (name, label_values), counts in sorted(totals.items()):
+            if name != self.name:
+                continue
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(_sample(
+                    name + '_bucket', labels + [('le', bound)], cumulative))
+            lines.append(_sample(name + '_sum', labels, counts[-2]))
+            lines.append(_sample(name + '_count', labels, counts[-1]))
+        return lines
+
+
+requests_total = Counter(
+    'timed_release_requests_total', 'Requests handled.',
+    ('endpoint', 'method', 'status'))
+request_duration = Histogram(
+    'timed_release_request_duration_seconds', 'Time to handle requests.',
+    ('endpoint', 'status'), REQUEST_BUCKETS)
+query_duration = Histogram(
+    'timed_release_query_duration_seconds', 'Time to run SQL queries.',
+    ('operation',), QUERY_BUCKETS)
+
+
+def init_app(app):
+    """Record the rate, errors and duration of the requests of an app.
+
+    Args:
+        app (flask.Flask): Application to set up.
+    """
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+
+
+def watch(engine):
+    """Record the count and duration of the SQL queries of an engine.
+
+    Args:
+        engine (Engine): Engine to watch.
+    """
+    event.listen(engine, 'before_cursor_execute', _start_query)
+    event.listen(engine, 'after_cursor_execute', _record_query)
+
+
+def _start_request():
+    """Keep the time the request started."""
+    flask.g.metrics_started = time.monotonic()
+
+
+def _record_request(flask_response):
+    """Record the duration and the status of the request."""
+    started = getattr(flask.g, 'metrics_started', None)
+    if started is not None:
+        endpoint = flask.request.endpoint or 'none'
+        status = str(flask_response.status_code)
+        requests_total.inc((endpoint, flask.request.method, status))
+        request_duration.observe(
+            time.monotonic() - started, (endpoint, status))
+    return flask_response
+
+
+def _start_query(connection, cursor, statement, parameters, context,
+                 executemany):
+    """Keep the time the query started."""
+    if context is not None:
+        context.metrics_started = time.monotonic()
+
+
+def _record_query(connection, cursor, statement, parameters, context,
+                  executemany):
+    """Record the duration of the query, by SQL operation."""
+    started = getattr(context, 'metrics_started', None)
+    if started is not None:
+        operation = statement.split(None, 1)[0].upper() if statement else ''
+        if operation not in _OPERATIONS:
+            operation = 'OTHER'
+        query_duration.observe(time.monotonic() - started, (operation,))
+
+
+def _merge(totals, values):
+    """Add values to totals, in place.
+
+    Args:
+        totals (dict): Values to add to.
+        values (dict): Values of a thread.
+    """
+    for key, value in list(values.items()):
+        if isinstance(value, list):
+            total = totals.get(key)
+            if total is None:
+                totals[key] = list(value)
+            else:
+                totals[key] = [a + b for a, b in zip(total, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _header(name, metric_type, help_text):
+    """Get the HELP and TYPE lines of a metric."""
+    return [
+        '# HELP {} {}'.format(name, help_text),
+        '# TYPE {} {}'.format(name, metric_type)]
+
+
+def _sample(name, labels, value):
+    """Get the line of a sample.
+
+    Args:
+        name (str): Name of the sample.
+        labels (iterable): (name, value) tuples, or a dict.
+        value (float): Value of the sample.
+
+    Returns:
+        str: The line.
+    """
+    if isinstance(labels, dict):
+        labels = sorted(labels.items())
+    labels = ','.join(
+        '{}="{}"'.format(label, _escape(str(label_value)))
+        for label, label_value in labels)
+    if labels:
+        return '{}{{{}}} {}'.format(name, labels, _format(value))
+    return '{} {}'.format(name, _format(value))
+
+
+def _escape(value):
+    """Escape a label value."""
+    return value.replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def _format(value):
+    """Format a number, integers without a decimal part."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
@@ -1,15 +1,32 @@
 """Product Live Time Model CRUD operation."""
 
+from collections import abc
+import datetime
+import functools
+import heapq
+import itertools
+import json
+
 from oto import response
+from oto import status
+from sqlalchemy import and_
+from sqlalchemy import bindparam
 from sqlalchemy import Column
 from sqlalchemy import Enum
+from sqlalchemy import exc
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import or_
+from sqlalchemy import select
 from sqlalchemy import Time
 
 from timed_release import config
+from timed_release import tracing
+from timed_release.connectors import cache
 from timed_release.connectors import sql
 from timed_release.constants import error
 from timed_release.constants import success
+from timed_release.validation import engine
 from timed_release.validation import validators
 
 
@@ -17,6 +34,12 @@ class ProductLiveTime(sql.base_model):
     """Table definition for product_live_time table."""
 
     __tablename__ = 'product_live_time'
+    __table_args__ = (
+        Index('ix_product_live_time_time_of_day_product',
+              'time_of_day_product'),
+        Index('ix_product_live_time_store_id_time_of_day_product_id',
+              'store_id', 'time_of_day_product', 'product_id'),
+    )
 
     product_id = Column(
         'product_id', Integer, primary_key=True, nullable=False)
@@ -34,6 +57,146 @@ class ProductLiveTime(sql.base_model):
         }
 
 
+class ProductLiveTimeRecord(abc.Mapping):
+    """Read-only product live time, read without the ORM.
+
+    Records are built from plain column rows, without the identity map and
+    the attribute instrumentation of `ProductLiveTime` instances. They read
+    like product live time dicts (`record['time_zone']`, `dict(record)`).
+    Records must not be modified: cached records are shared by all readers,
+    and their JSON is encoded once.
+    """
+
+    __slots__ = (
+        'product_id', 'time_of_day_product', 'time_zone', 'store_id',
+        '_json')
+
+    FIELDS = ('product_id', 'time_of_day_product', 'time_zone', 'store_id')
+
+    def __init__(self, product_id, time_of_day_product, time_zone, store_id):
+        """Create a record.
+
+        Args:
+            product_id (int): Product id.
+            time_of_day_product (str): Time to product go live, HH:MM:SS.
+            time_zone (str): Time Zone to product go live.
+            store_id (int): Store of the product, or None.
+        """
+        self.product_id = product_id
+        self.time_of_day_product = time_of_day_product
+        self.time_zone = time_zone
+        self.store_id = store_id
+        self._json = None
+
+    @classmethod
+    def from_row(cls, row):
+        """Create a record from a row of `FIELDS` columns."""
+        product_id, time_of_day_product, time_zone, store_id = row
+        return cls(
+            product_id, _format_time(time_of_day_product), time_zone,
+            store_id)
+
+    def __getitem__(self, field):
+        """Get the value of a field, like a product live time dict."""
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __iter__(self):
+        """Iterate over the fields."""
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        """Return the number of fields."""
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        """Represent the record like its dict."""
+        return '{}({!r})'.format(type(self).__name__, self.to_dict())
+
+    def to_dict(self):
+        """Return a dictionary of a product_live_time."""
+        return {
+            'product_id': self.product_id,
+            'time_of_day_product': self.time_of_day_product,
+            'time_zone': self.time_zone,
+            'store_id': self.store_id
+        }
+
+    def to_json(self):
+        """Return the JSON object of the record, encoded once."""
+        if self._json is None:
+            time_zone = _JSON_TIME_ZONES.get(self.time_zone)
+            self._json = (
+                '{{"product_id": {}, "time_of_day_product": "{}", '
+                '"time_zone": {}, "store_id": {}}}'.format(
+                    self.product_id, self.time_of_day_product,
+                    time_zone or json.dumps(self.time_zone),
+                    'null' if self.store_id is None else self.store_id))
+        return self._json
+
+
+# Columns read by the lightweight read path, in ProductLiveTimeRecord order
+_record_columns = [
+    ProductLiveTime.__table__.c[field]
+    for field in ProductLiveTimeRecord.FIELDS]
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Statements built once, with bound parameters, so that they are compiled
+# once per process by `sql.execute`. Statements depending on the shape of a
+# call are built by the `_*_statement` functions, cached by shape.
+_table = ProductLiveTime.__table__
+_select_product = select(_record_columns).where(
+    _table.c.product_id == bindparam('product_id'))
+_insert_product = _table.insert()
+_upsert_product = sql.Upsert(
+    _table, ['product_id'], ['time_of_day_product', 'time_zone', 'store_id'])
+_delete_product = _table.delete().where(
+    _table.c.product_id == bindparam('product_id'))
+_update_product = _table.update().where(
+    _table.c.product_id == bindparam('where_product_id'))
+_select_rows_page = select(_record_columns).where(
+    _table.c.product_id > bindparam('after_product_id')).order_by(
+        _table.c.product_id).limit(bindparam('limit', type_=Integer))
+
+# JSON strings of the time zones, and HH:MM:SS strings of the times read
+_JSON_TIME_ZONES = {
+    time_zone: json.dumps(time_zone) for time_zone in config.TIME_ZONES}
+_time_strings = {}
+
+# Read-through cache of the product live time records, keyed by product id.
+# Product ids that do not exist are cached as None.
+product_cache = cache.LRUCache(
+    config.PRODUCT_CACHE_MAX_SIZE, config.PRODUCT_CACHE_TTL_SECONDS)
+
+# Functions called with the list of product ids changed by this process.
+_change_listeners = []
+
+
+def add_change_listener(listener):
+    """Register a function to call when products are written.
+
+    Listeners are called once the changes are committed, with the list of
+    product ids (int) that were created, updated or deleted. Only the writes
+    made by this process are notified.
+
+    Args:
+        listener (func): Function to call with the changed product ids.
+    """
+    _change_listeners.append(listener)
+
+
+def remove_change_listener(listener):
+    """Unregister a function registered with `add_change_listener`.
+
+    Args:
+        listener (func): Function to unregister.
+    """
+    _change_listeners.remove(listener)
+
+
+@tracing.traced('model')
 @sql.wrap_db_errors
 def create_product_live_time_details(
         product_id, time_of_day_product, time_zone, store_id=None):
@@ -46,6 +209,98 @@ def create_product_live_time_details(
         store_id (int): Unique identification for DMS.
     Returns:
         response.Response: Response dict of inserted product live time
+        details or error, with a conflict status if the product id already
+        exists and a bad request status if the database refuses the values.
+    """
+    timed_release_data = {
+        'product_id': product_id,
+        'time_of_day_product': time_of_day_product,
+        'time_zone': time_zone,
+        'store_id': store_id
+    }
+
+    validation_error = validators.validate_timed_release_dataset(
+        timed_release_data, validators.TIMED_RELEASE_REQUIRED_FIELDS)
+
+    if validation_error:
+        return response.create_error_response(
+            code=error.ERROR_CODE_BAD_REQUEST, message=validation_error)
+
+    shard = sql.shard_map.get(product_id)
+    mapping = _to_mapping(timed_release_data)
+    try:
+        with sql.db_session(shard) as session:
+            sql.execute(session, _insert_product, mapping)
+    except exc.IntegrityError as integrity_error:
+        if not _product_exists(shard, mapping['product_id']):
+            return response.create_error_response(
+                code=error.ERROR_CODE_BAD_REQUEST,
+                message=[{'invalid data': str(integrity_error.orig)}])
+        return response.create_error_response(
+            code=error.ERROR_CODE_CONFLICT,
+            message=error.ERROR_MESSAGE_PRODUCT_ALREADY_EXISTS.format(
+                product_id),
+            status=status.CONFLICT)
+
+    _publish_changes([product_id])
+    timed_release_insert_response = {'product': timed_release_data}
+    return response.Response(message=timed_release_insert_response)
+
+
+@tracing.traced('model')
+@sql.wrap_db_errors
+def create_product_live_time_details_bulk(timed_release_records):
+    """Create product live time details for a list of validated records.
+
+    Records are grouped by shard, and inserted with one executemany per
+    chunk of `config.BULK_INSERT_CHUNK_SIZE` records, each in its own
+    transaction. When a chunk is rejected by the database, its records are
+    inserted one by one so that only the offending records fail.
+
+    Args:
+        timed_release_records (list): Validated timed release dicts.
+
+    Returns:
+        response.Response: Response containing, for each record, None if it
+        was inserted or the list of errors otherwise.
+    """
+    record_errors = [None] * len(timed_release_records)
+    mappings = [
+        _to_mapping(timed_release_data)
+        for timed_release_data in timed_release_records]
+    shard_indexes = sql.shard_map.group(
+        range(len(mappings)), key=lambda index: mappings[index]['product_id'])
+
+    for shard, indexes in shard_indexes:
+        for chunk in _chunks(indexes, config.BULK_INSERT_CHUNK_SIZE):
+            try:
+                with sql.db_session(shard, savepoint=True) as session:
+                    sql.execute(
+                        session, _insert_product,
+                        [mappings[index] for index in chunk])
+            except (exc.IntegrityError, exc.DataError):
+                for index in chunk:
+                    record_errors[index] = _insert_single_mapping(
+                        shard, mappings[index])
+            _publish_changes(
+                mappings[index]['product_id'] for index in chunk)
+
+    return response.Response(message=record_errors)
+
+
+@tracing.traced('model')
+@sql.wrap_db_errors
+def upsert_product_live_time_details(
+        product_id, time_of_day_product, time_zone, store_id=None):
+    """Create or replace product live time details in one statement.
+
+    Args:
+        product_id (int): Unique identification for product.
+        time_of_day_product (str): Time to product go live.
+        time_zone (str): Time Zone to product go live.
+        store_id (int): Unique identification for DMS.
+    Returns:
+        response.Response: Response dict of upserted product live time
         details or error.
     """
     timed_release_data = {
@@ -55,21 +310,102 @@ def create_product_live_time_details(
         'store_id': store_id
     }
 
-    required_fields = ['product_id', 'time_of_day_product', 'time_zone']
     validation_error = validators.validate_timed_release_dataset(
-        timed_release_data, required_fields)
+        timed_release_data, validators.TIMED_RELEASE_REQUIRED_FIELDS)
 
     if validation_error:
         return response.create_error_response(
             code=error.ERROR_CODE_BAD_REQUEST, message=validation_error)
 
-    timed_release_data_to_add = ProductLiveTime(**timed_release_data)
-    with sql.db_session() as session:
-        session.add(timed_release_data_to_add)
-        timed_release_insert_response = {'product': timed_release_data}
-        return response.Response(message=timed_release_insert_response)
+    with sql.db_session(sql.shard_map.get(product_id)) as session:
+        sql.execute(
+            session, _upsert_product, [_to_mapping(timed_release_data)])
 
+    _publish_changes([product_id])
+    return response.Response(message={'product': timed_release_data})
 
+
+@tracing.traced('model')
+@sql.wrap_db_errors
+def upsert_product_live_time_details_bulk(timed_release_records):
+    """Create or replace product live time details for validated records.
+
+    Records are grouped by shard, and each chunk of
+    `config.BULK_INSERT_CHUNK_SIZE` records is written with a single upsert
+    statement in its own transaction.
+
+    Args:
+        timed_release_records (list): Validated timed release dicts.
+
+    Returns:
+        response.Response: Response containing, for each record, None as
+        upserts do not fail on existing product ids.
+    """
+    mappings = [
+        _to_mapping(timed_release_data)
+        for timed_release_data in timed_release_records]
+
+    shard_mappings = sql.shard_map.group(
+        mappings, key=lambda mapping: mapping['product_id'])
+    for shard, mappings_of_shard in shard_mappings:
+        for chunk in _chunks(
+                mappings_of_shard, config.BULK_INSERT_CHUNK_SIZE):
+            with sql.db_session(shard) as session:
+                sql.execute(session, _upsert_product, chunk)
+            _publish_changes(mapping['product_id'] for mapping in chunk)
+
+    return response.Response(message=[None] * len(mappings))
+
+
+@tracing.traced('model')
+@sql.wrap_db_errors
+def import_product_live_time_details(timed_release_records):
+    """Create or replace validated records in one transaction per shard.
+
+    The ids that already exist are read first, within the same transaction,
+    to count how many records are inserted and how many are updated. The
+    transactions are committed before returning, even within a request, so
+    that imports can be resumed from the last batch written.
+
+    Args:
+        timed_release_records (list): Validated timed release dicts.
+
+    Returns:
+        response.Response: Response containing the number of `inserted` and
+        `updated` records.
+    """
+    mappings = [
+        _to_mapping(timed_release_data)
+        for timed_release_data in timed_release_records]
+    product_ids = [mapping['product_id'] for mapping in mappings]
+
+    existing_product_ids = set()
+    shard_mappings = sql.shard_map.group(
+        mappings, key=lambda mapping: mapping['product_id'])
+    for shard, mappings_of_shard in shard_mappings:
+        with sql.db_session(shard, request_scoped=False) as session:
+            for chunk in _chunks(
+                    [mapping['product_id'] for mapping in mappings_of_shard],
+                    config.BATCH_QUERY_CHUNK_SIZE):
+                size, parameters = _product_ids_parameters(chunk)
+                existing_product_ids.update(
+                    product_id for product_id, in sql.execute(
+                        session, _select_product_ids_statement(size),
+                        parameters))
+            sql.execute(session, _upsert_product, mappings_of_shard)
+
+    _publish_changes(product_ids, committed=True)
+    updated_count = 0
+    for product_id in product_ids:
+        if product_id in existing_product_ids:
+            updated_count += 1
+        existing_product_ids.add(product_id)
+    return response.Response(message={
+        'inserted': len(product_ids) - updated_count,
+        'updated': updated_count})
+
+
+@tracing.traced('model')
 @sql.wrap_db_errors
 def get_product_live_time_details(product_id):
     """Get all information of product live time for given product id.
@@ -77,19 +413,292 @@ def get_product_live_time_details(product_id):
     Args:
         product_id (int): Product id to fetch Spotify product live time.
 
+    The product is read from `product_cache` first, unless the request is
+    pinned to the primary, and cached once read from the database.
+
     Return:
-        response: message containing data upon successful query.
-            error Response message otherwise.
+        response: message containing the ProductLiveTimeRecord upon
+            successful query. error Response message otherwise.
     """
-    with sql.db_session() as session:
-        product_live_time = session.query(ProductLiveTime).get(product_id)
-        if not product_live_time:
-            return response.create_not_found_response(
-                error.ERROR_MESSAGE_PRODUCT_NOT_FOUND.format(product_id))
+    product = _get_cached_product(int(product_id))
+    if product is cache.MISSING:
+        token = product_cache.read_token()
+        with sql.db_read_connection(
+                sql.shard_map.get(product_id)) as connection:
+            row = sql.execute(
+                connection, _select_product,
+                {'product_id': int(product_id)}).first()
+        product = row and ProductLiveTimeRecord.from_row(row)
+        _cache_product(int(product_id), product, token)
+
+    if not product:
+        return response.create_not_found_response(
+            error.ERROR_MESSAGE_PRODUCT_NOT_FOUND.format(product_id))
 
-        return response.Response(message=product_live_time.to_dict())
+    return response.Response(message=product)
 
 
+@tracing.traced('model')
+@sql.wrap_db_errors
+def get_product_live_time_details_batch(product_ids):
+    """Get product live time details for a list of product ids.
+
+    The ids found in `product_cache` are not queried, unless the request is
+    pinned to the primary. All the other ids are fetched from their shards
+    in parallel, using one `IN (...)` query per chunk of
+    `config.BATCH_QUERY_CHUNK_SIZE` ids.
+
+    Args:
+        product_ids (list): Unique product ids (int) to fetch.
+
+    Return:
+        response.Response: message containing the found products
+        (ProductLiveTimeRecord) keyed by product id and the list of missing
+        product ids.
+    """
+    products = {}
+    uncached_product_ids = []
+    for product_id in product_ids:
+        product = _get_cached_product(product_id)
+        if product is cache.MISSING:
+            uncached_product_ids.append(product_id)
+        elif product:
+            products[product_id] = product
+
+    if uncached_product_ids:
+        token = product_cache.read_token()
+        shard_product_ids = sql.shard_map.group(uncached_product_ids)
+        product_ids_of_shards = dict(shard_product_ids)
+
+        def read_shard(shard, connection):
+            """Read the records of the ids of a shard."""
+            records = []
+            for chunk in _chunks(
+                    product_ids_of_shards[shard],
+                    config.BATCH_QUERY_CHUNK_SIZE):
+                size, parameters = _product_ids_parameters(chunk)
+                rows = sql.execute(
+                    connection, _select_products_statement(size), parameters)
+                records.extend(
+                    ProductLiveTimeRecord.from_row(row) for row in rows)
+            return records
+
+        fetched_products = {}
+        for records in sql.scatter(
+                read_shard, [shard for shard, _ in shard_product_ids]):
+            for product in records:
+                fetched_products[product.product_id] = product
+
+        for product_id in uncached_product_ids:
+            _cache_product(
+                product_id, fetched_products.get(product_id), token)
+        products.update(fetched_products)
+
+    missing_product_ids = [
+        product_id for product_id in product_ids
+        if product_id not in products]
+    return response.Response(message={
+        'products': {
+            str(product_id): product for product_id, product in
+            products.items()},
+        'missing': missing_product_ids})
+
+
+@tracing.traced('model')
+@sql.wrap_db_errors
+def get_products_going_live(start_time, end_time, store_id=None):
+    """Get the products going live within a time of day window.
+
+    Bounds are included. When the start is after the end, the window wraps
+    past midnight and is queried as two ranges, so that each of them is an
+    index range scan. Products are ordered by time of day from the start of
+    the window, then by product id. Shards are queried in parallel and their
+    products merged in that order.
+
+    Args:
+        start_time (str|datetime.time): Start of the window, HH:MM:SS.
+        end_time (str|datetime.time): End of the window, HH:MM:SS.
+        store_id (int): Only get the products of this store.
+
+    Return:
+        response.Response: message containing the products going live, at
+        most `config.WINDOW_MAX_RESULTS`, and whether the list is truncated.
+    """
+    start_time = _to_time(start_time)
+    end_time = _to_time(end_time)
+    ranges = [(start_time, end_time)]
+    if start_time > end_time:
+        ranges = [
+            (start_time, datetime.time.max), (datetime.time.min, end_time)]
+
+    limit = config.WINDOW_MAX_RESULTS + 1
+    statement = _going_live_statement(store_id is not None)
+
+    def read_shard(shard, connection):
+        """Read the products of a shard, with their rank in the window."""
+        ranked_products = []
+        for position, (range_start, range_end) in enumerate(ranges):
+            rows = sql.execute(connection, statement, {
+                'start_time': range_start, 'end_time': range_end,
+                'store_id': store_id, 'limit': limit - len(ranked_products)})
+            ranked_products.extend(
+                (position, row[1], row[0],
+                 ProductLiveTimeRecord.from_row(row).to_dict())
+                for row in rows)
+            if len(ranked_products) == limit:
+                break
+        return ranked_products
+
+    products = [
+        product for _, _, _, product in itertools.islice(
+            heapq.merge(*sql.scatter(read_shard)), limit)]
+
+    return response.Response(message={
+        'products': products[:config.WINDOW_MAX_RESULTS],
+        'truncated': len(products) > config.WINDOW_MAX_RESULTS})
+
+
+@tracing.traced('model')
+@sql.wrap_db_errors
+def get_store_products(store_id, limit, after=None):
+    """Get a page of the products of a store, ordered by time of day.
+
+    Pages are read with keyset pagination: the next page starts after the
+    (time of day, product id) of the last product of the previous one. Every
+    page is a range scan of the (store_id, time_of_day_product, product_id)
+    index, so deep pages cost the same as the first one. Shards are queried
+    in parallel and their pages merged.
+
+    Args:
+        store_id (int): Store of the products.
+        limit (int): Maximum number of products of the page.
+        after (tuple): Time of day (str|datetime.time) and product id (int) of
+            the last product of the previous page, None for the first page.
+
+    Return:
+        response.Response: message containing the products of the page, and
+        whether there are more products after them.
+    """
+    parameters = {'store_id': store_id, 'limit': limit + 1}
+    if after is not None:
+        parameters['after_time'] = _to_time(after[0])
+        parameters['after_product_id'] = after[1]
+
+    statement = _store_page_statement(after is not None)
+
+    def read_shard(shard, connection):
+        """Read the page of a shard, with the sort key of its products."""
+        return [
+            (row[1], row[0], ProductLiveTimeRecord.from_row(row).to_dict())
+            for row in sql.execute(connection, statement, parameters)]
+
+    products = [
+        product for _, _, product in itertools.islice(
+            heapq.merge(*sql.scatter(read_shard)), limit + 1)]
+
+    return response.Response(message={
+        'products': products[:limit],
+        'has_more': len(products) > limit})
+
+
+def iter_product_live_times(store_id=None, time_zone=None):
+    """Iterate over all the product live times, ordered by product id.
+
+    Rows are streamed from each shard `config.EXPORT_BATCH_SIZE` at a time
+    so that memory does not depend on the size of the table, and the streams
+    of the shards are merged by product id. Database errors are raised while
+    iterating.
+
+    Args:
+        store_id (int): Only yield the products of this store.
+        time_zone (str): Only yield the products with this time zone.
+
+    Yields:
+        dict: The next product live time dict.
+    """
+    statement = _iter_statement(store_id is not None, time_zone is not None)
+    parameters = {'store_id': store_id, 'time_zone': time_zone}
+    if len(sql.shard_map.shards) == 1:
+        for _, product in _iter_shard(
+                sql.shard_map.shards[0], statement, parameters):
+            yield product
+        return
+
+    for _, product in heapq.merge(*[
+            _iter_shard(shard, statement, parameters)
+            for shard in sql.shard_map.shards]):
+        yield product
+
+
+def _iter_shard(shard, statement, parameters):
+    """Stream the products of a shard, ordered by product id.
+
+    Args:
+        shard (sql.Shard): Shard to read.
+        statement (Select): Statement ordered by product id.
+        parameters (dict): Parameters of the statement.
+
+    Yields:
+        tuple: Product id (int) and product live time dict.
+    """
+    with sql.db_read_connection(shard) as connection:
+        rows = sql.execute(
+            connection, statement, parameters, stream_results=True)
+        while True:
+            batch = rows.fetchmany(config.EXPORT_BATCH_SIZE)
+            if not batch:
+                break
+            for row in batch:
+                yield row[0], ProductLiveTimeRecord.from_row(row).to_dict()
+
+
+def iter_shard_rows(shard, batch_size):
+    """Read all the rows of a shard, in batches ordered by product id.
+
+    Each batch is read in its own query, starting after the last product id
+    of the previous batch, so rows can be moved while iterating.
+
+    Args:
+        shard (sql.Shard): Shard to read, on its primary.
+        batch_size (int): Maximum number of rows per batch.
+
+    Yields:
+        list: The next batch of product live time column values (dict).
+    """
+    after_product_id = 0
+    while True:
+        with sql.db_session(shard, request_scoped=False) as session:
+            rows = sql.execute(session, _select_rows_page, {
+                'after_product_id': after_product_id,
+                'limit': batch_size}).fetchall()
+        if not rows:
+            return
+        yield [dict(zip(ProductLiveTimeRecord.FIELDS, row)) for row in rows]
+        after_product_id = rows[-1][0]
+
+
+def move_rows(mappings, source, target):
+    """Move product live time rows from one shard to another.
+
+    Rows are upserted in the target before being deleted from the source,
+    so that an interrupted move can be run again.
+
+    Args:
+        mappings (list): Product live time column values.
+        source (sql.Shard): Shard the rows are read from.
+        target (sql.Shard): Shard the rows belong to.
+    """
+    with sql.db_session(target, request_scoped=False) as session:
+        sql.execute(session, _upsert_product, mappings)
+
+    product_ids = [mapping['product_id'] for mapping in mappings]
+    with sql.db_session(source, request_scoped=False) as session:
+        for chunk in _chunks(product_ids, config.BATCH_QUERY_CHUNK_SIZE):
+            size, parameters = _product_ids_parameters(chunk)
+            sql.execute(session, _delete_products_statement(size), parameters)
+
+
+@tracing.traced('model')
 @sql.wrap_db_errors
 def delete_product_live_time_details(product_id):
     """Delete product live time details by product id.
@@ -101,18 +710,20 @@ def delete_product_live_time_details(product_id):
         response.Response: Response containing delete success message or error
         response message.
     """
-    with sql.db_session() as session:
-        affected_row_count = session.query(ProductLiveTime).filter(
-            ProductLiveTime.product_id == product_id).delete()
+    with sql.db_session(sql.shard_map.get(product_id)) as session:
+        affected_row_count = sql.execute(
+            session, _delete_product, {'product_id': product_id}).rowcount
 
-        if not affected_row_count:
-            return response.create_not_found_response(
-                error.ERROR_MESSAGE_PRODUCT_NOT_FOUND.format(product_id))
+    if not affected_row_count:
+        return response.create_not_found_response(
+            error.ERROR_MESSAGE_PRODUCT_NOT_FOUND.format(product_id))
 
-        return response.Response(
-            message=success.DELETE_SUCCESS_MESSAGE_TIMED_RELEASE)
+    _publish_changes([product_id])
+    return response.Response(
+        message=success.DELETE_SUCCESS_MESSAGE_TIMED_RELEASE)
 
 
+@tracing.traced('model')
 @sql.wrap_db_errors
 def update_product_live_time_details(product_id, data):
     """Update information of product live time for given product id.
@@ -125,13 +736,336 @@ def update_product_live_time_details(product_id, data):
         response.Response: Response message upon successful update.
         error Response message otherwise.
     """
-    with sql.db_session() as session:
-        affected_row_count = session.query(ProductLiveTime).filter(
-            ProductLiveTime.product_id == product_id).update(data)
+    with sql.db_session(sql.shard_map.get(product_id)) as session:
+        affected_row_count = sql.execute(
+            session, _update_product,
+            dict(data, where_product_id=product_id)).rowcount
+
+    if not affected_row_count:
+        return response.create_not_found_response(
+            error.ERROR_MESSAGE_PRODUCT_NOT_FOUND.format(product_id))
+
+    _publish_changes([product_id])
+    return response.Response(
+        message=success.UPDATE_SUCCESS_MESSAGE.format(product_id))
+
+
+def _chunks(items, size):
+    """Split a list into consecutive chunks.
+
+    Args:
+        items (list): Items to split.
+        size (int): Maximum size of each chunk.
+
+    Yields:
+        list: The next chunk of items.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _get_cached_product(product_id):
+    """Get a product from `product_cache`.
+
+    Requests pinned to the primary must see the recent writes of the
+    client, which another process may have made, so they do not use the
+    cache.
+
+    Args:
+        product_id (int): Product id of the product.
+
+    Returns:
+        ProductLiveTimeRecord: The cached product, None if it does not exist,
+        or `cache.MISSING` if it must be read from the database.
+    """
+    if sql.is_request_pinned():
+        return cache.MISSING
+    return product_cache.get(product_id)
+
+
+def _cache_product(product_id, product, token):
+    """Cache a product read from the database.
+
+    Products read by a request after it wrote are not cached, as the request
+    may still roll back.
+
+    Args:
+        product_id (int): Product id of the product.
+        product (ProductLiveTimeRecord): Product live time record, None if
+            it does not exist.
+        token (int): Cache token taken before reading the product.
+    """
+    if sql.has_uncommitted_writes():
+        return
+    ttl = None if product else config.PRODUCT_CACHE_NOT_FOUND_TTL_SECONDS
+    product_cache.set(product_id, product, ttl=ttl, token=token)
+
+
+def _format_time(time_value):
+    """Format a time read from the database as HH:MM:SS.
+
+    The strings are memoized by time, there are at most 86400 of them.
+
+    Args:
+        time_value (datetime.time): Time to format.
+
+    Returns:
+        str: The formatted time, like `str(time_value)`.
+    """
+    time_string = _time_strings.get(time_value)
+    if time_string is None:
+        time_string = '{:02d}:{:02d}:{:02d}'.format(
+            time_value.hour, time_value.minute, time_value.second)
+        if time_value.microsecond:
+            time_string += '.{:06d}'.format(time_value.microsecond)
+        elif len(_time_strings) < SECONDS_PER_DAY:
+            _time_strings[time_value] = time_string
+    return time_string
+
+
+def _publish_changes(product_ids, committed=False):
+    """Notify that products changed, once their changes are committed.
+
+    The products are removed from the cache right away, and again once the
+    changes are committed, in case another reader cached the previous
+    values meanwhile. The change listeners are called after the commit.
+
+    Args:
+        product_ids (iterable): Product ids (int or str) that changed.
+        committed (bool): The changes are already committed, even within a
+            request.
+    """
+    product_ids = [int(product_id) for product_id in product_ids]
+    product_cache.invalidate(product_ids)
+    if committed:
+        _notify_changes(product_ids)
+    else:
+        sql.after_commit(functools.partial(_notify_changes, product_ids))
+
+
+def _notify_changes(product_ids):
+    """Invalidate the cache and call the change listeners on commit.
+
+    Args:
+        product_ids (list): Product ids (int) that changed.
+    """
+    product_cache.invalidate(product_ids)
+    for listener in list(_change_listeners):
+        listener(product_ids)
+
+
+def _insert_single_mapping(shard, mapping):
+    """Insert one product live time mapping in its own transaction.
+
+    Args:
+        shard (sql.Shard): Shard of the product id.
+        mapping (dict): Product live time column values.
+
+    Returns:
+        list: None if the row was inserted, the list of errors otherwise.
+    """
+    try:
+        with sql.db_session(shard, savepoint=True) as session:
+            sql.execute(session, _insert_product, mapping)
+    except exc.IntegrityError as integrity_error:
+        if not _product_exists(shard, mapping['product_id']):
+            return [{'invalid data': str(integrity_error.orig)}]
+        return [{
+            'duplicate product id':
+                error.ERROR_MESSAGE_PRODUCT_ALREADY_EXISTS.format(
+                    mapping['product_id'])}]
+    except exc.DataError as data_error:
+        return [{'invalid data': str(data_error.orig)}]
+    return None
 
-        if not affected_row_count:
-            return response.create_not_found_response(
-                error.ERROR_MESSAGE_PRODUCT_NOT_FOUND.format(product_id))
 
-        return response.Response(
-            message=success.UPDATE_SUCCESS_MESSAGE.format(product_id))
+def _product_exists(shard, product_id):
+    """Check whether a product live time exists, reading the primary.
+
+    Tells the duplicate product ids from the other integrity errors, such as
+    NOT NULL or CHECK violations, without relying on driver error codes.
+
+    Args:
+        shard (sql.Shard): Shard of the product id.
+        product_id (int): Product id to look for.
+
+    Returns:
+        bool: True if the product id exists.
+    """
+    with sql.db_session(shard) as session:
+        return sql.execute(
+            session, _select_product,
+            {'product_id': product_id}).first() is not None
+
+
+def _product_ids_parameters(product_ids):
+    """Bind a chunk of product ids to the parameters of an IN (...) list.
+
+    The list is padded to the next power of two by repeating the last id, so
+    that a handful of IN (...) statements are compiled whatever the number
+    of ids.
+
+    Args:
+        product_ids (list): Product ids (int), at least one.
+
+    Returns:
+        tuple: Size of the IN (...) list (int) and its parameters (dict).
+    """
+    size = 1
+    while size < len(product_ids):
+        size *= 2
+    padded_product_ids = product_ids + [product_ids[-1]] * (
+        size - len(product_ids))
+    return size, {
+        'product_id_{}'.format(position): product_id
+        for position, product_id in enumerate(padded_product_ids)}
+
+
+def _product_ids_clause(size):
+    """Create the product_id IN (...) clause of `_product_ids_parameters`."""
+    return _table.c.product_id.in_([
+        bindparam('product_id_{}'.format(position))
+        for position in range(size)])
+
+
+@functools.lru_cache(maxsize=None)
+def _select_products_statement(size):
+    """Create the statement reading the records of a chunk of product ids.
+
+    Args:
+        size (int): Size of the IN (...) list.
+
+    Returns:
+        Select: Statement selecting the record columns.
+    """
+    return select(_record_columns).where(_product_ids_clause(size))
+
+
+@functools.lru_cache(maxsize=None)
+def _select_product_ids_statement(size):
+    """Create the statement reading which ids of a chunk exist.
+
+    Args:
+        size (int): Size of the IN (...) list.
+
+    Returns:
+        Select: Statement selecting the product ids.
+    """
+    return select([_table.c.product_id]).where(_product_ids_clause(size))
+
+
+@functools.lru_cache(maxsize=None)
+def _delete_products_statement(size):
+    """Create the statement deleting a chunk of product ids.
+
+    Args:
+        size (int): Size of the IN (...) list.
+
+    Returns:
+        Delete: Statement deleting the products.
+    """
+    return _table.delete().where(_product_ids_clause(size))
+
+
+@functools.lru_cache(maxsize=None)
+def _going_live_statement(by_store):
+    """Create the statement reading a range of times of the day.
+
+    Args:
+        by_store (bool): Only read the products of the `store_id` parameter.
+
+    Returns:
+        Select: Statement with the `start_time`, `end_time` and `limit`
+        parameters.
+    """
+    statement = select(_record_columns).where(
+        _table.c.time_of_day_product.between(
+            bindparam('start_time'), bindparam('end_time')))
+    if by_store:
+        statement = statement.where(
+            _table.c.store_id == bindparam('store_id'))
+    return statement.order_by(
+        _table.c.time_of_day_product, _table.c.product_id).limit(
+            bindparam('limit', type_=Integer))
+
+
+@functools.lru_cache(maxsize=None)
+def _store_page_statement(after):
+    """Create the statement reading a page of the products of a store.
+
+    Args:
+        after (bool): Start after the `after_time` and `after_product_id`
+            parameters, instead of at the first product.
+
+    Returns:
+        Select: Statement with the `store_id` and `limit` parameters.
+    """
+    statement = select(_record_columns).where(
+        _table.c.store_id == bindparam('store_id'))
+    if after:
+        after_time = bindparam('after_time', type_=Time)
+        statement = statement.where(or_(
+            _table.c.time_of_day_product > after_time,
+            and_(_table.c.time_of_day_product == after_time,
+                 _table.c.product_id > bindparam('after_product_id'))))
+    return statement.order_by(
+        _table.c.time_of_day_product, _table.c.product_id).limit(
+            bindparam('limit', type_=Integer))
+
+
+@functools.lru_cache(maxsize=None)
+def _iter_statement(by_store, by_time_zone):
+    """Create the statement reading all the products, by product id.
+
+    Args:
+        by_store (bool): Only read the products of the `store_id` parameter.
+        by_time_zone (bool): Only read the products of the `time_zone`
+            parameter.
+
+    Returns:
+        Select: Statement selecting the record columns.
+    """
+    statement = select(_record_columns).order_by(_table.c.product_id)
+    if by_store:
+        statement = statement.where(
+            _table.c.store_id == bindparam('store_id'))
+    if by_time_zone:
+        statement = statement.where(
+            _table.c.time_zone == bindparam('time_zone'))
+    return statement
+
+
+def _to_mapping(timed_release_data):
+    """Convert validated timed release data into column values.
+
+    Args:
+        timed_release_data (dict): Validated timed release data.
+
+    Returns:
+        dict: Product live time column values.
+    """
+    return {
+        'product_id': timed_release_data['product_id'],
+        'time_of_day_product': _to_time(
+            timed_release_data['time_of_day_product']),
+        'time_zone': timed_release_data['time_zone'],
+        'store_id': timed_release_data.get('store_id')
+    }
+
+
+def _to_time(time_value):
+    """Convert a HH:MM:SS string into a time.
+
+    Args:
+        time_value (str|datetime.time): Time to convert.
+
+    Returns:
+        datetime.time: The time of the day.
+    """
+    if isinstance(time_value, datetime.time):
+        return time_value
+    second_of_day = engine.parse_time(time_value)
+    if second_of_day is None:
+        raise ValueError('Invalid time of the day {!r}'.format(time_value))
+    return datetime.time(
+        second_of_day // 3600, second_of_day // 60 % 60, second_of_day % 60)
@@ -0,0 +1,333 @@
+"""In-memory Time of Day Index.
+
+Mirror of the product_live_time table sorted by time of day, answering going
+live window queries with two binary searches instead of a database query.
+
+Every entry is packed in one 64 bits integer, `second_of_day << 46 |
+product_id`, and kept in a sorted `array`, so that the index of a million
+products takes a few megabytes. Products whose id does not fit in
+`PRODUCT_ID_BITS` are not indexed, and logged. The index is kept up to date
+with the writes of this process through the model change listeners, and
+rebuilt in the background every `config.WINDOW_INDEX_RELOAD_SECONDS` to pick
+up the writes of the other processes. Readers keep using the last index
+built until the new one is swapped in.
+"""
+
+from array import array
+import bisect
+import logging
+import threading
+import time
+
+from timed_release import config
+from timed_release.models import product_live_time
+from timed_release.validation import engine
+
+
+logger = logging.getLogger(__name__)
+
+
+# Keys are signed 64 bits integers, and seconds of the day take 17 bits.
+PRODUCT_ID_BITS = 46
+MAX_PRODUCT_ID = (1 << PRODUCT_ID_BITS) - 1
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class TimeOfDayIndex:
+    """Sorted index of product ids by time of day, overall and per store."""
+
+    def __init__(self):
+        """Create an empty index."""
+        self._keys = array('q')
+        self._store_keys = {}
+        self._products = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of products in the index."""
+        return len(self._products)
+
+    def load(self, products):
+        """Replace the content of the index.
+
+        Args:
+            products (iterable): Product live time dicts.
+        """
+        indexed_products = {}
+        store_keys = {}
+        for product in products:
+            if not _fits(product['product_id']):
+                continue
+            second_of_day = engine.parse_time(product['time_of_day_product'])
+            store_id = product['store_id']
+            indexed_products[product['product_id']] = (
+                second_of_day, store_id)
+            if store_id is not None:
+                store_keys.setdefault(store_id, []).append(
+                    _pack(second_of_day, product['product_id']))
+
+        keys = array('q', sorted(
+            _pack(second_of_day, product_id)
+            for product_id, (second_of_day, _) in indexed_products.items()))
+        store_keys = {
+            store_id: array('q', sorted(keys_of_store))
+            for store_id, keys_of_store in store_keys.items()}
+
+        with self._lock:
+            self._keys = keys
+            self._store_keys = store_keys
+            self._products = indexed_products
+
+    def update(self, product):
+        """Add a product to the index, or move it if already indexed.
+
+        Args:
+            product (dict): Product live time dict.
+        """
+        product_id = product['product_id']
+        if not _fits(product_id):
+            return
+        second_of_day = engine.parse_time(product['time_of_day_product'])
+        key = _pack(second_of_day, product_id)
+        with self._lock:
+            self._remove(product_id)
+            self._products[product_id] = (second_of_day, product['store_id'])
+            bisect.insort(self._keys, key)
+            if product['store_id'] is not None:
+                bisect.insort(
+                    self._store_keys.setdefault(
+                        product['store_id'], array('q')), key)
+
+    def remove(self, product_id):
+        """Remove a product from the index, if indexed.
+
+        Args:
+            product_id (int): Product id to remove.
+        """
+        with self._lock:
+            self._remove(product_id)
+
+    def window(self, start_second, end_second, store_id=None, limit=None):
+        """Get the product ids going live within a time of day window.
+
+        Bounds are included. When the start is after the end, the window
+        wraps past midnight.
+
+        Args:
+            start_second (int): Start of the window, in seconds of the day.
+            end_second (int): End of the window, in seconds of the day.
+            store_id (int): Only get the products of this store.
+            limit (int): Maximum number of product ids to return.
+
+        Returns:
+            list: Product ids ordered by time of day from the start of the
+            window, then by product id.
+        """
+        ranges = [(start_second, end_second)]
+        if start_second > end_second:
+            ranges = [(start_second, SECONDS_PER_DAY - 1), (0, end_second)]
+
+        product_ids = []
+        with self._lock:
+            keys = self._keys
+            if store_id is not None:
+                keys = self._store_keys.get(store_id, array('q'))
+
+            for range_start, range_end in ranges:
+                first = bisect.bisect_left(keys, _pack(range_start, 0))
+                last = bisect.bisect_left(keys, _pack(range_end + 1, 0))
+                if limit is not None:
+                    last = min(last, first + limit - len(product_ids))
+                product_ids.extend(
+                    _unpack_product_id(key) for key in keys[first:last])
+        return product_ids
+
+    def _remove(self, product_id):
+        """Remove a product from the index, the lock being held."""
+        indexed_product = self._products.pop(product_id, None)
+        if indexed_product is None:
+            return
+
+        second_of_day, store_id = indexed_product
+        key = _pack(second_of_day, product_id)
+        _remove_key(self._keys, key)
+        if store_id is not None:
+            _remove_key(self._store_keys[store_id], key)
+
+
+_time_index = None
+_loaded_at = None
+_listening = False
+_generation = 0
+_reload_thread = None
+# Product ids changed while the table is scanned, applied again to the new
+# index once it is swapped in, None when no index is being built.
+_changed_product_ids = None
+# Serializes the first load, which requests wait for.
+_load_lock = threading.Lock()
+# Guards the state above, only held for a few operations.
+_state_lock = threading.Lock()
+
+
+def get_time_index():
+    """Get the index of this process, loading it on first use.
+
+    The first call loads the index and registers it as a change listener of
+    the model. Once the index is older than
+    `config.WINDOW_INDEX_RELOAD_SECONDS`, a single background thread builds a
+    new one from the table and swaps it in.
+
+    Returns:
+        TimeOfDayIndex: The loaded index.
+    """
+    index = _time_index
+    if index is None:
+        with _load_lock:
+            if _time_index is None:
+                _reload()
+            return _time_index
+
+    loaded_at = _loaded_at
+    if loaded_at is not None and \
+            time.monotonic() - loaded_at >= config.WINDOW_INDEX_RELOAD_SECONDS:
+        _start_reload()
+    return index
+
+
+def reset_time_index():
+    """Drop the index of this process, it is loaded again on next use."""
+    global _time_index, _loaded_at, _listening, _generation, \
+        _changed_product_ids
+    with _state_lock:
+        if _listening:
+            product_live_time.remove_change_listener(_refresh)
+        _time_index = None
+        _loaded_at = None
+        _listening = False
+        _generation += 1
+        _changed_product_ids = None
+
+
+def _start_reload():
+    """Build a new index in a background thread, unless one is running."""
+    global _reload_thread
+    with _state_lock:
+        if _reload_thread is not None:
+            return
+        _reload_thread = threading.Thread(
+            target=_reload_in_background, name='time-index-reload',
+            daemon=True)
+        _reload_thread.start()
+
+
+def _reload_in_background():
+    """Build a new index, keeping the last one when the table cannot be read.
+
+    The next reload is tried once `config.WINDOW_INDEX_RELOAD_SECONDS` passed.
+    """
+    global _loaded_at, _reload_thread
+    try:
+        _reload()
+    except Exception:
+        logger.exception('Could not reload the time of day index')
+        with _state_lock:
+            _loaded_at = time.monotonic()
+    finally:
+        with _state_lock:
+            _reload_thread = None
+
+
+def _reload():
+    """Build an index from the table, and swap it in."""
+    global _time_index, _loaded_at, _listening, _changed_product_ids
+    with _state_lock:
+        generation = _generation
+        if not _listening:
+            product_live_time.add_change_listener(_refresh)
+            _listening = True
+        _changed_product_ids = []
+
+    index = TimeOfDayIndex()
+    try:
+        index.load(product_live_time.iter_product_live_times())
+    except Exception:
+        with _state_lock:
+            if generation == _generation:
+                _changed_product_ids = None
+        raise
+
+    with _state_lock:
+        if generation != _generation:
+            return
+        _time_index = index
+        _loaded_at = time.monotonic()
+        changed_product_ids = _changed_product_ids
+        _changed_product_ids = None
+    _apply_changes(index, changed_product_ids)
+
+
+def _refresh(product_ids):
+    """Apply changed products to the index, and to the one being built.
+
+    Args:
+        product_ids (list): Product ids that changed.
+    """
+    with _state_lock:
+        index = _time_index
+        if _changed_product_ids is not None:
+            _changed_product_ids.extend(product_ids)
+    if index is not None:
+        _apply_changes(index, product_ids)
+
+
+def _apply_changes(index, product_ids):
+    """Read changed products again and apply them to an index.
+
+    Args:
+        index (TimeOfDayIndex): Index to update.
+        product_ids (list): Product ids that changed.
+    """
+    for start in range(0, len(product_ids), config.BATCH_QUERY_CHUNK_SIZE):
+        chunk = product_ids[start:start + config.BATCH_QUERY_CHUNK_SIZE]
+        batch_response = \
+            product_live_time.get_product_live_time_details_batch(chunk)
+        if not batch_response:
+            continue
+
+        for product in batch_response.message['products'].values():
+            index.update(product)
+        for product_id in batch_response.message['missing']:
+            index.remove(product_id)
+
+
+def _fits(product_id):
+    """Check that a product id can be packed, logging the ones that cannot.
+
+    Args:
+        product_id (int): Product id to index.
+
+    Returns:
+        bool: True if the product id fits in `PRODUCT_ID_BITS`.
+    """
+    if 0 <= product_id <= MAX_PRODUCT_ID:
+        return True
+    logger.warning(
+        'Product id %s does not fit in the time of day index', product_id)
+    return False
+
+
+def _pack(second_of_day, product_id):
+    """Pack a second of the day and a product id into an index key."""
+    return second_of_day << PRODUCT_ID_BITS | product_id
+
+
+def _unpack_product_id(key):
+    """Get the product id of an index key."""
+    return key & ((1 << PRODUCT_ID_BITS) - 1)
+
+
+def _remove_key(keys, key):
+    """Remove a key from a sorted array of keys, if present."""
+    position = bisect.bisect_left(keys, key)
+    if position < len(keys) and keys[position] == key:
+        del keys[position]
@@ -0,0 +1,60 @@
+"""Shard Rebalancing.
+
+Moves the product live times to the shards a new shard map assigns them to,
+after shards are added to or removed from `config.RDS_SHARD_URLS`. Every
+shard of the current map is read in batches of product ids, and the rows
+that belong to another shard of the new map are upserted there, then deleted
+from their current shard. A rebalance that is interrupted can be run again.
+
+Shards are named by their position, so the URLs kept in the new list must
+keep their position. Writes should be paused while rows move, as the running
+services keep using the current map until they are restarted with the new
+one.
+
+Usage:
+    moves = rebalance(sql.create_shard_map(new_shard_urls))
+"""
+
+from collections import Counter
+
+from timed_release import config
+from timed_release.connectors import sql
+from timed_release.models import product_live_time
+
+
+def rebalance(target_map, batch_size=None, dry_run=False, progress=None):
+    """Move the product live times to their shards in a new shard map.
+
+    Args:
+        target_map (sql.ShardMap): New shard map.
+        batch_size (int): Rows read and moved at a time, defaults to
+            `config.EXPORT_BATCH_SIZE`.
+        dry_run (bool): Only count the rows to move.
+        progress (func): Called with the summary after each batch.
+
+    Returns:
+        dict: Summary of the rebalance: rows `scanned`, and rows `moved`
+        between each pair of shards, keyed by `source->target`.
+    """
+    if not dry_run:
+        for shard in target_map.shards:
+            sql.base_model.metadata.create_all(shard.engine)
+
+    summary = {'scanned': 0, 'moved': Counter()}
+    for source in sql.shard_map.shards:
+        for rows in product_live_time.iter_shard_rows(
+                source, batch_size or config.EXPORT_BATCH_SIZE):
+            summary['scanned'] += len(rows)
+            for target, moved_rows in target_map.group(
+                    rows, key=lambda row: row['product_id']):
+                if target.name == source.name:
+                    continue
+                if not dry_run:
+                    product_live_time.move_rows(moved_rows, source, target)
+                summary['moved']['{}->{}'.format(
+                    source.name, target.name)] += len(moved_rows)
+            if progress:
+                progress(summary)
+
+    summary['moved'] = dict(summary['moved'])
+    return summary
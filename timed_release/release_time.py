@@ -0,0 +1,223 @@
+"""Release Time Resolution.
+
+Turns the time of day and the time zone of product live times into the
+absolute instants they go live. `GMT` releases happen at the same UTC time
+every day. `local` releases happen at the wall clock time of the store, in
+the time zone configured for it in `config.STORE_TIME_ZONES`, or in
+`config.DEFAULT_LOCAL_TIME_ZONE` for the stores without one.
+
+The UTC time of day of a local release changes with daylight saving time, so
+it is computed for the reference date rather than stored. Next releases of a
+batch of products are computed with NumPy: products are packed into arrays of
+local seconds of the day and time zone codes, and the UTC offsets of each
+time zone are only looked up around the reference time, a few times per zone
+whatever the number of products.
+
+Usage:
+    next_releases = compute_next_releases(products, time.time())
+"""
+
+import calendar
+import datetime
+
+import numpy
+import pytz
+
+from timed_release import config
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Step used to look for UTC offset changes around the reference time. Time
+# zones never change their offset twice within this step.
+OFFSET_SAMPLING_SECONDS = 3 * 60 * 60
+
+_time_zones = {}
+
+
+def resolve_time_zone(time_zone, store_id=None):
+    """Get the time zone a release happens in.
+
+    Args:
+        time_zone (str): `GMT` or `local`.
+        store_id (int): Store of the product, for local releases.
+
+    Returns:
+        datetime.tzinfo: Time zone of the release.
+    """
+    if time_zone == 'GMT':
+        name = 'UTC'
+    else:
+        name = config.STORE_TIME_ZONES.get(
+            store_id, config.DEFAULT_LOCAL_TIME_ZONE)
+
+    tz = _time_zones.get(name)
+    if tz is None:
+        tz = _time_zones[name] = pytz.timezone(name)
+    return tz
+
+
+def compute_next_releases(products, reference):
+    """Compute the next instant each product goes live.
+
+    Local times skipped by a daylight saving time change go live when the
+    clocks go forward, at the same time after the change (02:30 becomes
+    03:30). Local times happening twice go live on their second occurrence.
+
+    Args:
+        products (list): Product live time dicts.
+        reference (float): Reference time, in seconds since the epoch.
+
+    Returns:
+        numpy.ndarray: Next release of each product strictly after the
+        reference, in seconds since the epoch (int64), in the order of the
+        products.
+    """
+    count = len(products)
+    seconds_of_day = numpy.empty(count, dtype=numpy.int32)
+    zone_codes = numpy.empty(count, dtype=numpy.int32)
+    zones = []
+    codes = {}
+    for position, product in enumerate(products):
+        hours, minutes, seconds = str(
+            product['time_of_day_product']).split(':')
+        seconds_of_day[position] = \
+            int(hours) * 3600 + int(minutes) * 60 + int(float(seconds))
+
+        tz = resolve_time_zone(product['time_zone'], product.get('store_id'))
+        code = codes.get(tz)
+        if code is None:
+            code = codes[tz] = len(zones)
+            zones.append(tz)
+        zone_codes[position] = code
+
+    next_releases = numpy.empty(count, dtype=numpy.int64)
+    for code, tz in enumerate(zones):
+        selected = zone_codes == code
+        next_releases[selected] = compute_zone_next_releases(
+            tz, seconds_of_day[selected], reference)
+    return next_releases
+
+
+def compute_zone_next_releases(tz, seconds_of_day, reference):
+    """Compute the next releases of local times of the day in a time zone.
+
+    Releases strictly after the reference are returned, with the daylight
+    saving time rules of `compute_next_releases`.
+
+    Args:
+        tz (datetime.tzinfo): Time zone of the times of the day.
+        seconds_of_day (numpy.ndarray): Local times of the day, in seconds.
+        reference (float): Reference time, in seconds since the epoch.
+
+    Returns:
+        numpy.ndarray: Next releases, in seconds since the epoch.
+    """
+    transitions, offsets = _get_offsets(
+        tz, int(reference) - 2 * SECONDS_PER_DAY,
+        int(reference) + 3 * SECONDS_PER_DAY)
+    transitions = numpy.array(transitions, dtype=numpy.int64)
+    local_date = datetime.datetime.fromtimestamp(reference, tz).date()
+
+    next_releases = None
+    for day_offset in range(3):
+        day = local_date + datetime.timedelta(days=day_offset)
+        wall_times = calendar.timegm(day.timetuple()) + \
+            seconds_of_day.astype(numpy.int64)
+        releases = _to_utc(wall_times, transitions, offsets)
+        if next_releases is None:
+            next_releases = releases
+        else:
+            next_releases = numpy.where(
+                next_releases > reference, next_releases, releases)
+    return next_releases
+
+
+def _to_utc(wall_times, transitions, offsets):
+    """Convert local wall times into UTC instants.
+
+    Every offset is tried, and the latest instant whose offset is the one
+    used is kept. When no offset matches, the wall time is skipped by a
+    transition and the latest instant is kept as well.
+
+    Args:
+        wall_times (numpy.ndarray): Local wall times, in seconds since the
+            epoch as if they were UTC.
+        transitions (numpy.ndarray): UTC instants the offset changes at.
+        offsets (list): UTC offset, in seconds, before the first transition
+            and after each of them.
+
+    Returns:
+        numpy.ndarray: UTC instants, in seconds since the epoch.
+    """
+    if len(offsets) == 1:
+        return wall_times - offsets[0]
+
+    latest_matching = numpy.full(
+        len(wall_times), numpy.iinfo(numpy.int64).min, dtype=numpy.int64)
+    latest = latest_matching.copy()
+    for position, offset in enumerate(offsets):
+        candidates = wall_times - offset
+        matching = numpy.searchsorted(
+            transitions, candidates, side='right') == position
+        latest_matching = numpy.where(
+            matching, numpy.maximum(latest_matching, candidates),
+            latest_matching)
+        latest = numpy.maximum(latest, candidates)
+    return numpy.where(
+        latest_matching == numpy.iinfo(numpy.int64).min, latest,
+        latest_matching)
+
+
+def _get_offsets(tz, start, end):
+    """Get the UTC offsets of a time zone between two instants.
+
+    Args:
+        tz (datetime.tzinfo): Time zone.
+        start (int): First instant, in seconds since the epoch.
+        end (int): Last instant, in seconds since the epoch.
+
+    Returns:
+        tuple: UTC instants the offset changes at (list), and the offsets in
+        seconds before the first change and after each of them (list).
+    """
+    transitions = []
+    offsets = [_utc_offset(tz, start)]
+    previous = start
+    for instant in range(
+            start + OFFSET_SAMPLING_SECONDS, end + OFFSET_SAMPLING_SECONDS,
+            OFFSET_SAMPLING_SECONDS):
+        offset = _utc_offset(tz, instant)
+        if offset != offsets[-1]:
+            transitions.append(_find_transition(
+                tz, previous, instant, offsets[-1]))
+            offsets.append(offset)
+        previous = instant
+    return transitions, offsets
+
+
+def _find_transition(tz, start, end, start_offset):
+    """Find the instant the UTC offset of a time zone changes.
+
+    Args:
+        tz (datetime.tzinfo): Time zone.
+        start (int): Instant before the change.
+        end (int): Instant after the change.
+        start_offset (int): UTC offset at the start, in seconds.
+
+    Returns:
+        int: First instant with the new offset.
+    """
+    while end - start > 1:
+        middle = (start + end) // 2
+        if _utc_offset(tz, middle) == start_offset:
+            start = middle
+        else:
+            end = middle
+    return end
+
+
+def _utc_offset(tz, instant):
+    """Get the UTC offset of a time zone at an instant, in seconds."""
+    return int(datetime.datetime.fromtimestamp(
+        instant, tz).utcoffset().total_seconds())
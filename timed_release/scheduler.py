@@ -0,0 +1,461 @@
+"""Release Scheduler.
+
+Fires an event at the time of day of every product live time, and re-arms it
+for the next day. The scheduler replaces polling the service for products to
+release: it waits until the next release instant and calls the release
+callback with the product id.
+
+Schedules are kept in a heap ordered by their next fire instant. To keep the
+memory low with millions of products, every heap entry is one integer,
+`fire_at << 63 | product_id`, and the schedule of each product is one integer
+as well (see `_pack_schedule`). Products whose id does not fit in
+`PRODUCT_ID_BITS` are not scheduled, and logged. Changed or removed
+products leave stale entries in the heap, which are skipped when popped and
+compacted when they outnumber the live ones.
+
+Release instants are computed by `release_time`, local releases in the time
+zone of the store of the product, so that the scheduler and the next release
+endpoint agree.
+
+Usage:
+    release_scheduler = ReleaseScheduler(release_product)
+    release_scheduler.load(product_live_time.iter_product_live_times())
+    release_scheduler.start()
+
+The clock is injectable, so that tests can move the time by hand and call
+`run_pending`.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+import numpy
+import pytz
+
+from timed_release import config
+from timed_release import release_time
+from timed_release.models import product_live_time
+from timed_release.validation import engine
+
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# Product ids of any positive SQL BIGINT.
+PRODUCT_ID_BITS = 63
+MAX_PRODUCT_ID = (1 << PRODUCT_ID_BITS) - 1
+SECOND_OF_DAY_BITS = 17
+FIRE_AT_BITS = 34
+
+
+class SystemClock:
+    """Clock of the system, in seconds since the epoch."""
+
+    def now(self):
+        """Return the current time."""
+        return time.time()
+
+    def wait(self, condition, timeout):
+        """Wait on a condition for at most `timeout` seconds.
+
+        Args:
+            condition (threading.Condition): Acquired condition to wait on.
+            timeout (float): Maximum time to wait, None to wait forever.
+        """
+        condition.wait(timeout)
+
+
+def next_fire_time(time_zone, second_of_day, now, store_id=None):
+    """Get the next instant a time of the day happens in a time zone.
+
+    `GMT` times happen at the same UTC instant every day. `local` times are
+    in the time zone of the store, resolved by
+    `release_time.resolve_time_zone`, with its daylight saving time rules.
+
+    Args:
+        time_zone (str): Time zone of the time of the day.
+        second_of_day (int): Time of the day, in seconds since midnight.
+        now (float): Reference time, in seconds since the epoch.
+        store_id (int): Store of the product, for local times.
+
+    Returns:
+        int: First instant strictly after `now`, in seconds since the epoch.
+    """
+    return _zone_fire_time(
+        release_time.resolve_time_zone(time_zone, store_id), second_of_day,
+        now)
+
+
+def _zone_fire_time(tz, second_of_day, now):
+    """Get the next instant a time of the day happens in a resolved zone."""
+    if tz is pytz.utc:
+        fire_at = int(now) - int(now) % SECONDS_PER_DAY + second_of_day
+        if fire_at <= now:
+            fire_at += SECONDS_PER_DAY
+        return fire_at
+
+    return int(release_time.compute_zone_next_releases(
+        tz, numpy.array([second_of_day]), now)[0])
+
+
+class ReleaseScheduler:
+    """Heap of release events fired at the time of day of each product."""
+
+    def __init__(self, callback, clock=None):
+        """Create an empty scheduler.
+
+        Args:
+            callback (func): Called with the product id and the fire instant
+                (seconds since the epoch) of every release event.
+            clock (SystemClock): Clock giving the time and waiting.
+        """
+        self.callback = callback
+        self.clock = clock or SystemClock()
+        self.fired_count = 0
+        self._heap = []
+        self._schedules = {}
+        self._zones = []
+        self._zone_codes = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def __len__(self):
+        """Return the number of scheduled products."""
+        return len(self._schedules)
+
+    def load(self, products):
+        """Replace all the schedules.
+
+        Args:
+            products (iterable): Product live time dicts.
+        """
+        now = self.clock.now()
+        product_ids = []
+        zone_codes = []
+        seconds_of_day = []
+        for product in products:
+            if not _fits(product['product_id']):
+                continue
+            zone_code, second_of_day = self._encode_product(product)
+            product_ids.append(product['product_id'])
+            zone_codes.append(zone_code)
+            seconds_of_day.append(second_of_day)
+
+        # Fire instants are computed in one batch per time zone.
+        zone_codes = numpy.array(zone_codes, dtype=numpy.int32)
+        seconds_of_day = numpy.array(seconds_of_day, dtype=numpy.int64)
+        fire_ats = numpy.empty(len(product_ids), dtype=numpy.int64)
+        for zone_code in numpy.unique(zone_codes).tolist():
+            selected = zone_codes == zone_code
+            fire_ats[selected] = release_time.compute_zone_next_releases(
+                self._zones[zone_code], seconds_of_day[selected], now)
+
+        schedules = {
+            product_id: _pack_schedule(zone_code, fire_at, second_of_day)
+            for product_id, zone_code, fire_at, second_of_day in zip(
+                product_ids, zone_codes.tolist(), fire_ats.tolist(),
+                seconds_of_day.tolist())}
+        heap = [
+            _pack_heap_entry(_unpack_fire_at(schedule), product_id)
+            for product_id, schedule in schedules.items()]
+        heapq.heapify(heap)
+
+        with self._condition:
+            self._schedules = schedules
+            self._heap = heap
+            self._condition.notify()
+
+    def apply(self, product):
+        """Schedule a new product, or reschedule an existing one.
+
+        Args:
+            product (dict): Product live time dict.
+        """
+        product_id = product['product_id']
+        if not _fits(product_id):
+            return
+        with self._condition:
+            zone_code, second_of_day = self._encode_product(product)
+            schedule = self._schedules.get(product_id)
+            # An unchanged product keeps its pending instant, which may be
+            # due and not fired yet.
+            if schedule is not None and \
+                    _unpack_zone_code(schedule) == zone_code and \
+                    _unpack_second_of_day(schedule) == second_of_day:
+                return
+
+            fire_at = _zone_fire_time(
+                self._zones[zone_code], second_of_day, self.clock.now())
+            self._schedules[product_id] = _pack_schedule(
+                zone_code, fire_at, second_of_day)
+            self._push(fire_at, product_id)
+            self._condition.notify()
+
+    def remove(self, product_id):
+        """Unschedule a product, if scheduled.
+
+        Args:
+            product_id (int): Product id to unschedule.
+        """
+        with self._condition:
+            if self._schedules.pop(product_id, None) is not None:
+                self._compact_if_needed()
+
+    def sync(self, products):
+        """Apply a snapshot of all the products, only touching the changes.
+
+        Products missing from the snapshot are unscheduled, and only the
+        products whose time of day or time zone changed are rescheduled.
+
+        Args:
+            products (iterable): Product live time dicts.
+        """
+        seen_product_ids = set()
+        for product in products:
+            seen_product_ids.add(product['product_id'])
+            self.apply(product)
+
+        for product_id in list(self._schedules):
+            if product_id not in seen_product_ids:
+                self.remove(product_id)
+
+    def on_products_changed(self, product_ids):
+        """Read changed products again and apply them.
+
+        Meant to be registered as a change listener of the model.
+
+        Args:
+            product_ids (list): Product ids that changed.
+        """
+        for start in range(
+                0, len(product_ids), config.BATCH_QUERY_CHUNK_SIZE):
+            chunk = product_ids[start:start + config.BATCH_QUERY_CHUNK_SIZE]
+            batch_response = \
+                product_live_time.get_product_live_time_details_batch(chunk)
+            if not batch_response:
+                logger.error('Could not read changed products %s', chunk)
+                continue
+
+            for product in batch_response.message['products'].values():
+                self.apply(product)
+            for product_id in batch_response.message['missing']:
+                self.remove(product_id)
+
+    def seconds_until_next(self):
+        """Get the time to wait until the next release event.
+
+        Returns:
+            float: Seconds until the next event, None if nothing is scheduled.
+        """
+        with self._condition:
+            self._drop_stale_entries()
+            if not self._heap:
+                return None
+            return max(0, _unpack_heap_fire_at(self._heap[0]) -
+                       self.clock.now())
+
+    def run_pending(self):
+        """Fire the release events that are due, and re-arm them.
+
+        Returns:
+            int: Number of release events fired.
+        """
+        fired = []
+        with self._condition:
+            now = self.clock.now()
+            while self._heap and _unpack_heap_fire_at(self._heap[0]) <= now:
+                entry = heapq.heappop(self._heap)
+                product_id = _unpack_product_id(entry)
+                fire_at = _unpack_heap_fire_at(entry)
+                schedule = self._schedules.get(product_id)
+                if schedule is None or _unpack_fire_at(schedule) != fire_at:
+                    continue
+
+                zone_code = _unpack_zone_code(schedule)
+                second_of_day = _unpack_second_of_day(schedule)
+                next_fire_at = _zone_fire_time(
+                    self._zones[zone_code], second_of_day,
+                    max(now, fire_at))
+                self._schedules[product_id] = _pack_schedule(
+                    zone_code, next_fire_at, second_of_day)
+                self._push(next_fire_at, product_id)
+                fired.append((product_id, fire_at))
+
+        for product_id, fire_at in fired:
+            try:
+                self.callback(product_id, fire_at)
+            except Exception:
+                logger.exception(
+                    'Release callback failed for product %s', product_id)
+        self.fired_count += len(fired)
+        return len(fired)
+
+    def run(self):
+        """Fire the release events as they are due, until stopped."""
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+            self.run_pending()
+            with self._condition:
+                if self._stopping:
+                    return
+                self.clock.wait(self._condition, self.seconds_until_next())
+
+    def start(self):
+        """Run the scheduler in a daemon thread."""
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self.run, name='release-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the scheduler thread.
+
+        Args:
+            timeout (float): Maximum time to wait for the thread to stop.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _encode_product(self, product):
+        """Get the time zone code and the time of the day of a product.
+
+        Codes are given to the time zones the products resolve to, so that
+        local products of stores in the same time zone share a code.
+        """
+        tz = release_time.resolve_time_zone(
+            product['time_zone'], product.get('store_id'))
+        zone_code = self._zone_codes.get(tz)
+        if zone_code is None:
+            zone_code = len(self._zones)
+            self._zones.append(tz)
+            self._zone_codes[tz] = zone_code
+
+        second_of_day = engine.parse_time(product['time_of_day_product'])
+        return zone_code, second_of_day
+
+    def _push(self, fire_at, product_id):
+        """Push a heap entry, the lock being held."""
+        heapq.heappush(self._heap, _pack_heap_entry(fire_at, product_id))
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        """Rebuild the heap when stale entries outnumber the live ones."""
+        if len(self._heap) <= 2 * len(self._schedules) + 1024:
+            return
+
+        self._heap = [
+            _pack_heap_entry(_unpack_fire_at(schedule), product_id)
+            for product_id, schedule in self._schedules.items()]
+        heapq.heapify(self._heap)
+
+    def _drop_stale_entries(self):
+        """Pop the stale entries from the top of the heap."""
+        while self._heap:
+            entry = self._heap[0]
+            schedule = self._schedules.get(_unpack_product_id(entry))
+            if schedule is not None and \
+                    _unpack_fire_at(schedule) == _unpack_heap_fire_at(entry):
+                return
+            heapq.heappop(self._heap)
+
+
+def serve(callback, sync_seconds=None):
+    """Schedule all the product live times and fire them until interrupted.
+
+    Writes made by this process are applied as they are committed. Writes
+    made by the other processes are picked up by syncing with the table
+    every `sync_seconds`, which only reschedules the products that changed.
+
+    Args:
+        callback (func): Called with the product id and the fire instant of
+            every release event.
+        sync_seconds (float): Time between two syncs, defaults to
+            `config.SCHEDULER_SYNC_SECONDS`.
+    """
+    sync_seconds = sync_seconds or config.SCHEDULER_SYNC_SECONDS
+    release_scheduler = ReleaseScheduler(callback)
+    release_scheduler.load(product_live_time.iter_product_live_times())
+    logger.info('Scheduled %s products', len(release_scheduler))
+
+    product_live_time.add_change_listener(
+        release_scheduler.on_products_changed)
+    release_scheduler.start()
+    try:
+        while True:
+            time.sleep(sync_seconds)
+            release_scheduler.sync(product_live_time.iter_product_live_times())
+    finally:
+        product_live_time.remove_change_listener(
+            release_scheduler.on_products_changed)
+        release_scheduler.stop()
+
+
+def log_release(product_id, fire_at):
+    """Release callback logging the release events.
+
+    Args:
+        product_id (int): Product id going live.
+        fire_at (int): Instant of the release, in seconds since the epoch.
+    """
+    logger.info('Product %s goes live at %s', product_id, time.strftime(
+        '%Y-%m-%dT%H:%M:%SZ', time.gmtime(fire_at)))
+
+
+def _fits(product_id):
+    """Check that a product id can be packed, logging the ones that cannot.
+
+    Args:
+        product_id (int): Product id to schedule.
+
+    Returns:
+        bool: True if the product id fits in `PRODUCT_ID_BITS`.
+    """
+    if 0 <= product_id <= MAX_PRODUCT_ID:
+        return True
+    logger.warning('Product id %s cannot be scheduled', product_id)
+    return False
+
+
+def _pack_schedule(zone_code, fire_at, second_of_day):
+    """Pack the schedule of a product into one integer."""
+    return (zone_code << (FIRE_AT_BITS + SECOND_OF_DAY_BITS) |
+            fire_at << SECOND_OF_DAY_BITS | second_of_day)
+
+
+def _unpack_zone_code(schedule):
+    """Get the time zone code of a packed schedule."""
+    return schedule >> (FIRE_AT_BITS + SECOND_OF_DAY_BITS)
+
+
+def _unpack_fire_at(schedule):
+    """Get the next fire instant of a packed schedule."""
+    return schedule >> SECOND_OF_DAY_BITS & ((1 << FIRE_AT_BITS) - 1)
+
+
+def _unpack_second_of_day(schedule):
+    """Get the time of the day of a packed schedule."""
+    return schedule & ((1 << SECOND_OF_DAY_BITS) - 1)
+
+
+def _pack_heap_entry(fire_at, product_id):
+    """Pack a fire instant and a product id into a heap entry."""
+    return fire_at << PRODUCT_ID_BITS | product_id
+
+
+def _unpack_heap_fire_at(entry):
+    """Get the fire instant of a heap entry."""
+    return entry >> PRODUCT_ID_BITS
+
+
+def _unpack_product_id(entry):
+    """Get the product id of a heap entry."""
+    return entry & ((1 << PRODUCT_ID_BITS) - 1)
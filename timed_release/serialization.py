@@ -0,0 +1,39 @@
+"""JSON serialization of product live times.
+
+Encodes the responses of the product reads directly from the product live
+time records, reusing the JSON each record encodes once, instead of building
+dicts for `json.dumps`.
+"""
+
+import json
+
+
+def encode_product(product):
+    """Encode a product live time as a JSON object.
+
+    Args:
+        product (ProductLiveTimeRecord|dict): Product live time.
+
+    Returns:
+        str: The JSON object.
+    """
+    to_json = getattr(product, 'to_json', None)
+    if to_json is None:
+        return json.dumps(product)
+    return to_json()
+
+
+def encode_product_batch(batch):
+    """Encode a batch of product live times as a JSON object.
+
+    Args:
+        batch (dict): found products keyed by product id and missing ids.
+
+    Returns:
+        str: The JSON object.
+    """
+    products = ', '.join(
+        '{}: {}'.format(json.dumps(product_id), encode_product(product))
+        for product_id, product in batch['products'].items())
+    return '{{"products": {{{}}}, "missing": {}}}'.format(
+        products, json.dumps(batch['missing']))
@@ -0,0 +1,260 @@
+"""Request Tracing.
+
+Breaks the time of each request down by layer: the request hooks of
+owsrequest and owslogger, the handler, the logic, the validation, the model
+and the SQL queries. Layers are timed by `traced` decorators and `span`
+blocks, SQL queries by the cursor events of the engines given to `watch`.
+The time of a layer is counted once when its spans are nested, and `hooks`
+is the time of the request outside its handler.
+
+With `config.TRACING_ENABLED`, the breakdown of each request is sent in its
+`Server-Timing` header, in milliseconds, and a sample of
+`config.TRACING_SAMPLE_RATE` of the requests is added to the
+`timed_release_span_duration_seconds` histogram of the metrics.
+
+Spans only look at a thread local attribute when no request is traced, and
+add a few microseconds otherwise. Queries run in the threads of
+`sql.scatter` are counted in the span of their caller, not as SQL.
+
+Usage:
+    @traced('logic')
+    def get_product(product_id):
+        with span('validation'):
+            ...
+"""
+
+import functools
+import random
+import threading
+import time
+
+import flask
+from sqlalchemy import event
+
+from timed_release import config
+from timed_release import metrics
+
+
+# Layers of the breakdown, in the order of the Server-Timing header
+LAYERS = ('hooks', 'handler', 'logic', 'validation', 'model', 'sql')
+
+span_duration = metrics.Histogram(
+    'timed_release_span_duration_seconds',
+    'Time of the sampled requests spent in each layer.', ('layer',),
+    metrics.REQUEST_BUCKETS)
+
+
+class Trace:
+    """Time spent in each layer by a request."""
+
+    __slots__ = ('started', 'durations', 'counts', 'active')
+
+    def __init__(self):
+        """Start a trace."""
+        self.started = time.perf_counter()
+        self.durations = dict.fromkeys(LAYERS, 0.0)
+        self.counts = dict.fromkeys(LAYERS, 0)
+        self.active = set()
+
+    def add(self, layer, seconds):
+        """Add the time of a span.
+
+        Args:
+            layer (str): Layer of the span.
+            seconds (float): Time of the span.
+        """
+        self.durations[layer] += seconds
+        self.counts[layer] += 1
+
+    def server_timing(self, total):
+        """Format the breakdown as a Server-Timing header.
+
+        Args:
+            total (float): Time of the request, in seconds.
+
+        Returns:
+            str: Value of the header.
+        """
+        timings = [
+            '{};dur={:.3f}'.format(layer, self.durations[layer] * 1000)
+            for layer in LAYERS if self.counts[layer]]
+        if self.counts['sql']:
+            timings[-1] += ';desc="{} queries"'.format(self.counts['sql'])
+        timings.append('total;dur={:.3f}'.format(total * 1000))
+        return ', '.join(timings)
+
+
+class _Local(threading.local):
+    """Trace of the request of the thread, None outside traced requests."""
+
+    trace = None
+
+
+_local = _Local()
+
+
+def current_trace():
+    """Get the trace of the request of the thread.
+
+    Returns:
+        Trace: The trace, or None outside traced requests.
+    """
+    return _local.trace
+
+
+class span:
+    """Block of code timed as part of a layer.
+
+    Usage:
+        with span('validation'):
+            errors = validate(record)
+    """
+
+    __slots__ = ('layer', '_trace', '_started')
+
+    def __init__(self, layer):
+        """Create a span.
+
+        Args:
+            layer (str): One of `LAYERS`.
+        """
+        self.layer = layer
+        self._trace = None
+
+    def __enter__(self):
+        """Start timing, unless the layer is already timed."""
+        trace = _local.trace
+        if trace is not None and self.layer not in trace.active:
+            trace.active.add(self.layer)
+            self._trace = trace
+            self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Add the time of the block to its layer."""
+        trace = self._trace
+        if trace is not None:
+            trace.add(self.layer, time.perf_counter() - self._started)
+            trace.active.discard(self.layer)
+            self._trace = None
+
+
+def traced(layer):
+    """Time the calls of a function as part of a layer.
+
+    Generators are timed until they are created, not while they are
+    iterated.
+
+    Args:
+        layer (str): One of `LAYERS`.
+
+    Returns:
+        func: Decorator of the function.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def call_traced_function(*args, **kwargs):
+            trace = _local.trace
+            if trace is None or layer in trace.active:
+                return function(*args, **kwargs)
+            trace.active.add(layer)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                trace.add(layer, time.perf_counter() - started)
+                trace.active.discard(layer)
+        return call_traced_function
+    return decorator
+
+
+def init_app(app):
+    """Trace the requests of an app, with `config.TRACING_ENABLED`.
+
+    Must be called once every other request hook is registered: the trace
+    starts before the other `before_request` hooks and ends after the other
+    `after_request` hooks, while the handler span only covers the view.
+
+    Args:
+        app (flask.Flask): Application to set up.
+    """
+    if not config.TRACING_ENABLED:
+        return
+    before_request = app.before_request_funcs.setdefault(None, [])
+    before_request.insert(0, _start_trace)
+    before_request.append(_start_handler)
+    after_request = app.after_request_funcs.setdefault(None, [])
+    # After request hooks run from the last registered to the first one.
+    after_request.insert(0, _finish_trace)
+    after_request.append(_finish_handler)
+    app.teardown_request(_clear_trace)
+
+
+def watch(engine):
+    """Time the SQL queries of an engine in the traced requests.
+
+    Args:
+        engine (Engine): Engine to watch.
+    """
+    event.listen(engine, 'before_cursor_execute', _start_query)
+    event.listen(engine, 'after_cursor_execute', _finish_query)
+
+
+def _start_trace():
+    """Start the trace of the request."""
+    _local.trace = Trace()
+
+
+def _start_handler():
+    """Start timing the handler, once the other hooks ran."""
+    trace = _local.trace
+    if trace is not None:
+        trace.active.add('handler')
+        flask.g.trace_handler_started = time.perf_counter()
+
+
+def _finish_handler(flask_response):
+    """Stop timing the handler, before the other hooks run."""
+    trace = _local.trace
+    started = getattr(flask.g, 'trace_handler_started', None)
+    if trace is not None and started is not None:
+        trace.add('handler', time.perf_counter() - started)
+        trace.active.discard('handler')
+    return flask_response
+
+
+def _finish_trace(flask_response):
+    """Send the breakdown of the request, and sample it in the metrics."""
+    trace = _local.trace
+    if trace is None:
+        return flask_response
+
+    total = time.perf_counter() - trace.started
+    trace.add('hooks', max(total - trace.durations['handler'], 0.0))
+    flask_response.headers['Server-Timing'] = trace.server_timing(total)
+    if random.random() < config.TRACING_SAMPLE_RATE:
+        for layer in LAYERS:
+            if trace.counts[layer]:
+                span_duration.observe(trace.durations[layer], (layer,))
+    return flask_response
+
+
+def _clear_trace(exception):
+    """Stop tracing once the request is over."""
+    _local.trace = None
+
+
+def _start_query(connection, cursor, statement, parameters, context,
+                 executemany):
+    """Start timing the query of a traced request."""
+    if _local.trace is not None and context is not None:
+        context.trace_started = time.perf_counter()
+
+
+def _finish_query(connection, cursor, statement, parameters, context,
+                  executemany):
+    """Add the time of the query to the trace of its request."""
+    trace = _local.trace
+    started = getattr(context, 'trace_started', None)
+    if trace is not None and started is not None:
+        trace.add('sql', time.perf_counter() - started)
@@ -0,0 +1,289 @@
+"""Columnar validation.
+
+Validates large batches of timed releases given as columns, one array per
+field, with NumPy operations over whole columns instead of one record at a
+time. The result is an error mask per row, made of the `ERROR_*` flags, and
+`describe_errors` turns the mask of a row into the errors
+`validators.validate_timed_release_dataset` reports for the same record.
+
+Integer columns are fastest as integer arrays, and time columns as string
+arrays. Lists are turned into such arrays when all their values have the same
+type, and into arrays of Python objects otherwise, `None` being a missing
+value.
+
+Usage:
+    row_errors = validate_columns({
+        'product_id': product_ids,
+        'time_of_day_product': times,
+        'time_zone': time_zones,
+        'store_id': store_ids}, TIMED_RELEASE_REQUIRED_FIELDS)
+    for row in numpy.flatnonzero(row_errors):
+        errors = describe_errors(row_errors[row], ..., product_ids[row])
+"""
+
+import numpy
+
+from timed_release import config
+from timed_release.constants import error
+from timed_release.validation import engine
+
+
+ERROR_MISSING_PRODUCT_ID = 1 << 0
+ERROR_MISSING_TIME = 1 << 1
+ERROR_MISSING_TIME_ZONE = 1 << 2
+ERROR_MISSING_STORE_ID = 1 << 3
+ERROR_INVALID_PRODUCT_ID = 1 << 4
+ERROR_INVALID_STORE_ID = 1 << 5
+ERROR_INVALID_TIME = 1 << 6
+ERROR_INVALID_TIME_ZONE = 1 << 7
+ERROR_DUPLICATED_PRODUCT_ID = 1 << 8
+
+# Validated fields and the flag raised when they are required but missing
+FIELD_MISSING_ERRORS = (
+    ('product_id', ERROR_MISSING_PRODUCT_ID),
+    ('time_of_day_product', ERROR_MISSING_TIME),
+    ('time_zone', ERROR_MISSING_TIME_ZONE),
+    ('store_id', ERROR_MISSING_STORE_ID))
+
+# Positions of the digits and of the colons in a HH:MM:SS time
+_TIME_DIGITS = [0, 1, 3, 4, 6, 7]
+_TIME_COLONS = [2, 5]
+
+
+def validate_columns(columns, required_fields, check_duplicates=True):
+    """Validate timed releases given as columns.
+
+    Args:
+        columns (dict): Array or list of values of each validated field, all
+            of the same length. Missing columns are empty.
+        required_fields (iterable): Fields that must be present and not empty,
+            among the validated ones.
+        check_duplicates (bool): Flag the rows repeating the product id of a
+            previous valid row.
+
+    Returns:
+        numpy.ndarray: Error flags of each row, 0 when the row is valid.
+
+    Raises:
+        ValueError: when the columns do not have the same length, or when
+        a required field is not validated.
+    """
+    validated_fields = [field for field, _ in FIELD_MISSING_ERRORS]
+    unknown_fields = set(required_fields).difference(validated_fields)
+    if unknown_fields:
+        raise ValueError('Fields {} cannot be validated as columns'.format(
+            ', '.join(sorted(unknown_fields))))
+
+    lengths = set(len(values) for values in columns.values())
+    if len(lengths) > 1:
+        raise ValueError('Columns must have the same length')
+    count = lengths.pop() if lengths else 0
+
+    values = {
+        field: _to_column(columns[field]) if field in columns else
+        numpy.zeros(count, dtype=numpy.int64)
+        for field in validated_fields}
+    present = {
+        field: _present(values[field]) for field in validated_fields}
+
+    row_errors = numpy.zeros(count, dtype=numpy.uint16)
+    for field, missing_error in FIELD_MISSING_ERRORS:
+        if field in required_fields:
+            row_errors[~present[field]] |= missing_error
+
+    row_errors[present['product_id'] & ~_positive_integers(
+        values['product_id'])] |= ERROR_INVALID_PRODUCT_ID
+    row_errors[present['store_id'] & ~_positive_integers(
+        values['store_id'])] |= ERROR_INVALID_STORE_ID
+    row_errors[present['time_of_day_product'] & ~_valid_times(
+        values['time_of_day_product'], present['time_of_day_product'])] |= \
+        ERROR_INVALID_TIME
+    row_errors[present['time_zone'] & ~_valid_time_zones(
+        values['time_zone'])] |= ERROR_INVALID_TIME_ZONE
+
+    if check_duplicates:
+        candidates = numpy.flatnonzero(
+            (row_errors == 0) & present['product_id'])
+        _, first_positions = numpy.unique(
+            values['product_id'][candidates], return_index=True)
+        duplicated = numpy.ones(len(candidates), dtype=bool)
+        duplicated[first_positions] = False
+        row_errors[candidates[duplicated]] |= ERROR_DUPLICATED_PRODUCT_ID
+
+    return row_errors
+
+
+def describe_errors(row_error, required_fields, product_id=None):
+    """Describe the error flags of a row.
+
+    Args:
+        row_error (int): Error flags of the row.
+        required_fields (iterable): Required fields given to
+            `validate_columns`.
+        product_id (int): Product id of the row, for duplicates.
+
+    Returns:
+        list: The errors of the row, as reported for a single record.
+    """
+    validation_errors = []
+    missing_errors = dict(FIELD_MISSING_ERRORS)
+    missing_fields = [
+        field for field in required_fields
+        if row_error & missing_errors[field]]
+    if missing_fields:
+        validation_errors.append({'missing mandatory fields': missing_fields})
+
+    invalid_integer_fields = [
+        field for field, invalid_error in (
+            ('product_id', ERROR_INVALID_PRODUCT_ID),
+            ('store_id', ERROR_INVALID_STORE_ID))
+        if row_error & invalid_error]
+    if invalid_integer_fields:
+        validation_errors.append(
+            {'non integer or negative fields list': invalid_integer_fields})
+
+    if row_error & ERROR_INVALID_TIME:
+        validation_errors.append(
+            {'invalid time zone': error.ERROR_MESSAGE_TIME_OF_DAY_RELEASE})
+
+    if row_error & ERROR_INVALID_TIME_ZONE:
+        validation_errors.append(
+            {'invalid time format': error.ERROR_MESSAGE_TIME_ZONE})
+
+    if row_error & ERROR_DUPLICATED_PRODUCT_ID:
+        validation_errors.append({
+            'duplicate product id':
+                error.ERROR_MESSAGE_DUPLICATED_PRODUCT_ID.format(product_id)})
+
+    return validation_errors
+
+
+def _to_column(values):
+    """Turn the values of a field into an array.
+
+    Lists of integers or of strings become typed arrays, the others object
+    arrays keeping every value as it is, rather than converting them to a
+    common type as `numpy.asarray` does. Strings ending with NUL characters,
+    which string arrays drop, also make object arrays.
+
+    Args:
+        values (numpy.ndarray|list): Values of the field.
+
+    Returns:
+        numpy.ndarray: Column.
+    """
+    if isinstance(values, numpy.ndarray):
+        return values
+
+    types = set(map(type, values))
+    if types == {int}:
+        try:
+            return numpy.array(values, dtype=numpy.int64)
+        except OverflowError:
+            pass
+    elif types == {str}:
+        column = numpy.array(values, dtype=str)
+        if numpy.array_equal(
+                numpy.char.str_len(column), list(map(len, values))):
+            return column
+
+    column = numpy.empty(len(values), dtype=object)
+    for row, value in enumerate(values):
+        column[row] = value
+    return column
+
+
+def _present(values):
+    """Get the rows with a value, empty values being missing.
+
+    Args:
+        values (numpy.ndarray): Column.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the rows with a value.
+    """
+    if values.dtype.kind in 'US':
+        return numpy.char.str_len(values) > 0
+    return values.astype(bool)
+
+
+def _positive_integers(values):
+    """Get the rows holding integers greater than zero.
+
+    Args:
+        values (numpy.ndarray): Column.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the valid rows.
+    """
+    if values.dtype.kind in 'iub':
+        return values > 0
+    if values.dtype.kind != 'O':
+        return numpy.zeros(len(values), dtype=bool)
+
+    valid = _is_integer(values).astype(bool)
+    valid[valid] = values[valid] > 0
+    return valid
+
+
+def _valid_times(values, present):
+    """Get the rows holding valid times of the day.
+
+    HH:MM:SS strings are checked on their characters. The other present
+    rows, with one digit fields or that are not strings, are parsed one by
+    one.
+
+    Args:
+        values (numpy.ndarray): Column.
+        present (numpy.ndarray): Boolean mask of the rows with a value.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the valid rows.
+    """
+    valid = numpy.zeros(len(values), dtype=bool)
+    if values.dtype.kind in 'USO':
+        if values.dtype.kind == 'O':
+            # Values that are not strings, or that a string array would
+            # truncate, are parsed one by one.
+            strings = numpy.array([
+                value if isinstance(value, str) and
+                not value.endswith('\x00') else ''
+                for value in values], dtype=str)
+        else:
+            strings = values.astype(str)
+        rows = numpy.flatnonzero(numpy.char.str_len(strings) == 8)
+        characters = strings[rows].astype('U8').view(
+            numpy.uint32).reshape(-1, 8).astype(numpy.int64)
+        digits = characters[:, _TIME_DIGITS] - ord('0')
+        hours = digits[:, 0] * 10 + digits[:, 1]
+        minutes = digits[:, 2] * 10 + digits[:, 3]
+        seconds = digits[:, 4] * 10 + digits[:, 5]
+        valid[rows] = (
+            ((digits >= 0) & (digits <= 9)).all(axis=1) &
+            (characters[:, _TIME_COLONS] == ord(':')).all(axis=1) &
+            (hours < 24) & (minutes < 60) & (seconds < 60))
+
+    for row in numpy.flatnonzero(present & ~valid):
+        valid[row] = engine.parse_time(values[row]) is not None
+    return valid
+
+
+def _valid_time_zones(values):
+    """Get the rows holding one of `config.TIME_ZONES`.
+
+    Args:
+        values (numpy.ndarray): Column.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the valid rows.
+    """
+    valid = numpy.zeros(len(values), dtype=bool)
+    if values.dtype.kind not in 'USO':
+        return valid
+    for time_zone in config.TIME_ZONES:
+        valid |= values == time_zone
+    return valid
+
+
+# Whether each value of an object column is an int
+_is_integer = numpy.frompyfunc(lambda value: isinstance(value, int), 1, 1)
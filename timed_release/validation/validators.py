@@ -1,24 +1,32 @@
 """Validations for timed release module."""
 
-import datetime
+import numpy
 
 from timed_release import config
+from timed_release import tracing
 from timed_release.constants import error
+from timed_release.validation import columnar
+from timed_release.validation import engine
+
+
+# Fields required to create a timed release
+TIMED_RELEASE_REQUIRED_FIELDS = (
+    'product_id', 'time_of_day_product', 'time_zone')
+
+# Digits of the integers of requests: str.isdigit also accepts Unicode digits,
+# such as '²', that int() rejects.
+ASCII_DIGITS = frozenset('0123456789')
 
 
 def validate_time(time_value):
     """Validate given time in HH:MM:SS format.
 
     Args:
-        time_value (str): time to validate
+        time_value (str|datetime.time): time to validate
     Returns:
         return boolean true if valid time match with time format else false
     """
-    try:
-        datetime.datetime.strptime(time_value, config.DEFAULT_TIME_FORMAT)
-        return True
-    except ValueError:
-        return False
+    return engine.parse_time(time_value) is not None
 
 
 def is_integer_and_non_negative(value):
@@ -63,47 +71,81 @@ def validate_time_zone(time_zone):
     return False
 
 
+@tracing.traced('validation')
 def validate_timed_release_dataset(data, required_fields):
     """Validate an incoming dataset.
 
+    The rules are compiled once per list of required fields, see
+    `engine.compile_rules`.
+
     Args:
         data (dict): the dataset to validate.
         required_fields (list): list of required fields.
     Returns:
-        Response: with the result of the operation and a clean dataset.
+        list: validation errors, empty when the dataset is valid.
     """
-    validation_errors = []
-    integer_and_non_negative_check_fields = ['product_id', 'store_id']
+    return engine.compile_rules(required_fields)(data)
 
-    # check for mandatory_fields
-    mandatory_fields_validation = mandatory_fields(data, required_fields)
-    if mandatory_fields_validation:
-        field = {'missing mandatory fields': mandatory_fields_validation}
-        validation_errors.append(field)
 
-    # check for product_id and store_id is integer and
-    # greater than zero
-    integer_and_non_negative = [
-        field for field in integer_and_non_negative_check_fields
-        if data.get(field) and not is_integer_and_non_negative(data[field])]
+def validate_timed_release_columns(columns, required_fields):
+    """Validate a large batch of datasets given as columns.
 
-    if integer_and_non_negative:
-        fields = {
-            'non integer or negative fields list': integer_and_non_negative}
-        validation_errors.append(fields)
+    Args:
+        columns (dict): Array of values of each field, see
+            `columnar.validate_columns`.
+        required_fields (list): list of required fields.
+    Returns:
+        numpy.ndarray: error flags of each row, 0 when the row is valid.
+        `columnar.describe_errors` gives the validation errors of a row.
+    """
+    return columnar.validate_columns(columns, required_fields)
 
-    # validate time_of_day_product
-    if data.get('time_of_day_product') and \
-            not validate_time(data['time_of_day_product']):
-        field = {'invalid time zone': error.ERROR_MESSAGE_TIME_OF_DAY_RELEASE}
-        validation_errors.append(field)
 
-    # check time zone is local or GMT
-    if data.get('time_zone') and not validate_time_zone(data['time_zone']):
-        field = {'invalid time format': error.ERROR_MESSAGE_TIME_ZONE}
-        validation_errors.append(field)
+@tracing.traced('validation')
+def validate_timed_release_records(records, required_fields,
+                                   check_duplicates=False):
+    """Validate a batch of datasets.
 
-    return validation_errors
+    Batches of `config.COLUMNAR_VALIDATION_MIN_RECORDS` records or more are
+    validated as columns, see `columnar.validate_columns`, and the smaller
+    ones one record at a time. Both report the errors of
+    `validate_timed_release_dataset`.
+
+    Args:
+        records (list): Datasets (dict) to validate.
+        required_fields (list): list of required fields.
+        check_duplicates (bool): Report the records repeating the product id
+            of a previous valid record.
+    Returns:
+        list: validation errors of each record, empty when it is valid.
+    """
+    if len(records) >= config.COLUMNAR_VALIDATION_MIN_RECORDS:
+        row_errors = columnar.validate_columns({
+            field: [record.get(field) for record in records]
+            for field, _ in columnar.FIELD_MISSING_ERRORS},
+            required_fields, check_duplicates)
+        record_errors = [[] for _ in records]
+        for row in numpy.flatnonzero(row_errors).tolist():
+            record_errors[row] = columnar.describe_errors(
+                int(row_errors[row]), required_fields,
+                records[row].get('product_id'))
+        return record_errors
+
+    validate = engine.compile_rules(required_fields)
+    record_errors = []
+    seen_product_ids = set()
+    for record in records:
+        validation_errors = validate(record)
+        if check_duplicates and not validation_errors:
+            product_id = record.get('product_id')
+            if product_id in seen_product_ids:
+                validation_errors = [{
+                    'duplicate product id':
+                        error.ERROR_MESSAGE_DUPLICATED_PRODUCT_ID.format(
+                            product_id)}]
+            seen_product_ids.add(product_id)
+        record_errors.append(validation_errors)
+    return record_errors
 
 
 def is_digit_and_non_zero(value):
@@ -115,6 +157,6 @@ def is_digit_and_non_zero(value):
     Returns:
         Boolean: True if value is integer and greater than zero else False.
     """
-    if not value.isdigit() or int(value) <= 0:
+    if not value or not ASCII_DIGITS.issuperset(value) or int(value) <= 0:
         return False
     return True